@@ -0,0 +1,232 @@
+"""
+Admin commands
+
+Commands for inspecting and maintaining the game's in-memory caches
+and indexes.
+
+"""
+from django.utils.six import text_type
+from twisted.internet import reactor
+from evennia.objects.models import ObjectDB
+from evennia.utils.evtable import EvTable
+from commands.command import MuxCommand
+from world.lazyimport import lazy_import
+
+oob = lazy_import("world.oob")
+rooms = lazy_import("typeclasses.rooms")
+serializer = lazy_import("world.serializer")
+statuspush = lazy_import("world.statuspush")
+zones = lazy_import("world.zones")
+
+
+class CmdCheckIndex(MuxCommand):
+    """
+    compare room contents indexes with the database
+
+    Usage:
+      @checkindex [<room>]
+      @checkindex/all
+
+    Switches:
+      all - check every room that currently has an index.
+
+    Compares the in-memory contents index of a room (its exits,
+    puppeted objects and other objects) with what is stored in the
+    database. Rooms with differences get their index rebuilt. Without
+    an argument, checks your current location.
+    """
+    key = "@checkindex"
+    locks = "cmd:perm(checkindex) or perm(Builder)"
+    help_category = "Building"
+
+    def func(self):
+        """Implements the command"""
+        caller = self.caller
+
+        if "all" in self.switches:
+            rooms = [obj for obj in ObjectDB.get_all_cached_instances()
+                     if isinstance(obj, rooms.Room) and obj.ndb._contents_index is not None]
+        elif self.args:
+            room = caller.search(self.args, global_search=True)
+            if not room:
+                return
+            rooms = [room]
+        else:
+            rooms = [caller.location]
+
+        nerrors = 0
+        for room in rooms:
+            if not isinstance(room, rooms.Room):
+                caller.msg("%s is not a Room." % room)
+                continue
+            errors = room.check_contents_index()
+            if errors:
+                nerrors += len(errors)
+                room.reset_contents_index()
+                caller.msg("|r%s (#%i): index rebuilt:|n\n  %s" % (
+                    room.key, room.id, "\n  ".join(errors)))
+        caller.msg("Checked %i room(s), found %i error(s)." % (len(rooms), nerrors))
+
+
+class CmdOOBStats(MuxCommand):
+    """
+    show statistics of the webclient's out-of-band messages
+
+    Usage:
+      @oobstats
+      @oobstats/reset
+
+    Switches:
+      reset - zero the statistics after showing them.
+
+    Shows, for each input function handling out-of-band messages (see
+    server/conf/inputfuncs.py), how often it was called, how many calls
+    were dropped by rate limiting or coalesced into later ones, how
+    many failed, and how long the calls took. Also shows how many
+    status changes were pushed to subscribed sessions.
+    """
+    key = "@oobstats"
+    locks = "cmd:perm(oobstats) or perm(Developer)"
+    help_category = "System"
+
+    def func(self):
+        """Implements the command"""
+        pushes = statuspush.stats()
+        pushed = ("Status push: %i changes noted, %i characters pushed (%i unchanged), "
+                  "%i messages with %i fields sent." % (
+                      pushes["marks"], pushes["pushes"], pushes["unchanged"],
+                      pushes["messages"], pushes["fields"]))
+        stats = oob.stats()
+        if not stats:
+            self.caller.msg("No out-of-band input functions are in use.\n" + pushed)
+            return
+        table = EvTable("|wfunction|n", "|wcalls|n", "|wdropped|n", "|wcoalesced|n",
+                        "|werrors|n", "|wmean ms|n", "|wms: calls|n", border="cells")
+        for name in sorted(stats):
+            funcstats = stats[name]
+            histogram = ", ".join("%s: %i" % ("<=%s" % bound if bound is not None else "more",
+                                              count)
+                                  for bound, count in funcstats["histogram"] if count)
+            table.add_row(name, funcstats["calls"], funcstats["dropped"],
+                          funcstats["coalesced"], funcstats["errors"],
+                          "%.3f" % funcstats["mean_ms"], histogram or "-")
+        self.caller.msg(text_type(table) + "\n" + pushed)
+        if "reset" in self.switches:
+            oob.reset_stats()
+            self.caller.msg("Statistics reset.")
+
+
+class CmdConvertAttrs(MuxCommand):
+    """
+    re-store Attribute values with another serializer
+
+    Usage:
+      @convertattrs [<serializer>]
+      @convertattrs/benchmark [<number of Attributes>]
+
+    Switches:
+      benchmark - compare the size and speed of the serializers on
+                  Attributes in the database, without changing them.
+
+    Converts all Attributes in the database to the given serializer
+    (default the one set by ATTRIBUTE_SERIALIZER, see
+    world/serializer.py). Attributes are read in any format, so this
+    can run while the game is up: it works through the database in
+    batches, letting the server do other things in between.
+    """
+    key = "@convertattrs"
+    locks = "cmd:perm(convertattrs) or perm(Developer)"
+    help_category = "System"
+    batch_size = 500
+
+    def func(self):
+        """Implements the command"""
+        caller = self.caller
+
+        if "benchmark" in self.switches:
+            limit = int(self.args) if self.args.isdigit() else 10000
+            result = serializer.benchmark(limit=limit)
+            table = EvTable("|wserializer|n", "|wbytes|n", "|wencode ms|n", "|wdecode ms|n",
+                            border="cells")
+            for name in sorted(key for key in result if key != "values"):
+                stats = result[name]
+                table.add_row(name, stats["bytes"], "%.1f" % stats["encode_ms"],
+                              "%.1f" % stats["decode_ms"])
+            caller.msg("%i Attribute values:\n%s" % (result["values"], text_type(table)))
+            return
+
+        name = self.args.strip() or None
+        if name and name != "pickle" and name not in serializer.serializers():
+            caller.msg("Unknown serializer '%s'." % name)
+            return
+        totals = [0, 0, 0]
+
+        def batch(after):
+            last, nread, nconverted, nfailed = serializer.convert(
+                name, after=after, limit=self.batch_size)
+            totals[0] += nread
+            totals[1] += nconverted
+            totals[2] += nfailed
+            if last is None:
+                caller.msg("Read %i Attributes, converted %i, %i could not be read." % tuple(totals))
+            else:
+                reactor.callLater(0, batch, last)
+
+        caller.msg("Converting Attributes to %s ..." % (name or "the configured serializer"))
+        batch(0)
+
+
+class CmdZones(MuxCommand):
+    """
+    show and manage the zones held in memory
+
+    Usage:
+      @zones
+      @zones/load <zone>
+      @zones/evict <zone>
+
+    Switches:
+      load  - load a zone's rooms and contents now.
+      evict - drop a zone from memory now, if nothing holds it.
+
+    Lists the zones (rooms tagged in the "zone" category, see
+    world/zones.py) loaded since the server started, with how many of
+    their objects are in memory, an estimate of the memory they use,
+    and how long no puppeted character has been in them. Idle zones
+    are evicted automatically after ZONE_IDLE_TIME seconds.
+    """
+    key = "@zones"
+    locks = "cmd:perm(zones) or perm(Developer)"
+    help_category = "System"
+
+    def func(self):
+        """Implements the command"""
+        caller = self.caller
+        name = self.args.strip()
+        if "load" in self.switches or "evict" in self.switches:
+            if not name:
+                caller.msg("Usage: @zones/%s <zone>" % self.switches[0])
+            elif "load" in self.switches:
+                caller.msg("Loaded %i objects of zone %s." % (zones.load(name), name))
+            elif zones.evict(name) is None:
+                held = zones.stats()["zones"].get(name, {}).get("held")
+                caller.msg("Zone %s was not evicted: %s." % (name, held or "it is not loaded"))
+            else:
+                caller.msg("Zone %s evicted." % name)
+            return
+
+        stats = zones.stats(with_memory=True)
+        if not stats["zones"]:
+            caller.msg("No zones have been loaded.")
+            return
+        table = EvTable("|wzone|n", "|wloaded|n", "|wrooms|n", "|wobjects|n", "|wKB|n",
+                        "|widle s|n", "|wloads|n", "|wevictions|n", "|wlast held by|n",
+                        border="cells")
+        for zone_name in sorted(stats["zones"]):
+            zone = stats["zones"][zone_name]
+            table.add_row(zone_name, "yes" if zone["loaded"] else "no", zone["rooms"],
+                          zone["objects"], zone["bytes"] // 1024, int(zone["idle"]),
+                          zone["loads"], zone["evictions"], zone["held"] or "-")
+        caller.msg("%s\n%i loads, %i evictions (%i objects), %i refused." % (
+            text_type(table), stats["loads"], stats["evictions"], stats["flushed"],
+            stats["held"]))
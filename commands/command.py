@@ -4,9 +4,9 @@ Commands
 Commands describe the input the account can do to the game.
 
 """
-
+from time import time
 from evennia import Command as BaseCommand
-# from evennia import default_cmds
+from evennia.utils import utils
 
 
 class Command(BaseCommand):
@@ -37,149 +37,277 @@ class Command(BaseCommand):
 #
 #   evennia.commands.default.muxcommand.MuxCommand.
 #
-# If you want to make sweeping changes to default commands you can
-# uncomment this copy of the MuxCommand parent and add
+# This is a drop-in replacement of that parent, activated by
 #
 #   COMMAND_DEFAULT_CLASS = "commands.command.MuxCommand"
 #
-# to your settings file. Be warned that the default commands expect
+# in the settings file. Be warned that the default commands expect
 # the functionality implemented in the parse() method, so be
-# careful with what you change.
+# careful with what you change. The parse results are exactly the
+# same as those of `_reference_parse` below (a copy of the original
+# MuxCommand.parse), but are computed in one pass, and the list
+# attributes (`arglist`, `lhslist`, `rhslist`) are only built the
+# first time a command reads them.
 #
 # -------------------------------------------------------------
 
-# from evennia.utils import utils
-#
-#
-# class MuxCommand(Command):
-#     """
-#     This sets up the basis for a MUX command. The idea
-#     is that most other Mux-related commands should just
-#     inherit from this and don't have to implement much
-#     parsing of their own unless they do something particularly
-#     advanced.
-#
-#     Note that the class's __doc__ string (this text) is
-#     used by Evennia to create the automatic help entry for
-#     the command, so make sure to document consistently here.
-#     """
-#     def has_perm(self, srcobj):
-#         """
-#         This is called by the cmdhandler to determine
-#         if srcobj is allowed to execute this command.
-#         We just show it here for completeness - we
-#         are satisfied using the default check in Command.
-#         """
-#         return super(MuxCommand, self).has_perm(srcobj)
-#
-#     def at_pre_cmd(self):
-#         """
-#         This hook is called before self.parse() on all commands
-#         """
-#         pass
-#
-#     def at_post_cmd(self):
-#         """
-#         This hook is called after the command has finished executing
-#         (after self.func()).
-#         """
-#         pass
-#
-#     def parse(self):
-#         """
-#         This method is called by the cmdhandler once the command name
-#         has been identified. It creates a new set of member variables
-#         that can be later accessed from self.func() (see below)
-#
-#         The following variables are available for our use when entering this
-#         method (from the command definition, and assigned on the fly by the
-#         cmdhandler):
-#            self.key - the name of this command ('look')
-#            self.aliases - the aliases of this cmd ('l')
-#            self.permissions - permission string for this command
-#            self.help_category - overall category of command
-#
-#            self.caller - the object calling this command
-#            self.cmdstring - the actual command name used to call this
-#                             (this allows you to know which alias was used,
-#                              for example)
-#            self.args - the raw input; everything following self.cmdstring.
-#            self.cmdset - the cmdset from which this command was picked. Not
-#                          often used (useful for commands like 'help' or to
-#                          list all available commands etc)
-#            self.obj - the object on which this command was defined. It is often
-#                          the same as self.caller.
-#
-#         A MUX command has the following possible syntax:
-#
-#           name[ with several words][/switch[/switch..]] arg1[,arg2,...] [[=|,] arg[,..]]
-#
-#         The 'name[ with several words]' part is already dealt with by the
-#         cmdhandler at this point, and stored in self.cmdname (we don't use
-#         it here). The rest of the command is stored in self.args, which can
-#         start with the switch indicator /.
-#
-#         This parser breaks self.args into its constituents and stores them in the
-#         following variables:
-#           self.switches = [list of /switches (without the /)]
-#           self.raw = This is the raw argument input, including switches
-#           self.args = This is re-defined to be everything *except* the switches
-#           self.lhs = Everything to the left of = (lhs:'left-hand side'). If
-#                      no = is found, this is identical to self.args.
-#           self.rhs: Everything to the right of = (rhs:'right-hand side').
-#                     If no '=' is found, this is None.
-#           self.lhslist - [self.lhs split into a list by comma]
-#           self.rhslist - [list of self.rhs split into a list by comma]
-#           self.arglist = [list of space-separated args (stripped, including '=' if it exists)]
-#
-#           All args and list members are stripped of excess whitespace around the
-#           strings, but case is preserved.
-#         """
-#         raw = self.args
-#         args = raw.strip()
-#
-#         # split out switches
-#         switches = []
-#         if args and len(args) > 1 and args[0] == "/":
-#             # we have a switch, or a set of switches. These end with a space.
-#             switches = args[1:].split(None, 1)
-#             if len(switches) > 1:
-#                 switches, args = switches
-#                 switches = switches.split('/')
-#             else:
-#                 args = ""
-#                 switches = switches[0].split('/')
-#         arglist = [arg.strip() for arg in args.split()]
-#
-#         # check for arg1, arg2, ... = argA, argB, ... constructs
-#         lhs, rhs = args, None
-#         lhslist, rhslist = [arg.strip() for arg in args.split(',')], []
-#         if args and '=' in args:
-#             lhs, rhs = [arg.strip() for arg in args.split('=', 1)]
-#             lhslist = [arg.strip() for arg in lhs.split(',')]
-#             rhslist = [arg.strip() for arg in rhs.split(',')]
-#
-#         # save to object properties:
-#         self.raw = raw
-#         self.switches = switches
-#         self.args = args.strip()
-#         self.arglist = arglist
-#         self.lhs = lhs
-#         self.lhslist = lhslist
-#         self.rhs = rhs
-#         self.rhslist = rhslist
-#
-#         # if the class has the account_caller property set on itself, we make
-#         # sure that self.caller is always the account if possible. We also create
-#         # a special property "character" for the puppeted object, if any. This
-#         # is convenient for commands defined on the Account only.
-#         if hasattr(self, "account_caller") and self.account_caller:
-#             if utils.inherits_from(self.caller, "evennia.objects.objects.DefaultObject"):
-#                 # caller is an Object/Character
-#                 self.character = self.caller
-#                 self.caller = self.caller.account
-#             elif utils.inherits_from(self.caller, "evennia.accounts.accounts.DefaultAccount"):
-#                 # caller was already an Account
-#                 self.character = self.caller.get_puppet(self.session)
-#             else:
-#                 self.character = None
+
+class MuxCommand(Command):
+    """
+    This sets up the basis for a MUX command. The idea
+    is that most other Mux-related commands should just
+    inherit from this and don't have to implement much
+    parsing of their own unless they do something particularly
+    advanced.
+
+    Note that the class's __doc__ string (this text) is
+    used by Evennia to create the automatic help entry for
+    the command, so make sure to document consistently here.
+    """
+    # storage for the parse results. The list results are None until
+    # first accessed through their properties.
+    __slots__ = ("raw", "switches", "lhs", "rhs",
+                 "_parsed_args", "_arglist", "_lhslist", "_rhslist")
+
+    def parse(self):
+        """
+        This method is called by the cmdhandler once the command name
+        has been identified. It creates a new set of member variables
+        that can be later accessed from self.func() (see below)
+
+        The following variables are available for our use when entering this
+        method (from the command definition, and assigned on the fly by the
+        cmdhandler):
+           self.key - the name of this command ('look')
+           self.aliases - the aliases of this cmd ('l')
+           self.permissions - permission string for this command
+           self.help_category - overall category of command
+
+           self.caller - the object calling this command
+           self.cmdstring - the actual command name used to call this
+                            (this allows you to know which alias was used,
+                             for example)
+           self.args - the raw input; everything following self.cmdstring.
+           self.cmdset - the cmdset from which this command was picked. Not
+                         often used (useful for commands like 'help' or to
+                         list all available commands etc)
+           self.obj - the object on which this command was defined. It is often
+                         the same as self.caller.
+
+        A MUX command has the following possible syntax:
+
+          name[ with several words][/switch[/switch..]] arg1[,arg2,...] [[=|,] arg[,..]]
+
+        The 'name[ with several words]' part is already dealt with by the
+        cmdhandler at this point, and stored in self.cmdname (we don't use
+        it here). The rest of the command is stored in self.args, which can
+        start with the switch indicator /.
+
+        This parser breaks self.args into its constituents and stores them in the
+        following variables:
+          self.switches = [list of /switches (without the /)]
+          self.raw = This is the raw argument input, including switches
+          self.args = This is re-defined to be everything *except* the switches
+          self.lhs = Everything to the left of = (lhs:'left-hand side'). If
+                     no = is found, this is identical to self.args.
+          self.rhs: Everything to the right of = (rhs:'right-hand side').
+                    If no '=' is found, this is None.
+          self.lhslist - [self.lhs split into a list by comma]
+          self.rhslist - [list of self.rhs split into a list by comma]
+          self.arglist = [list of space-separated args (stripped, including '=' if it exists)]
+
+          All args and list members are stripped of excess whitespace around the
+          strings, but case is preserved.
+        """
+        raw = self.args
+        args = raw.strip()
+
+        # split out switches. These end with a space.
+        switches = []
+        if len(args) > 1 and args[0] == "/":
+            switchstring, args = (args[1:].split(None, 1) + [""])[:2]
+            switches = switchstring.split("/")
+
+        # check for arg1, arg2, ... = argA, argB, ... constructs
+        lhs, rhs = args, None
+        if "=" in args:
+            lhs, _, rhs = args.partition("=")
+            lhs, rhs = lhs.strip(), rhs.strip()
+
+        # save to object properties:
+        self.raw = raw
+        self.switches = switches
+        self.args = args
+        self.lhs = lhs
+        self.rhs = rhs
+        self._parsed_args = args
+        self._arglist = self._lhslist = self._rhslist = None
+
+        # if the class has the account_caller property set on itself, we make
+        # sure that self.caller is always the account if possible. We also create
+        # a special property "character" for the puppeted object, if any. This
+        # is convenient for commands defined on the Account only.
+        if getattr(self, "account_caller", False):
+            if utils.inherits_from(self.caller, "evennia.objects.objects.DefaultObject"):
+                # caller is an Object/Character
+                self.character = self.caller
+                self.caller = self.caller.account
+            elif utils.inherits_from(self.caller, "evennia.accounts.accounts.DefaultAccount"):
+                # caller was already an Account
+                self.character = self.caller.get_puppet(self.session)
+            else:
+                self.character = None
+
+    # lazily computed parse results. These are split from the values
+    # found at parse time, so they are the same as if they had been
+    # computed in parse().
+
+    @property
+    def arglist(self):
+        if self._arglist is None:
+            self._arglist = self._parsed_args.split()
+        return self._arglist
+
+    @arglist.setter
+    def arglist(self, value):
+        self._arglist = value
+
+    @property
+    def lhslist(self):
+        if self._lhslist is None:
+            args = self._parsed_args
+            if "=" in args:
+                args = args.partition("=")[0]
+            self._lhslist = [arg.strip() for arg in args.split(",")]
+        return self._lhslist
+
+    @lhslist.setter
+    def lhslist(self, value):
+        self._lhslist = value
+
+    @property
+    def rhslist(self):
+        if self._rhslist is None:
+            args = self._parsed_args
+            if "=" in args:
+                self._rhslist = [arg.strip() for arg in args.partition("=")[2].split(",")]
+            else:
+                self._rhslist = []
+        return self._rhslist
+
+    @rhslist.setter
+    def rhslist(self, value):
+        self._rhslist = value
+
+
+def _reference_parse(raw):
+    """
+    The original MuxCommand.parse, kept for comparison with the
+    active implementation.
+
+    Args:
+        raw (str): The input following the command name.
+
+    Returns:
+        parsed (dict): The parse results, keyed on attribute name.
+
+    """
+    args = raw.strip()
+
+    # split out switches
+    switches = []
+    if args and len(args) > 1 and args[0] == "/":
+        # we have a switch, or a set of switches. These end with a space.
+        switches = args[1:].split(None, 1)
+        if len(switches) > 1:
+            switches, args = switches
+            switches = switches.split('/')
+        else:
+            args = ""
+            switches = switches[0].split('/')
+    arglist = [arg.strip() for arg in args.split()]
+
+    # check for arg1, arg2, ... = argA, argB, ... constructs
+    lhs, rhs = args, None
+    lhslist, rhslist = [arg.strip() for arg in args.split(',')], []
+    if args and '=' in args:
+        lhs, rhs = [arg.strip() for arg in args.split('=', 1)]
+        lhslist = [arg.strip() for arg in lhs.split(',')]
+        rhslist = [arg.strip() for arg in rhs.split(',')]
+
+    return {"raw": raw, "switches": switches, "args": args.strip(),
+            "arglist": arglist, "lhs": lhs, "lhslist": lhslist,
+            "rhs": rhs, "rhslist": rhslist}
+
+
+# a few typical inputs, used if no corpus is given to benchmark_parse
+_BENCHMARK_CORPUS = (
+    "", " here", " me", " sword", " 2-ball", " = Hello there!",
+    " Hello there, how are you?", "/ooc Back in a sec.",
+    "/tell Griatch = How do I dig a room?",
+    " #12 = A small, dusty room.", "/tel/quiet #42",
+    "/add/force me = commands.default_cmdsets.CharacterCmdSet",
+    " north;n, south;s = Hallway", " ball, box, sword = chest",
+    " pub = hello all", "/history pub = 20")
+
+
+def benchmark_parse(corpus=None, repeats=1000, read_lists=False):
+    """
+    Compare the speed of `MuxCommand.parse` with the original
+    implementation. Meant to be run from `evennia shell`.
+
+    Args:
+        corpus (list or str, optional): A list of argument strings (what
+            follows the command name), or the path to a file with one
+            per line. Defaults to a small built-in corpus.
+        repeats (int, optional): How many times to parse the corpus.
+        read_lists (bool, optional): Also read `arglist`, `lhslist` and
+            `rhslist` after each parse, forcing the lazy lists to be built.
+
+    Returns:
+        result (dict): With keys `lines`, `reference` and `muxcommand`
+            (seconds used), `speedup` and `mismatches` (inputs where the
+            two parsers did not give the same result).
+
+    """
+    if corpus is None:
+        corpus = _BENCHMARK_CORPUS
+    elif utils.is_iter(corpus):
+        corpus = list(corpus)
+    else:
+        with open(corpus) as fil:
+            corpus = [line.rstrip("\r\n") for line in fil]
+
+    cmd = MuxCommand()
+    cmd.caller = None
+
+    mismatches = []
+    for line in corpus:
+        cmd.args = line
+        cmd.parse()
+        ref = _reference_parse(line)
+        if any(getattr(cmd, key) != value for key, value in ref.items()):
+            mismatches.append(line)
+
+    t0 = time()
+    for _ in range(repeats):
+        for line in corpus:
+            ref = _reference_parse(line)
+            if read_lists:
+                ref["arglist"], ref["lhslist"], ref["rhslist"]
+    t_reference = time() - t0
+
+    t0 = time()
+    for _ in range(repeats):
+        for line in corpus:
+            cmd.args = line
+            cmd.parse()
+            if read_lists:
+                cmd.arglist, cmd.lhslist, cmd.rhslist
+    t_muxcommand = time() - t0
+
+    return {"lines": len(corpus),
+            "reference": t_reference,
+            "muxcommand": t_muxcommand,
+            "speedup": t_reference / max(t_muxcommand, 1e-9),
+            "mismatches": mismatches}
@@ -15,6 +15,11 @@ own cmdsets by inheriting from them or directly from `evennia.CmdSet`.
 """
 
 from evennia import default_cmds
+from world.lazyimport import lazy_import
+
+# imported when the first cmdset using them is created
+admin = lazy_import("commands.admin")
+travel = lazy_import("commands.travel")
 
 
 class CharacterCmdSet(default_cmds.CharacterCmdSet):
@@ -33,6 +38,11 @@ class CharacterCmdSet(default_cmds.CharacterCmdSet):
         #
         # any commands you add below will overload the default ones.
         #
+        self.add(admin.CmdCheckIndex())
+        self.add(admin.CmdOOBStats())
+        self.add(admin.CmdConvertAttrs())
+        self.add(admin.CmdZones())
+        self.add(travel.CmdTravel())
 
 
 class AccountCmdSet(default_cmds.AccountCmdSet):
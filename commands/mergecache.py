@@ -0,0 +1,180 @@
+"""
+Cmdset merge cache
+
+Every time a puppeted Character enters a command, Evennia's cmdhandler
+gathers the cmdsets of the Session, Account, Character and of the
+objects in the location (such as exits) and merges them into one
+cmdset. In a crowded room almost all of those merges are identical to
+the previous command's.
+
+This module memoizes cmdset merges. A merge of two cmdsets is keyed
+on the identities and versions of both operands, so a full merge
+chain (Session + Account + Character + exits) is cached piece by
+piece - the result of one merge is the (unchanged) left operand of
+the next one.
+
+The cache is invalidated automatically:
+
+ - when a cmdset is added to or removed from a cmdset handler, since
+   the handler then creates a new cmdset instance with a new identity.
+ - when a command is added to or removed from an existing cmdset,
+   which bumps the version of that cmdset.
+ - when the exits of a location change (see `typeclasses.rooms.Room`),
+   which calls `invalidate()`.
+
+The cache is activated by `install()`, which is called from
+`server/conf/at_server_startstop.py` unless the setting
+
+    CMDSET_MERGE_CACHE = False
+
+is given. The number of cached merges is set by
+`CMDSET_MERGE_CACHE_SIZE`. Use `merge_cache_stats()` to check the
+hit ratio.
+
+"""
+from collections import OrderedDict
+from django.conf import settings
+from evennia.commands.cmdset import CmdSet
+
+_CACHE_SIZE = getattr(settings, "CMDSET_MERGE_CACHE_SIZE", 4096)
+
+# (id_a, version_a, ..., id_b, version_b, ...): (cmdset_a, cmdset_b, result, result_version)
+_MERGE_CACHE = OrderedDict()
+_STATS = {"hits": 0, "misses": 0, "invalidations": 0}
+
+# the original CmdSet methods, set by install()
+_ORIG_ADD = None
+_ORIG_CMDSET_ADD = None
+_ORIG_CMDSET_REMOVE = None
+
+
+def cmdset_version(cmdset):
+    """
+    Get the version of a cmdset.
+
+    Args:
+        cmdset (CmdSet): The cmdset to check.
+
+    Returns:
+        version (int): A counter increased every time commands are
+            added to or removed from this cmdset instance.
+
+    """
+    return cmdset.__dict__.get("_merge_version", 0)
+
+
+def mark_changed(cmdset):
+    """
+    Bump the version of a cmdset, so merges including it are no
+    longer taken from the cache.
+
+    Args:
+        cmdset (CmdSet): The cmdset that changed.
+
+    """
+    cmdset._merge_version = cmdset.__dict__.get("_merge_version", 0) + 1
+
+
+def _merge_key(cmdset_a, cmdset_b):
+    """
+    Build the cache key for merging two cmdsets. Apart from identity
+    and version this includes the merge options the cmdhandler may
+    change on a cmdset between merges.
+
+    """
+    return (id(cmdset_a), cmdset_version(cmdset_a), cmdset_a.priority,
+            cmdset_a.mergetype, cmdset_a.duplicates,
+            id(cmdset_b), cmdset_version(cmdset_b), cmdset_b.priority,
+            cmdset_b.mergetype, cmdset_b.duplicates)
+
+
+def cached_merge(cmdset_a, cmdset_b):
+    """
+    Merge two cmdsets (`cmdset_a + cmdset_b`), reusing an earlier
+    merge of the same cmdsets if possible.
+
+    Args:
+        cmdset_a (CmdSet): The left-hand cmdset.
+        cmdset_b (CmdSet): The right-hand cmdset.
+
+    Returns:
+        cmdset (CmdSet): The merged cmdset. This may be shared with
+            other callers and should not be modified.
+
+    """
+    key = _merge_key(cmdset_a, cmdset_b)
+    entry = _MERGE_CACHE.pop(key, None)
+    if entry is not None and cmdset_version(entry[2]) == entry[3]:
+        _STATS["hits"] += 1
+        _MERGE_CACHE[key] = entry
+        return entry[2]
+
+    _STATS["misses"] += 1
+    result = _ORIG_ADD(cmdset_a, cmdset_b)
+    if len(_MERGE_CACHE) >= _CACHE_SIZE:
+        _MERGE_CACHE.popitem(last=False)
+    # we store the operands too, so their ids can not be reused by
+    # other cmdsets while the entry lives.
+    _MERGE_CACHE[key] = (cmdset_a, cmdset_b, result, cmdset_version(result))
+    return result
+
+
+def invalidate():
+    """
+    Empty the merge cache. This is called when the exits of a
+    location change.
+    """
+    _STATS["invalidations"] += 1
+    _MERGE_CACHE.clear()
+
+
+def merge_cache_stats():
+    """
+    Get the performance counters of the merge cache.
+
+    Returns:
+        stats (dict): With keys `hits`, `misses`, `invalidations`,
+            `ratio` (hits / lookups) and `size` (cached merges).
+
+    """
+    lookups = _STATS["hits"] + _STATS["misses"]
+    stats = dict(_STATS)
+    stats["ratio"] = _STATS["hits"] / float(lookups) if lookups else 0.0
+    stats["size"] = len(_MERGE_CACHE)
+    return stats
+
+
+def reset_stats():
+    """
+    Zero the hit/miss counters.
+    """
+    for key in _STATS:
+        _STATS[key] = 0
+
+
+def install():
+    """
+    Make all cmdset merges go through the cache. This replaces
+    `CmdSet.__add__` and wraps `CmdSet.add`/`CmdSet.remove` so
+    changes to a cmdset bump its version. Calling this more than
+    once has no further effect.
+
+    """
+    global _ORIG_ADD, _ORIG_CMDSET_ADD, _ORIG_CMDSET_REMOVE
+    if _ORIG_ADD is not None:
+        return
+    _ORIG_ADD = CmdSet.__add__
+    _ORIG_CMDSET_ADD = CmdSet.add
+    _ORIG_CMDSET_REMOVE = CmdSet.remove
+
+    def add(self, cmd):
+        mark_changed(self)
+        return _ORIG_CMDSET_ADD(self, cmd)
+
+    def remove(self, cmd):
+        mark_changed(self)
+        return _ORIG_CMDSET_REMOVE(self, cmd)
+
+    CmdSet.__add__ = cached_merge
+    CmdSet.add = add
+    CmdSet.remove = remove
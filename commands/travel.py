@@ -0,0 +1,140 @@
+"""
+Travel
+
+The `travel` command walks the caller to a distant room along the
+shortest route, one exit at a time, using `world.pathfinding`. Each
+travel has an id in `ndb.travel_id`, so the steps still scheduled for
+a stopped or replaced travel do nothing.
+
+"""
+from evennia.objects.models import ObjectDB
+from evennia.utils.utils import delay
+from commands.command import MuxCommand
+from world.lazyimport import lazy_import
+
+pathfinding = lazy_import("world.pathfinding")
+
+# seconds between each step of a travel
+TRAVEL_STEP_DELAY = 1
+
+
+def stop_travel(traveller):
+    """
+    Stop a travel. A step already scheduled does nothing when it comes.
+
+    Args:
+        traveller (Object): The object travelling.
+
+    """
+    traveller.ndb.travel_path = None
+    traveller.ndb.travel_id = (traveller.ndb.travel_id or 0) + 1
+
+
+def start_travel(traveller, path):
+    """
+    Start walking a route, replacing any travel in progress, and take
+    the first step.
+
+    Args:
+        traveller (Object): The object to travel.
+        path (list): The ids of the exits to traverse, in order.
+
+    """
+    stop_travel(traveller)
+    traveller.ndb.travel_path = path
+    travel_step(traveller, traveller.ndb.travel_id)
+
+
+def travel_step(traveller, travel_id):
+    """
+    Take the next step of a travel started with `start_travel`.
+    Re-schedules itself until the destination is reached or the route
+    is blocked.
+
+    Args:
+        traveller (Object): The object travelling. Its route is
+            stored as a list of exit ids in `ndb.travel_path`.
+        travel_id (int): The travel this step belongs to; if the
+            travel was stopped or replaced since, nothing happens.
+
+    """
+    if travel_id != traveller.ndb.travel_id:
+        return
+    path = traveller.ndb.travel_path
+    if not path:
+        return
+    exi = ObjectDB.objects.get_id(path.pop(0))
+    if not exi or not exi.destination:
+        traveller.msg("Your route is blocked. You stop travelling.")
+        stop_travel(traveller)
+        return
+    if exi.location != traveller.location:
+        # the traveller moved off the route
+        traveller.msg("You stop travelling.")
+        stop_travel(traveller)
+        return
+    if not exi.access(traveller, "traverse"):
+        exi.at_failed_traverse(traveller)
+        stop_travel(traveller)
+        return
+    exi.at_traverse(traveller, exi.destination)
+    if traveller.location != exi.destination:
+        traveller.msg("You stop travelling.")
+        stop_travel(traveller)
+    elif path:
+        delay(TRAVEL_STEP_DELAY, travel_step, traveller, travel_id)
+    else:
+        stop_travel(traveller)
+        traveller.msg("You have arrived.")
+
+
+class CmdTravel(MuxCommand):
+    """
+    walk to a room
+
+    Usage:
+      travel <room>
+      travel/stop
+
+    Walks you to the given room along the shortest route,
+    passing one exit every second. Moving anywhere else on
+    your own stops the travel.
+    """
+    key = "travel"
+    locks = "cmd:all()"
+    help_category = "General"
+
+    def func(self):
+        """Implements the command"""
+        caller = self.caller
+
+        if "stop" in self.switches:
+            if caller.ndb.travel_path:
+                stop_travel(caller)
+                caller.msg("You stop travelling.")
+            else:
+                caller.msg("You are not travelling anywhere.")
+            return
+
+        if not self.args:
+            caller.msg("Usage: travel <room>")
+            return
+        if not caller.location:
+            caller.msg("You can't travel from here.")
+            return
+        target = caller.search(self.args, global_search=True,
+                               typeclass="typeclasses.rooms.Room")
+        if not target:
+            return
+        if target == caller.location:
+            caller.msg("You are already there.")
+            return
+
+        path = pathfinding.find_path(caller.location, target, traveller=caller)
+        if path is None:
+            caller.msg("You can't find a way to %s." % target.get_display_name(caller))
+            return
+
+        caller.msg("You set off towards %s (%i step%s)." % (
+            target.get_display_name(caller), len(path), "" if len(path) == 1 else "s"))
+        start_travel(caller, path)
@@ -23,7 +23,77 @@ line to your settings file:
 
     SEARCH_AT_RESULT = "server.conf.at_search.at_search_result"
 
+Local searches by key and alias from our Objects are matched in memory
+(see world/nameindex.py), but still end up here with the same list of
+matches as a database search would give.
+
+Global searches by key and alias from our Objects go through
+`global_search` below, which uses the in-memory trigram index of
+world/fuzzysearch.py. Only exact names match; if there are none, the
+closest names from `suggestions` are listed in the not-found message.
+
 """
+import re
+from django.conf import settings
+from evennia.objects.models import ObjectDB
+from world import fuzzysearch
+
+_MULTIMATCH_REGEX = re.compile(getattr(settings, "SEARCH_MULTIMATCH_REGEX",
+                                       r"(?P<number>[0-9]+)-(?P<name>.*)"), re.I + re.U)
+_FUZZY_LIMIT = getattr(settings, "SEARCH_FUZZY_LIMIT", 10)
+
+
+def global_search(query):
+    """
+    Search all objects in the game by key and alias.
+
+    Args:
+        query (str): The search string, possibly on the form `2-ball`.
+
+    Returns:
+        matches (list): The objects with a key or alias equal to the
+            query, ordered by id. Near misses are never matches (see
+            `suggestions`), so commands don't act on an object that
+            was not named.
+
+    """
+    index = fuzzysearch.get_index()
+    query = query.strip()
+    ids = index.exact(query)
+    if not ids:
+        match = _MULTIMATCH_REGEX.match(query)
+        if match:
+            match_number = int(match.group("number")) - 1
+            ids = index.exact(match.group("name"))
+            ids = [ids[match_number]] if 0 <= match_number < len(ids) else []
+    return _objects(ids)
+
+
+def suggestions(query, limit=_FUZZY_LIMIT):
+    """
+    Find the objects with names most similar to a query, for telling
+    the searcher what they may have meant.
+
+    Args:
+        query (str): The search string.
+        limit (int, optional): The most objects to return.
+
+    Returns:
+        objects (list): The objects, best match first.
+
+    """
+    return _objects([obj_id for _, obj_id in fuzzysearch.get_index().search(
+        query.strip(), limit=limit)])
+
+
+def _objects(ids):
+    """
+    Load objects by id, keeping the order of the ids.
+    """
+    if not ids:
+        return []
+    objects = dict((obj.id, obj) for obj in ObjectDB.objects.filter(id__in=ids))
+    return [objects[obj_id] for obj_id in ids if obj_id in objects]
 
 
 def at_search_result(matches, caller, query="", quiet=False, **kwargs):
@@ -15,14 +15,41 @@ at_server_cold_start()
 at_server_cold_stop()
 
 """
+from django.conf import settings
+from twisted.internet import reactor
+from world import (channelhistory, exitgraph, inlinecache, lockcache, scriptstate,
+                   serializer, startprofile, writebehind, zones)
+from world.lazyimport import lazy_import
 
+# only imported if enabled
+fuzzysearch = lazy_import("world.fuzzysearch")
+mergecache = lazy_import("commands.mergecache")
+warmup = lazy_import("world.warmup")
 
+# the server imports this module before loading anything from the
+# database, and Attributes stored in any format must be readable then
+serializer.install()
+
+
+@startprofile.timed("at_server_start")
 def at_server_start():
     """
     This is called every time the server starts up, regardless of
     how it was shut down.
     """
-    pass
+    if getattr(settings, "CMDSET_MERGE_CACHE", True):
+        mergecache.install()
+    lockcache.install()
+    lockcache.on_change(exitgraph.locks_changed)
+    inlinecache.install()
+    exitgraph.build()
+    if getattr(settings, "SEARCH_FUZZY_INDEX", True):
+        fuzzysearch.build()
+    scriptstate.resume()
+    scriptstate.start()
+    channelhistory.start()
+    writebehind.start()
+    zones.start()
 
 
 def at_server_stop():
@@ -30,14 +57,27 @@ def at_server_stop():
     This is called just before the server is shut down, regardless
     of it is for a reload, reset or shutdown.
     """
-    pass
+    # all scripts have been paused by now
+    scriptstate.flush()
+    channelhistory.flush()
+    writebehind.flush()
+
+
+def _warmup():
+    """
+    Preload objects (see world/warmup.py), after at_server_start has
+    installed the caches.
+    """
+    if getattr(settings, "WARMUP_ENABLED", True):
+        reactor.callLater(0, warmup.start)
 
 
+@startprofile.timed("at_server_reload_start")
 def at_server_reload_start():
     """
     This is called only when server starts back up after a reload.
     """
-    pass
+    _warmup()
 
 
 def at_server_reload_stop():
@@ -47,12 +87,13 @@ def at_server_reload_stop():
     pass
 
 
+@startprofile.timed("at_server_cold_start")
 def at_server_cold_start():
     """
     This is called only when the server starts "cold", i.e. after a
     shutdown or a reset.
     """
-    pass
+    _warmup()
 
 
 def at_server_cold_stop():
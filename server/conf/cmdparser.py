@@ -29,7 +29,29 @@ your settings file:
 
     COMMAND_PARSER = "server.conf.cmdparser.cmdparser"
 
+This implementation gives the same results as the default parser but
+does not scan every key and alias of the merged cmdset for every line
+of input. Instead, the names of each cmdset are indexed in a prefix
+trie (so multi-word keys like `look at` work the same way) and the
+trie is cached keyed on the signature of the merged cmdset. A command
+lookup is then one walk down the trie, proportional to the length of
+the input rather than to the number of available commands.
+
+Use `benchmark()` from `evennia shell` to replay a recorded input log
+against both this and the default parser.
+
 """
+from time import time
+from collections import OrderedDict
+from evennia.utils.logger import log_trace
+
+# how many distinct merged cmdsets to keep tries for
+_TRIE_CACHE_SIZE = 256
+_TRIE_CACHE = OrderedDict()
+
+# key used in trie nodes for the names ending at that node. Since all
+# other keys are single characters this can never collide.
+_NAMES = ""
 
 
 def cmdparser(raw_string, cmdset, caller, match_index=None):
@@ -52,4 +74,228 @@ def cmdparser(raw_string, cmdset, caller, match_index=None):
             (possibly) separate multiple matches.
 
     """
-    # Your implementation here
+    if not raw_string:
+        return []
+
+    trie = _get_trie(cmdset)
+    l_raw_string = raw_string.lower()
+
+    # walk down the trie; every node passed that ends a name is a
+    # command name the input starts with.
+    found = []
+    node = trie
+    for char in l_raw_string:
+        node = node.get(char)
+        if node is None:
+            break
+        if _NAMES in node:
+            found.extend(node[_NAMES])
+
+    matches = []
+    if found:
+        # restore the cmdset order so multimatch indexing is the same
+        # as with the default parser
+        found.sort()
+        for _, cmdname, cmd in found:
+            try:
+                if cmd.arg_regex and not cmd.arg_regex.match(l_raw_string[len(cmdname):]):
+                    continue
+                matches.append(_create_match(cmdname, raw_string, cmd))
+            except Exception:
+                log_trace("cmdhandler error. raw_input:%s" % raw_string)
+
+    if not matches:
+        # no matches found
+        if '-' in raw_string:
+            # This could be due to the user trying to identify the
+            # command with a #num-<command> style syntax. We expect the
+            # number to be 1-indexed
+            mindex, new_raw_string = raw_string.split("-", 1)
+            if mindex.isdigit():
+                mindex = int(mindex) - 1
+                return cmdparser(new_raw_string, cmdset, caller, match_index=mindex)
+
+    # only select command matches we are actually allowed to call.
+    matches = [match for match in matches if match[2].access(caller, 'cmd')]
+
+    if len(matches) > 1:
+        # See if it helps to analyze the match with preserved case but only if
+        # it leaves at least one match.
+        trimmed = [match for match in matches
+                   if raw_string.startswith(match[0])]
+        if trimmed:
+            matches = trimmed
+
+    if len(matches) > 1:
+        # we still have multiple matches. Sort them by count quality.
+        matches = sorted(matches, key=lambda m: m[3])
+        # only pick the matches with highest count quality
+        quality = [mat[3] for mat in matches]
+        matches = matches[-quality.count(quality[-1]):]
+
+    if len(matches) > 1:
+        # still multiple matches. Fall back to ratio-based quality.
+        matches = sorted(matches, key=lambda m: m[4])
+        # only pick the highest rated ratio match
+        quality = [mat[4] for mat in matches]
+        matches = matches[-quality.count(quality[-1]):]
+
+    if len(matches) > 1 and match_index is not None and 0 <= match_index < len(matches):
+        # We couldn't separate match by quality, but we have an
+        # index argument to tell us which match to use.
+        matches = [matches[match_index]]
+
+    # no matter what we have at this point, we have to return it.
+    return matches
+
+
+def _create_match(cmdname, string, cmdobj):
+    """
+    Builds a command match by splitting the incoming string and
+    evaluating the quality of the match.
+
+    Args:
+        cmdname (str): Name of command to check for.
+        string (str): The string to match against.
+        cmdobj (str): The full Command instance.
+
+    Returns:
+        match (tuple): This is on the form (cmdname, args, cmdobj, cmdlen, mratio),
+            where `cmdname` is the command's name and `args` the rest of the
+            incoming string, without said command name. `cmdobj` is the
+            Command instance, the cmdlen is the same as len(cmdname) and
+            mratio is a measure of how big a part of the full input string
+            the cmdname takes up - an exact match would be 1.0.
+
+    """
+    cmdlen, strlen = len(cmdname), len(string)
+    mratio = 1 - (strlen - cmdlen) / (1.0 * strlen)
+    args = string[cmdlen:]
+    return (cmdname, args, cmdobj, cmdlen, mratio)
+
+
+def cmdset_signature(cmdset):
+    """
+    Get the merge signature of a cmdset.
+
+    Args:
+        cmdset (CmdSet): A (usually merged) cmdset.
+
+    Returns:
+        signature (tuple): The identities of the Command instances in
+            the cmdset, in order. Two merges resulting in the same
+            commands give the same signature.
+
+    Notes:
+        The cached tries hold on to their Command instances, so an id
+        can not be reused by another command while it is still cached.
+        Exits and other dynamic cmdsets create new Command instances
+        when they are rebuilt (such as after an alias change), so
+        those are picked up as a new signature.
+
+    """
+    return tuple(id(cmd) for cmd in cmdset.commands)
+
+
+def build_trie(cmdset):
+    """
+    Build a prefix trie of all command names in a cmdset.
+
+    Args:
+        cmdset (CmdSet): The cmdset to index.
+
+    Returns:
+        trie (dict): Nested dicts keyed on single (lowercase)
+            characters. A node where one or more command names end
+            stores a list of `(order, cmdname, cmd)` under the empty
+            string key, where `order` is the position the name would
+            have had when scanning the cmdset linearly.
+
+    """
+    trie = {}
+    order = 0
+    for cmd in cmdset.commands:
+        for cmdname in [cmd.key] + cmd.aliases:
+            if cmdname:
+                node = trie
+                for char in cmdname.lower():
+                    node = node.setdefault(char, {})
+                node.setdefault(_NAMES, []).append((order, cmdname, cmd))
+            order += 1
+    return trie
+
+
+def _get_trie(cmdset):
+    """
+    Get the trie for a cmdset from cache, building it if needed.
+
+    Args:
+        cmdset (CmdSet): The merged cmdset.
+
+    Returns:
+        trie (dict): The trie for this cmdset.
+
+    """
+    signature = cmdset_signature(cmdset)
+    try:
+        trie = _TRIE_CACHE.pop(signature)
+    except KeyError:
+        trie = build_trie(cmdset)
+        if len(_TRIE_CACHE) >= _TRIE_CACHE_SIZE:
+            _TRIE_CACHE.popitem(last=False)
+    # (re)insert last to mark as most recently used
+    _TRIE_CACHE[signature] = trie
+    return trie
+
+
+def clear_cache():
+    """
+    Empty the trie cache. This is never needed for correctness.
+    """
+    _TRIE_CACHE.clear()
+
+
+def benchmark(logfile, cmdset, caller, repeats=10):
+    """
+    Replay a recorded input log against this and the default
+    parser and compare their speed. Meant to be run from
+    `evennia shell`, with the merged cmdset of a typical character
+    (for example `caller.cmdset.current`).
+
+    Args:
+        logfile (str): Path to a file with one line of raw input
+            per line, as entered by players.
+        cmdset (CmdSet): The merged cmdset to parse against.
+        caller (Object or Account): Used for the `cmd` lock checks.
+        repeats (int, optional): How many times to replay the log.
+
+    Returns:
+        result (dict): With keys `lines`, `default_lps` and `trie_lps`
+            (lookups per second), `speedup` and `mismatches` (input lines
+            where the two parsers did not agree).
+
+    """
+    from evennia.commands.cmdparser import cmdparser as default_cmdparser
+
+    with open(logfile) as fil:
+        lines = [line.strip() for line in fil if line.strip()]
+
+    mismatches = [line for line in lines
+                  if cmdparser(line, cmdset, caller) != default_cmdparser(line, cmdset, caller)]
+
+    timings = {}
+    for name, parser in (("default", default_cmdparser), ("trie", cmdparser)):
+        t0 = time()
+        for _ in range(repeats):
+            for line in lines:
+                parser(line, cmdset, caller)
+        timings[name] = time() - t0
+
+    nlookups = len(lines) * repeats
+    default_lps = nlookups / max(timings["default"], 1e-9)
+    trie_lps = nlookups / max(timings["trie"], 1e-9)
+    return {"lines": len(lines),
+            "default_lps": default_lps,
+            "trie_lps": trie_lps,
+            "speedup": trie_lps / max(default_lps, 1e-9),
+            "mismatches": mismatches}
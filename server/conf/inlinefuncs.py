@@ -43,9 +43,21 @@ internally by Evennia, notably to send the `session` keyword to
 the function; this is the session of the object viewing the string
 and can be used to customize it to each session.
 
+Each distinct string with inlinefuncs is only parsed once (see
+world/inlinecache.py). Inline functions whose result doesn't depend on
+the session can be decorated with `@shared`, to run them once per
+message instead of once for every session receiving it.
+
 """
+from world.inlinecache import shared  # noqa - for decorating inlinefuncs
 
 # def capitalize(text, *args, **kwargs):
 #    "Silly capitalize example. Used as {capitalize() ... {/capitalize"
 #    session = kwargs.get("session")
 #    return text.capitalize()
+#
+#
+# @shared
+# def upper(*args, **kwargs):
+#    "Used as $upper(text). The same for every session."
+#    return "".join(args).upper()
@@ -24,7 +24,134 @@ as argument.
 
     default(session, cmdname, *args, **kwargs)
 
+The functions below handle the frequent out-of-band messages of the
+webclient. They arrive as JSON arrays `["status", [], {}]` over the
+websocket and are called directly, without going through the command
+handler, and answer the same way (`["status", [], {"hp": 10, ...}]`).
+They are rate limited and coalesced per session by `world.oob.handler`,
+see `world/oob.py`.
+
 """
+from time import time
+from django.conf import settings
+from world import oob
+
+# polls answered per second and session, with bursts of twice that
+_POLL_RATE = getattr(settings, "OOB_POLL_RATE", 10)
+# repeated polls within this many seconds get one (delayed) answer
+_POLL_COALESCE = getattr(settings, "OOB_POLL_COALESCE", 0.2)
+_KEEPALIVE_RATE = getattr(settings, "OOB_KEEPALIVE_RATE", 1)
+_COORDINATES_ATTRIBUTE = getattr(settings, "PATHFINDING_COORDINATES_ATTRIBUTE", "coordinates")
+
+
+@oob.handler(rate=_POLL_RATE, coalesce=_POLL_COALESCE)
+def map_position(session, *args, **kwargs):
+    """
+    Report where the puppeted character is, for the webclient map.
+
+    Args:
+        session (Session): The active Session.
+
+    Answers:
+        map_position: `{"room": id, "name": key, "coordinates": [x, y]}`,
+            or `{"room": None}` when not in a room. `coordinates` is
+            `None` if the room has none.
+
+    """
+    puppet = session.puppet
+    location = puppet.location if puppet else None
+    if location is None:
+        session.msg(map_position={"room": None})
+        return
+    coordinates = location.attributes.get(_COORDINATES_ATTRIBUTE)
+    session.msg(map_position={"room": location.id, "name": location.key,
+                              "coordinates": list(coordinates) if coordinates else None})
+
+
+@oob.handler(rate=_POLL_RATE, coalesce=_POLL_COALESCE)
+def status(session, *args, **kwargs):
+    """
+    Report the status of the puppeted character.
+
+    Args:
+        session (Session): The active Session.
+        args (list of str, optional): The fields to report, of
+            `typeclasses.characters.STATUS_FIELDS`. Defaults to all.
+
+    Answers:
+        status: The fields, as from `Character.get_status`. Empty if
+            nothing is puppeted.
+
+    """
+    puppet = session.puppet
+    if puppet is None or not hasattr(puppet, "get_status"):
+        session.msg(status={})
+        return
+    session.msg(status=puppet.get_status(args or None))
+
+
+@oob.handler(rate=_POLL_RATE)
+def status_subscribe(session, *args, **kwargs):
+    """
+    Subscribe to changes of the puppeted character's status, instead of
+    polling with `status`. See `world/statuspush.py`.
+
+    Args:
+        session (Session): The active Session.
+        args (list of str, optional): The fields to subscribe to, of
+            `typeclasses.characters.STATUS_FIELDS`. Defaults to all.
+
+    Answers:
+        status: The current values of the newly subscribed fields, then
+            the fields that changed whenever any do.
+        status_subscribed: `[field, ...]`, all subscribed fields.
+
+    """
+    puppet = session.puppet
+    if puppet is None or not hasattr(puppet, "subscribe_status"):
+        session.msg(status_subscribed=([], {}))
+        return
+    session.msg(status_subscribed=(sorted(puppet.subscribe_status(session, args)), {}))
+
+
+@oob.handler(rate=_POLL_RATE)
+def status_unsubscribe(session, *args, **kwargs):
+    """
+    Stop getting changes of the puppeted character's status.
+
+    Args:
+        session (Session): The active Session.
+        args (list of str, optional): The fields to unsubscribe from.
+            Defaults to all.
+
+    Answers:
+        status_subscribed: `[field, ...]`, the fields still subscribed.
+
+    """
+    puppet = session.puppet
+    if puppet is None or not hasattr(puppet, "unsubscribe_status"):
+        session.msg(status_subscribed=([], {}))
+        return
+    session.msg(status_subscribed=(sorted(puppet.unsubscribe_status(session, args)), {}))
+
+
+@oob.handler(rate=_KEEPALIVE_RATE, burst=2)
+def keepalive(session, *args, **kwargs):
+    """
+    Keep an idle connection from timing out.
+
+    Args:
+        session (Session): The active Session.
+        args (list, optional): A token to send back, such as the
+            client's time, for measuring round trips.
+
+    Answers:
+        pong: `[token]`.
+
+    """
+    session.cmd_last = time()
+    session.msg(pong=(args[:1], {}))
+
 
 # def oob_echo(session, *args, **kwargs):
 #     """
@@ -18,7 +18,13 @@ returning False.
 Lock functions in this module extend (and will overload same-named)
 lock functions from evennia.locks.lockfuncs.
 
+Lock functions whose result only depends on their arguments and the
+permissions, tags and locks of the objects involved can be decorated
+with `@pure`. The results of locks using only pure lock functions are
+then memoized (see world/lockcache.py).
+
 """
+from world.lockcache import pure  # noqa - for decorating lockfuncs
 
 # def myfalse(accessing_obj, accessed_obj, *args, **kwargs):
 #    """
@@ -28,3 +34,12 @@ lock functions from evennia.locks.lockfuncs.
 #    """
 #    print "%s tried to access %s. Access denied." % (accessing_obj, accessed_obj)
 #    return False
+#
+#
+# @pure
+# def named(accessing_obj, accessed_obj, *args, **kwargs):
+#    """
+#    called in lockstring with named(Griatch).
+#    Passes if the accessing object has one of the given keys.
+#    """
+#    return accessing_obj.key in args
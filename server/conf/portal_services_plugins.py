@@ -13,12 +13,15 @@ anything. Plugin services are started last in the Portal startup
 process.
 
 """
+from world import startprofile
 
 
+@startprofile.timed("portal start_plugin_services")
 def start_plugin_services(portal):
     """
     This hook is called by Evennia, last in the Portal startup process.
 
     portal - a reference to the main portal application.
     """
-    pass
+    # the last startup hook; write the startup profile, if profiling
+    startprofile.schedule_report("portal")
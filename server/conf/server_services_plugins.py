@@ -13,12 +13,15 @@ can be added to it). The function should not return anything. Plugin
 services are started last in the Server startup process.
 
 """
+from world import startprofile
 
 
+@startprofile.timed("server start_plugin_services")
 def start_plugin_services(server):
     """
     This hook is called by Evennia, last in the Server startup process.
 
     server - a reference to the main server application.
     """
-    pass
+    # the last startup hook; write the startup profile, if profiling
+    startprofile.schedule_report("server")
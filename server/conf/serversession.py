@@ -21,7 +21,16 @@ settings file:
 
 """
 
+from django.conf import settings
 from evennia.server.serversession import ServerSession as BaseServerSession
+from world import rendercache
+
+_RENDER_CACHE = getattr(settings, "RENDER_CACHE", True)
+_INLINEFUNC_ENABLED = getattr(settings, "INLINEFUNC_ENABLED", False)
+_TELNET_PROTOCOLS = ("telnet", "ssl", "ssh")
+_WEB_PROTOCOLS = ("websocket", "ajax/comet")
+# options the portal handles text differently for
+_UNRENDERED_OPTIONS = ("raw", "send_prompt", "screenreader", "echo")
 
 
 class ServerSession(BaseServerSession):
@@ -32,5 +41,73 @@ class ServerSession(BaseServerSession):
     Each account gets one or more sessions assigned to them whenever they connect
     to the game server. All communication between game and account goes
     through their session(s).
+
+    Text sent to telnet, ssh and webclient sessions is rendered here,
+    through a cache shared by all sessions (see `world.rendercache`),
+    instead of by the portal for every session.
     """
-    pass
+
+    def render_profile(self, options=None):
+        """
+        Get the capability profile of this session's client, the same
+        way its portal protocol would.
+
+        Args:
+            options (dict, optional): The options text is sent with,
+                which override the protocol flags.
+
+        Returns:
+            profile (str or None): The profile, or `None` if text to
+                this session should be left to the portal.
+
+        """
+        options = options or {}
+        flags = self.protocol_flags
+        if flags.get("RAW") or flags.get("SCREENREADER") or any(
+                options.get(option) for option in _UNRENDERED_OPTIONS):
+            return None
+        protocol = self.protocol_key
+        if protocol in _TELNET_PROTOCOLS:
+            ttype = flags.get("TTYPE")
+            return rendercache.telnet_profile(
+                xterm256=options.get("xterm256", flags.get("XTERM256", False) if ttype else True),
+                ansi=options.get("ansi", flags.get("ANSI", False) if ttype else True),
+                nocolor=options.get("nocolor", flags.get("NOCOLOR", False)),
+                mxp=options.get("mxp", flags.get("MXP", False)))
+        if protocol in _WEB_PROTOCOLS:
+            return rendercache.web_profile(nocolor=options.get("nocolor", flags.get("NOCOLOR", False)))
+        return None
+
+    def data_out(self, **kwargs):
+        """
+        Send data to the client, rendering its text through the render
+        cache.
+
+        Kwargs:
+            kwargs (any): Output functions and their data, as for
+                `msg`. Only plain `text`, alone or with `options`, is
+                rendered here.
+
+        """
+        text = kwargs.get("text")
+        if _RENDER_CACHE and text is not None and len(kwargs) <= 2 and (
+                len(kwargs) == 1 or "options" in kwargs):
+            textkwargs = {}
+            if isinstance(text, (tuple, list)):
+                if len(text) == 2 and isinstance(text[1], dict):
+                    text, textkwargs = text
+                else:
+                    text = None
+            options = kwargs.get("options") or {}
+            profile = self.render_profile(options) if text is not None else None
+            if profile is not None:
+                if _INLINEFUNC_ENABLED:
+                    # the session handler doesn't parse raw text
+                    from evennia.utils import inlinefuncs
+                    text = inlinefuncs.parse_inlinefunc(
+                        text, strip=options.get("strip_inlinefunc", False), session=self)
+                options = dict(options, raw=True)
+                text = rendercache.render(text, profile)
+                kwargs = {"text": (text, textkwargs) if textkwargs else text,
+                          "options": options}
+        super(ServerSession, self).data_out(**kwargs)
@@ -24,6 +24,11 @@ put secret game- or server-specific settings in secret_settings.py.
 
 """
 
+# Profile the startup if the STARTUP_PROFILE environment variable is
+# set, from here on (see world/startprofile.py)
+from world import startprofile
+startprofile.start()
+
 # Use the defaults from Evennia unless explicitly overridden
 from evennia.settings_default import *
 
@@ -56,6 +61,83 @@ WEBSOCKET_CLIENT_PORT = 4005
 # Internal Server-Portal port. Not visible.
 AMP_PORT = 4006
 
+######################################################################
+# Game-dir overrides of Evennia systems
+######################################################################
+
+# Trie-indexed command parser (see server/conf/cmdparser.py)
+COMMAND_PARSER = "server.conf.cmdparser.cmdparser"
+# Memoize cmdset merges (see commands/mergecache.py)
+CMDSET_MERGE_CACHE = True
+CMDSET_MERGE_CACHE_SIZE = 4096
+# Parent of the default commands, with a faster parse() (see
+# commands/command.py)
+COMMAND_DEFAULT_CLASS = "commands.command.MuxCommand"
+# Scripts with tick_bucketed = True share one timer per interval (see
+# world/scheduler.py), stepping through slots at least this many seconds
+# apart, at most this many per interval. A slot tick running over this
+# part of the time between slots is reported.
+SCRIPT_BUCKET_MIN_SLOT_TIME = 0.1
+SCRIPT_BUCKET_MAX_SLOTS = 100
+SCRIPT_BUCKET_BUDGET = 0.5
+# Seconds between batched writes of script pause/repeat state (see
+# world/scriptstate.py). A crash loses at most this much state.
+SCRIPT_STATE_FLUSH_INTERVAL = 30
+# Persistent channel messages are stored in batches (see
+# world/channelhistory.py): this often, or once this many are waiting
+CHANNEL_HISTORY_FLUSH_INTERVAL = 5
+CHANNEL_HISTORY_BATCH_SIZE = 200
+# Latest persistent messages kept in memory for each channel's history
+CHANNEL_SCROLLBACK_SIZE = 500
+# Compile lock strings, and memoize results of locks made of pure
+# lockfuncs (see world/lockcache.py)
+LOCK_COMPILE = True
+LOCK_RESULT_CACHE = True
+LOCK_RESULT_CACHE_SIZE = 10000
+# Match local object searches in memory (see world/nameindex.py)
+SEARCH_NAME_INDEX = True
+# Match global object searches in memory, suggesting ranked near misses
+# if nothing has the exact name (see world/fuzzysearch.py)
+SEARCH_FUZZY_INDEX = True
+# Webclient out-of-band polls (see server/conf/inputfuncs.py): answered
+# per second and session, and repeats within this many seconds coalesced
+OOB_POLL_RATE = 10
+OOB_POLL_COALESCE = 0.2
+# Parse each distinct string with inlinefuncs once, if INLINEFUNC_ENABLED
+# (see world/inlinecache.py)
+INLINEFUNC_TEMPLATE_CACHE = True
+INLINEFUNC_TEMPLATE_CACHE_SIZE = 1000
+# Render markup of outgoing text once per kind of client, caching up to
+# this many bytes (see server/conf/serversession.py)
+SERVER_SESSION_CLASS = "server.conf.serversession.ServerSession"
+RENDER_CACHE = True
+RENDER_CACHE_MEMORY = 4 * 1024 * 1024
+# Default of Object.write_behind: write Attribute updates in batches,
+# this often or once this many are waiting (see world/writebehind.py)
+ATTRIBUTE_WRITE_BEHIND = False
+ATTRIBUTE_WRITE_BEHIND_INTERVAL = 2
+ATTRIBUTE_WRITE_BEHIND_BATCH_SIZE = 1000
+# Format of new Attribute values, "pickle" or "compact"; all formats
+# are always readable (see world/serializer.py)
+ATTRIBUTE_SERIALIZER = "pickle"
+# Preload objects of these typeclasses (and their children) with their
+# Attributes and tags on start and reload, optionally in a background
+# thread (see world/warmup.py)
+WARMUP_ENABLED = True
+WARMUP_TYPECLASSES = ("typeclasses.rooms.Room", "typeclasses.exits.Exit")
+WARMUP_THREAD = False
+# Drop zones (rooms tagged in the "zone" category) from memory after
+# this many seconds without puppeted characters, checking this often;
+# 0 never drops them (see world/zones.py)
+ZONE_IDLE_TIME = 600
+ZONE_CHECK_INTERVAL = 60
+# Write the startup profile this many seconds after the plugin services
+# were started (see world/startprofile.py)
+STARTUP_PROFILE_REPORT_DELAY = 10
+# Import the systems used by commands and typeclasses when first used
+# rather than with the module (see world/lazyimport.py)
+LAZY_IMPORTS = True
+
 ######################################################################
 # Settings given in secret_settings.py override those in this file.
 ######################################################################
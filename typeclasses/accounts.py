@@ -23,6 +23,9 @@ several more options for customizing the Guest account system.
 """
 
 from evennia import DefaultAccount, DefaultGuest
+from world.lazyimport import lazy_import
+
+channels = lazy_import("typeclasses.channels")
 
 
 class Account(DefaultAccount):
@@ -92,7 +95,22 @@ class Account(DefaultAccount):
      at_server_shutdown()
 
     """
-    pass
+
+    def at_post_login(self, session=None, **kwargs):
+        """
+        Called at the end of the login process, just before letting
+        the account loose.
+        """
+        channels.account_connected(self)
+        super(Account, self).at_post_login(session=session, **kwargs)
+
+    def at_post_disconnect(self, **kwargs):
+        """
+        Called after a session disconnected; the account is only
+        offline once its last session is gone.
+        """
+        channels.account_disconnected(self)
+        super(Account, self).at_post_disconnect(**kwargs)
 
 
 class Guest(DefaultGuest):
@@ -100,4 +118,17 @@ class Guest(DefaultGuest):
     This class is used for guest logins. Unlike Accounts, Guests and their
     characters are deleted after disconnection.
     """
-    pass
+
+    def at_post_login(self, session=None, **kwargs):
+        """
+        Called at the end of the login process.
+        """
+        channels.account_connected(self)
+        super(Guest, self).at_post_login(session=session, **kwargs)
+
+    def at_post_disconnect(self, **kwargs):
+        """
+        Called after a session disconnected.
+        """
+        channels.account_disconnected(self)
+        super(Guest, self).at_post_disconnect(**kwargs)
@@ -10,9 +10,84 @@ Note that sending data to channels are handled via the CMD_CHANNEL
 syscommand (see evennia.syscmds). The sending should normally not need
 to be modified.
 
+Sending a message to a big channel is dominated by the fan-out to its
+subscribers. `Channel.distribute_message` here keeps the subscribers
+in memory, skips those who are offline using a set of connected
+accounts kept up to date by `typeclasses.accounts.Account`, formats
+the message once for each output variant and times each fan-out (see
+`Channel.fanout_stats`).
+
+Messages sent with `persistent=True` are stored in the background
+and the latest of them are kept in memory (see `world.channelhistory`);
+`Channel.history` includes those not stored yet.
+
 """
+from collections import OrderedDict
+from time import time
+from django.conf import settings
+from evennia import DefaultChannel, DefaultAccount
+from evennia.accounts.models import AccountDB
+from evennia.comms.models import Msg, TempMsg
+from evennia.utils import logger
+from evennia.utils.utils import make_iter
+from world.lazyimport import lazy_import
+
+channelhistory = lazy_import("world.channelhistory")
+
+# fan-outs slower than this (seconds) are logged
+_FANOUT_WARN_TIME = getattr(settings, "CHANNEL_FANOUT_WARN_TIME", 0.1)
+
+# ids of connected accounts; None until first needed
+_ONLINE = [None]
+# class: if it sends channel messages like DefaultAccount.msg does
+_DEFAULT_MSG = {}
 
-from evennia import DefaultChannel
+
+def _online_accounts():
+    if _ONLINE[0] is None:
+        _ONLINE[0] = set(AccountDB.objects.filter(
+            db_is_connected=True).values_list("id", flat=True))
+    return _ONLINE[0]
+
+
+def account_connected(account):
+    """
+    Mark an account as online, for channel fan-out.
+
+    Args:
+        account (Account): The account that logged in.
+
+    """
+    _online_accounts().add(account.id)
+
+
+def account_disconnected(account):
+    """
+    Mark an account as offline if it has no sessions left.
+
+    Args:
+        account (Account): The account that disconnected.
+
+    """
+    if not account.is_connected:
+        _online_accounts().discard(account.id)
+
+
+def _subscriber_key(entity):
+    return ("account" if isinstance(entity, AccountDB) else "object", entity.id)
+
+
+def _uses_default_msg(entity):
+    """
+    Check if the entity's class keeps the default `Account.msg`, so that
+    the fan-out may send to its sessions directly.
+    """
+    cls = type(entity)
+    if cls not in _DEFAULT_MSG:
+        msg = getattr(cls.msg, "__func__", cls.msg)
+        _DEFAULT_MSG[cls] = (isinstance(entity, AccountDB) and
+                             msg is getattr(DefaultAccount.msg, "__func__", DefaultAccount.msg))
+    return _DEFAULT_MSG[cls]
 
 
 class Channel(DefaultChannel):
@@ -57,5 +132,283 @@ class Channel(DefaultChannel):
         pre_send_message(msg) - runs just before a message is sent to channel
         post_send_message(msg) - called just after message was sent to channel
 
+    History:
+        scrollback - the latest persistent messages, in memory
+        history(limit=20, since=None) - the latest persistent messages,
+                from the scrollback where possible
+
+    Fan-out hooks:
+        message_variant(receiver) - which output variant a receiver gets
+        format_variant(msgobj, variant) - text of an output variant
+
     """
-    pass
+
+    @property
+    def subscriber_cache(self):
+        """
+        All subscribers, kept in memory.
+
+        Returns:
+            subscribers (OrderedDict): Mapping `("account", id)` or
+                `("object", id)` to the subscriber.
+
+        """
+        subscribers = self.ndb._subscribers
+        if subscribers is None:
+            subscribers = OrderedDict((_subscriber_key(entity), entity)
+                                      for entity in self.subscriptions.all())
+            self.ndb._subscribers = subscribers
+        return subscribers
+
+    def reset_subscriber_cache(self):
+        """
+        Forget the cached subscribers, such as after changing
+        `subscriptions` directly rather than with `connect`/`disconnect`.
+        """
+        self.ndb._subscribers = None
+
+    def post_join_channel(self, joiner, **kwargs):
+        """
+        Called right after successful join.
+        """
+        self.subscriber_cache[_subscriber_key(joiner)] = joiner
+        super(Channel, self).post_join_channel(joiner, **kwargs)
+
+    def post_leave_channel(self, leaver, **kwargs):
+        """
+        Called right after successful leave.
+        """
+        self.subscriber_cache.pop(_subscriber_key(leaver), None)
+        super(Channel, self).post_leave_channel(leaver, **kwargs)
+
+    def online_subscribers(self):
+        """
+        Get the subscribers that are currently online.
+
+        Returns:
+            subscribers (list): Connected accounts, and puppeted objects.
+
+        """
+        online = _online_accounts()
+        return [entity for (kind, entid), entity in self.subscriber_cache.items()
+                if (entid in online if kind == "account" else entity.sessions.count())]
+
+    def message_variant(self, receiver):
+        """
+        Get which output variant of a message a receiver should get.
+        Messages are formatted once for each variant.
+
+        Args:
+            receiver (Account or Object): A subscriber.
+
+        Returns:
+            variant (hashable): Passed to `format_variant`. All receivers
+                get the same text by default.
+
+        """
+        return None
+
+    def format_variant(self, msgobj, variant):
+        """
+        Format the text of one output variant of a message.
+
+        Args:
+            msgobj (Msg or TempMsg): The message, after `message_transform`.
+            variant (hashable): As returned by `message_variant`.
+
+        Returns:
+            text (str): The text to send.
+
+        """
+        return msgobj.message
+
+    def distribute_message(self, msgobj, online=False, **kwargs):
+        """
+        Send a message to all subscribers of the channel.
+
+        Args:
+            msgobj (Msg or TempMsg): Message to distribute.
+            online (bool): Only send to subscribers that are online.
+                Offline accounts using the default `msg` are always
+                skipped, as they have no sessions to send to.
+
+        """
+        t0 = time()
+        online_ids = _online_accounts()
+        muted = set(_subscriber_key(entity) for entity in (self.mutelist or ()))
+        senders = msgobj.senders
+        options = {"from_channel": self.id}
+        texts = {}
+        nsent = 0
+        for key, entity in self.subscriber_cache.items():
+            if key in muted:
+                continue
+            fast = _uses_default_msg(entity)
+            if (fast or online) and (key[1] not in online_ids if key[0] == "account"
+                                     else not entity.sessions.count()):
+                continue
+            variant = self.message_variant(entity)
+            if variant not in texts:
+                texts[variant] = self.format_variant(msgobj, variant)
+            text = texts[variant]
+            try:
+                if not fast:
+                    entity.msg(text, from_obj=senders, options=options)
+                    nsent += 1
+                    continue
+                # what DefaultAccount.msg does, without rebuilding its
+                # arguments for every receiver
+                for sender in senders:
+                    try:
+                        sender.at_msg_send(text=text, to_obj=entity)
+                    except Exception:
+                        logger.log_trace()
+                try:
+                    if not entity.at_msg_receive(text=text):
+                        continue
+                except Exception:
+                    logger.log_trace()
+                for session in entity.sessions.all():
+                    session.data_out(text=text, options=options)
+                nsent += 1
+            except AttributeError as err:
+                logger.log_trace("%s\nCannot send msg to '%s'." % (err, entity))
+
+        if getattr(msgobj, "keep_log", False):
+            logger.log_file(msgobj.message,
+                            self.attributes.get("log_file") or "channel_%s.log" % self.key)
+
+        spent = time() - t0
+        stats = self.fanout_stats()
+        stats["messages"] += 1
+        stats["total"] += spent
+        stats["last"] = spent
+        stats["last_receivers"] = nsent
+        stats["variants"] = len(texts)
+        stats["worst"] = max(stats["worst"], spent)
+        if spent > _FANOUT_WARN_TIME:
+            logger.log_warn("Channel %s: fan-out to %i receivers took %.1fms." %
+                            (self.key, nsent, spent * 1000))
+
+    def fanout_stats(self):
+        """
+        Get timings of this channel's message fan-outs since the last
+        reload.
+
+        Returns:
+            stats (dict): With keys `messages`, `total`, `last` and `worst`
+                (seconds), `last_receivers` and `variants` (of the last
+                message).
+
+        """
+        stats = self.ndb._fanout_stats
+        if stats is None:
+            stats = {"messages": 0, "total": 0.0, "last": 0.0, "worst": 0.0,
+                     "last_receivers": 0, "variants": 0}
+            self.ndb._fanout_stats = stats
+        return stats
+
+    def msg(self, msgobj, header=None, senders=None, sender_strings=None,
+            persistent=False, **kwargs):
+        """
+        Send a message to the channel. This is `DefaultChannel.msg`, with
+        persistent messages being queued for storing instead of being
+        stored while sending.
+
+        Args:
+            msgobj (Msg, TempMsg or str): The message to send.
+            header (str, optional): Header of the message.
+            senders (Object, Account or list, optional): Who sent it.
+            sender_strings (list, optional): Names of external senders.
+            persistent (bool, optional): Store the message in the channel
+                history.
+
+        Kwargs:
+            Passed on to `DefaultChannel.msg`.
+
+        Returns:
+            success (bool): If the message was sent.
+
+        """
+        if persistent and not isinstance(msgobj, Msg):
+            if not isinstance(msgobj, TempMsg):
+                msgobj = TempMsg(senders=make_iter(senders) if senders else [],
+                                 header=header, message=msgobj, channels=[self])
+            msgobj.persistent = True
+        return super(Channel, self).msg(msgobj, header=header, senders=senders,
+                                        sender_strings=sender_strings, **kwargs)
+
+    def post_send_message(self, msg, **kwargs):
+        """
+        Called just after a message was sent to the channel.
+        """
+        if getattr(msg, "persistent", False):
+            channelhistory.queue(msg)
+            if self.ndb._scrollback is not None:
+                self.ndb._scrollback.append(channelhistory.compact(msg))
+        super(Channel, self).post_send_message(msg, **kwargs)
+
+    @property
+    def scrollback(self):
+        """
+        The latest persistent messages of the channel, kept in memory.
+        Loaded from the database the first time it's needed.
+
+        Returns:
+            scrollback (Scrollback): The messages.
+
+        """
+        scrollback = self.ndb._scrollback
+        if scrollback is None:
+            stored = self._stored_history(channelhistory.SCROLLBACK_SIZE)
+            entries = [channelhistory.compact(msgobj)
+                       for msgobj in stored + channelhistory.pending(self)]
+            scrollback = channelhistory.Scrollback(
+                entries=entries, complete=len(stored) < channelhistory.SCROLLBACK_SIZE)
+            self.ndb._scrollback = scrollback
+        return scrollback
+
+    def _stored_history(self, limit, since=None):
+        """
+        Get the latest stored messages of the channel, oldest first.
+        """
+        stored = Msg.objects.get_messages_by_channel(self)
+        if since is not None:
+            stored = stored.filter(db_date_created__gte=channelhistory.from_timestamp(since))
+        stored = stored.order_by("-db_date_created", "-id").prefetch_related(
+            "db_sender_accounts", "db_sender_objects", "db_sender_scripts")
+        return list(stored[:limit])[::-1]
+
+    def history(self, limit=20, since=None):
+        """
+        Get the latest persistent messages of the channel. These come from
+        the channel's `scrollback`, unless reaching further back than it.
+
+        Args:
+            limit (int, optional): The most messages to get.
+            since (float, optional): Only get messages sent at or after
+                this time stamp.
+
+        Returns:
+            entries (list): `(timestamp, sender id, text)` tuples, oldest
+                first.
+
+        """
+        if limit <= 0:
+            # a [-0:] slice would be everything
+            return []
+        scrollback = self.scrollback
+        if since is None:
+            if scrollback.covers_last(limit):
+                return scrollback.last(limit)
+        elif scrollback.covers_since(since):
+            return scrollback.since(since)[-limit:]
+
+        messages = channelhistory.pending(self)
+        if since is not None:
+            messages = [msgobj for msgobj in messages
+                        if channelhistory.to_timestamp(msgobj.date_created) >= since]
+        messages = messages[-limit:]
+        if len(messages) < limit:
+            messages = self._stored_history(limit - len(messages), since=since) + messages
+        return [channelhistory.compact(msgobj) for msgobj in messages]
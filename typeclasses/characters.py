@@ -7,10 +7,50 @@ is setup to be the "default" character type created by the default
 creation commands.
 
 """
+from collections import Counter
 from evennia import DefaultCharacter
+from evennia.utils.utils import lazy_property, make_iter
+from typeclasses.objects import Object, WriteBehindAttributeHandler
+from world.lazyimport import lazy_import
 
+lockcache = lazy_import("world.lockcache")
+statuspush = lazy_import("world.statuspush")
 
-class Character(DefaultCharacter):
+# the fields of Character.get_status
+STATUS_FIELDS = ("hp", "location", "inventory")
+# the fields stored as Attributes of the same name
+STATUS_ATTRIBUTES = ("hp",)
+
+
+class StatusAttributeHandler(WriteBehindAttributeHandler):
+    """
+    Attribute handler telling the character's status subscribers about
+    changes of the Attributes in `STATUS_ATTRIBUTES`.
+
+    """
+
+    def _changed(self, keys):
+        fields = [key for key in make_iter(keys) if key in STATUS_ATTRIBUTES]
+        if fields:
+            self.obj.status_changed(*fields)
+
+    def add(self, key, *args, **kwargs):
+        result = super(StatusAttributeHandler, self).add(key, *args, **kwargs)
+        self._changed(key)
+        return result
+
+    def remove(self, key, *args, **kwargs):
+        result = super(StatusAttributeHandler, self).remove(key, *args, **kwargs)
+        self._changed(key)
+        return result
+
+    def clear(self, *args, **kwargs):
+        result = super(StatusAttributeHandler, self).clear(*args, **kwargs)
+        self._changed(STATUS_ATTRIBUTES)
+        return result
+
+
+class Character(Object, DefaultCharacter):
     """
     The Character defaults to reimplementing some of base Object's hook methods with the
     following functionality:
@@ -29,5 +69,197 @@ class Character(DefaultCharacter):
                     pre_logout_location Attribute and move it back on the grid.
     at_post_puppet - Echoes "AccountName has entered the game" to the room.
 
+    Sessions can subscribe to the fields of `get_status`, to be sent
+    the fields that changed (see `world.statuspush`).
+
     """
-    pass
+
+    @lazy_property
+    def attributes(self):
+        return StatusAttributeHandler(self)
+
+    def at_post_puppet(self, **kwargs):
+        """
+        Called just after puppeting has been completed and all
+        Account<->Object links have been established.
+        """
+        if self.location:
+            # we have a session now, so will receive room messages
+            self.location.update_contents_index(self)
+        # locks checking the account now see a different one
+        lockcache.changed()
+        super(Character, self).at_post_puppet(**kwargs)
+
+    def at_post_unpuppet(self, account, session=None, **kwargs):
+        """
+        Called just after the Account successfully disconnected from
+        this object, severing all connections.
+
+        Args:
+            account (Account): The account object that just disconnected
+                from this object.
+            session (Session): Session id controlling the connection that
+                just disconnected.
+
+        """
+        location = self.location
+        lockcache.changed()
+        if session:
+            self.unsubscribe_status(session)
+        super(Character, self).at_post_unpuppet(account, session=session, **kwargs)
+        if location:
+            location.update_contents_index(self, removed=self.location != location)
+
+    def at_after_move(self, source_location, **kwargs):
+        """
+        Called after the character moved.
+
+        Args:
+            source_location (Object): Where it came from.
+
+        """
+        super(Character, self).at_after_move(source_location, **kwargs)
+        self.status_changed("location")
+
+    def update_name_index(self, obj, removed=False):
+        """
+        Called when something enters or leaves the inventory, or is
+        renamed in it.
+
+        Args:
+            obj (Object): The object in (or just leaving) the inventory.
+            removed (bool, optional): If `obj` is leaving.
+
+        """
+        super(Character, self).update_name_index(obj, removed=removed)
+        self.status_changed("inventory")
+
+    def get_status(self, fields=None):
+        """
+        Get the status shown by the webclient (see the `status` input
+        function in `server/conf/inputfuncs.py`).
+
+        Args:
+            fields (iterable, optional): The fields to get, of
+                `STATUS_FIELDS`. Defaults to all of them.
+
+        Returns:
+            status (dict): Values that can be sent as JSON:
+                hp (int or None): The `hp` Attribute.
+                location (list or None): `[id, key]` of the location.
+                inventory (list): `[key, count]` of the things carried,
+                    sorted by key.
+
+        """
+        status = {}
+        for field in (fields or STATUS_FIELDS):
+            if field == "hp":
+                status["hp"] = self.attributes.get("hp")
+            elif field == "location":
+                location = self.location
+                status["location"] = [location.id, location.key] if location else None
+            elif field == "inventory":
+                counts = Counter(obj.key for obj in self.contents
+                                 if obj.destination is None)
+                status["inventory"] = sorted([key, count] for key, count in counts.items())
+        return status
+
+    def subscribe_status(self, session, fields=None):
+        """
+        Send a session the changes of some status fields from now on,
+        starting with their current values.
+
+        Args:
+            session (Session): The subscribing session.
+            fields (iterable, optional): The fields, of `STATUS_FIELDS`.
+                Defaults to all of them.
+
+        Returns:
+            fields (set): All fields the session is now subscribed to.
+
+        """
+        subscriptions = self.ndb._status_subscriptions
+        if subscriptions is None:
+            subscriptions = self.ndb._status_subscriptions = {}
+        entry = subscriptions.get(session.sessid)
+        if entry is None:
+            # [subscribed fields, values last sent]
+            entry = subscriptions[session.sessid] = [set(), {}]
+        new = set(fields or STATUS_FIELDS).intersection(STATUS_FIELDS) - entry[0]
+        entry[0].update(new)
+        if new:
+            delta = statuspush.diff(self.get_status(new), entry[1])
+            if delta:
+                session.msg(status=delta)
+        return set(entry[0])
+
+    def unsubscribe_status(self, session, fields=None):
+        """
+        Stop sending a session changes of status fields.
+
+        Args:
+            session (Session): The subscribed session.
+            fields (iterable, optional): The fields to unsubscribe
+                from. Defaults to all of them.
+
+        Returns:
+            fields (set): The fields the session is still subscribed to.
+
+        """
+        subscriptions = self.ndb._status_subscriptions
+        entry = subscriptions.get(session.sessid) if subscriptions else None
+        if entry is None:
+            return set()
+        for field in (fields or STATUS_FIELDS):
+            entry[0].discard(field)
+            entry[1].pop(field, None)
+        if not entry[0]:
+            del subscriptions[session.sessid]
+        return set(entry[0])
+
+    def status_changed(self, *fields):
+        """
+        Note that status fields may have changed. Subscribed sessions
+        are sent those that did at the end of the reactor tick.
+
+        Args:
+            fields (str): The fields. Defaults to all of them.
+
+        """
+        if self.ndb._status_subscriptions:
+            statuspush.mark(self, fields or STATUS_FIELDS)
+
+    def push_status(self, fields):
+        """
+        Send subscribed sessions the fields that changed since they
+        were last sent. Called by `world.statuspush`.
+
+        Args:
+            fields (iterable): The fields that may have changed.
+
+        Returns:
+            nmessages (int): How many sessions were sent changes.
+
+        """
+        subscriptions = self.ndb._status_subscriptions
+        if not subscriptions:
+            return 0
+        sessions = dict((session.sessid, session) for session in self.sessions.all())
+        for sessid in list(subscriptions):
+            if sessid not in sessions:
+                del subscriptions[sessid]
+        wanted = set()
+        for subscribed, _ in subscriptions.values():
+            wanted.update(subscribed)
+        wanted.intersection_update(fields)
+        if not wanted:
+            return 0
+        values = self.get_status(wanted)
+        nmessages = 0
+        for sessid, (subscribed, sent) in subscriptions.items():
+            delta = statuspush.diff(dict((field, values[field]) for field in subscribed
+                                         if field in values), sent)
+            if delta:
+                sessions[sessid].msg(status=delta)
+                nmessages += 1
+        return nmessages
@@ -7,9 +7,14 @@ for allowing Characters to traverse the exit to its destination.
 
 """
 from evennia import DefaultExit
+from typeclasses.objects import Object
+from world.lazyimport import lazy_import
 
+exitgraph = lazy_import("world.exitgraph")
+mergecache = lazy_import("commands.mergecache")
 
-class Exit(DefaultExit):
+
+class Exit(Object, DefaultExit):
     """
     Exits are connectors between rooms. Exits are normal Objects except
     they defines the `destination` property. It also does work in the
@@ -33,5 +38,83 @@ class Exit(DefaultExit):
         at_failed_traverse(traveller) - called by at_traverse if traversal failed for some reason. Will
                                         not be called if the attribute `err_traverse` is
                                         defined, in which case that will simply be echoed.
+
+    Exits in a Room don't get a cmdset of their own. They are kept in the world's
+    exit graph (see `world.exitgraph`) and the Room provides one shared cmdset
+    holding the traversal commands of all its exits.
     """
-    pass
+
+    def at_object_creation(self):
+        """
+        Called once, when the exit is first created.
+        """
+        super(Exit, self).at_object_creation()
+        # the location has a new exit, cached cmdset merges are outdated
+        mergecache.invalidate()
+
+    def basetype_posthook_setup(self):
+        """
+        Called once, after the exit has been created and all its
+        creation hooks have run.
+        """
+        super(Exit, self).basetype_posthook_setup()
+        exitgraph.update_exit(self)
+
+    def at_cmdset_get(self, **kwargs):
+        """
+        Called just before the command handler requests a cmdset from
+        this exit. A `force_init` kwarg means the exit's key, aliases or
+        destination changed.
+        """
+        if "force_init" in kwargs:
+            exitgraph.update_exit(self)
+        if not getattr(self.location, "shares_exit_cmdset", False):
+            # outside a Room, provide our own cmdset as usual
+            super(Exit, self).at_cmdset_get(**kwargs)
+
+    def at_db_key_postsave(self, new):
+        """
+        Called by Evennia after the key was saved.
+
+        Args:
+            new (bool): If the exit was just created.
+
+        """
+        super(Exit, self).at_db_key_postsave(new)
+        if not new:
+            exitgraph.update_exit(self)
+
+    def at_db_destination_postsave(self, new):
+        """
+        Called by Evennia after the destination was saved, such as by
+        `@link` or `@unlink`.
+
+        Args:
+            new (bool): If the exit was just created.
+
+        """
+        if not new:
+            exitgraph.update_exit(self)
+
+    def at_after_move(self, source_location, **kwargs):
+        """
+        Called after the exit has been moved to a new location.
+
+        Args:
+            source_location (Object): Where the exit was before.
+
+        """
+        super(Exit, self).at_after_move(source_location, **kwargs)
+        exitgraph.update_exit(self)
+
+    def at_object_delete(self):
+        """
+        Called just before the exit is deleted.
+
+        Returns:
+            delete (bool): If `False`, deletion is aborted.
+
+        """
+        mergecache.invalidate()
+        exitgraph.remove_exit(self)
+        return super(Exit, self).at_object_delete()
@@ -5,12 +5,77 @@ The Object is the "naked" base class for things in the game world.
 
 Note that the default Character, Room and Exit does not inherit from
 this Object, but from their respective default implementations in the
-evennia library. If you want to use this class as a parent to change
-the other types, you can do so by adding this as a multiple
-inheritance.
+evennia library. In this game they add this class as a multiple
+inheritance, so changes here apply to them as well.
 
 """
+from collections import OrderedDict
+from django.conf import settings
+from django.utils.six import string_types
 from evennia import DefaultObject
+from evennia.typeclasses.attributes import AttributeHandler
+from evennia.typeclasses.tags import AliasHandler
+from evennia.utils.utils import is_iter, make_iter, lazy_property, variable_from_module
+from world.lazyimport import lazy_import
+
+at_search = lazy_import("server.conf.at_search")
+fuzzysearch = lazy_import("world.fuzzysearch")
+nameindex = lazy_import("world.nameindex")
+writebehind = lazy_import("world.writebehind")
+
+_NAME_INDEX = getattr(settings, "SEARCH_NAME_INDEX", True)
+_FUZZY_INDEX = getattr(settings, "SEARCH_FUZZY_INDEX", True)
+_WRITE_BEHIND = getattr(settings, "ATTRIBUTE_WRITE_BEHIND", False)
+_AT_SEARCH_RESULT = None
+
+
+class IndexedAliasHandler(AliasHandler):
+    """
+    Alias handler telling the location's name index about changes.
+
+    """
+
+    def _changed(self):
+        location = self.obj.location
+        if location:
+            location.update_name_index(self.obj)
+        fuzzysearch.update_object(self.obj)
+
+    def add(self, *args, **kwargs):
+        result = super(IndexedAliasHandler, self).add(*args, **kwargs)
+        self._changed()
+        return result
+
+    def remove(self, *args, **kwargs):
+        result = super(IndexedAliasHandler, self).remove(*args, **kwargs)
+        self._changed()
+        return result
+
+    def clear(self, *args, **kwargs):
+        result = super(IndexedAliasHandler, self).clear(*args, **kwargs)
+        self._changed()
+        return result
+
+
+class WriteBehindAttributeHandler(AttributeHandler):
+    """
+    Attribute handler deferring updates of existing Attributes to
+    `world.writebehind` if the object's typeclass sets `write_behind`.
+
+    """
+
+    def add(self, key, value, category=None, lockstring="", strattr=False,
+            accessing_obj=None, default_access=True):
+        if (getattr(self.obj, "write_behind", False) and self.obj.id and
+                isinstance(key, string_types) and not (lockstring or strattr) and
+                accessing_obj is None):
+            attr = self.get(key, category=category, return_obj=True)
+            if attr is not None and not isinstance(attr, list):
+                writebehind.write(self.obj, attr, value)
+                return
+        return super(WriteBehindAttributeHandler, self).add(
+            key, value, category=category, lockstring=lockstring, strattr=strattr,
+            accessing_obj=accessing_obj, default_access=default_access)
 
 
 class Object(DefaultObject):
@@ -160,4 +225,253 @@ class Object(DefaultObject):
                                  object speaks
 
      """
-    pass
+    # Objects without sessions normally don't get messages sent with
+    # msg_contents. Set this on typeclasses that still need to (such as
+    # NPCs reacting to what is said around them).
+    listens_to_room = False
+
+    # Set on typeclasses whose Attributes are updated often (such as
+    # NPCs in combat) to write updates in batches (see world/writebehind.py)
+    write_behind = _WRITE_BEHIND
+
+    @lazy_property
+    def attributes(self):
+        return WriteBehindAttributeHandler(self)
+
+    @lazy_property
+    def aliases(self):
+        return IndexedAliasHandler(self)
+
+    def message_receivers(self):
+        """
+        Get the objects in this object's contents that should receive
+        messages sent with `msg_contents`. These are the objects with
+        connected sessions and those with `listens_to_room` set.
+
+        Returns:
+            receivers (list): The receiving objects. This is cached and
+                updated as objects enter or leave and as Characters are
+                puppeted/unpuppeted, so it should not be modified.
+
+        """
+        receivers = self.ndb._message_receivers
+        if receivers is None:
+            receivers = [obj for obj in self.contents
+                         if getattr(obj, "listens_to_room", False) or obj.sessions.count()]
+            self.ndb._message_receivers = receivers
+        return receivers
+
+    def update_contents_index(self, obj, removed=False):
+        """
+        Called when an object enters or leaves this object, or when
+        something about it that affects `message_receivers` changes
+        (such as it being puppeted or unpuppeted).
+
+        Args:
+            obj (Object): The object in (or just leaving) our contents.
+            removed (bool, optional): If `obj` is leaving.
+
+        """
+        self.ndb._message_receivers = None
+        self.update_name_index(obj, removed=removed)
+
+    def update_name_index(self, obj, removed=False):
+        """
+        Update the name index of our contents (see `world.nameindex`)
+        for an object entering or leaving, or being renamed or
+        re-aliased.
+
+        Args:
+            obj (Object): The object in (or just leaving) our contents.
+            removed (bool, optional): If `obj` is leaving.
+
+        """
+        index = self.ndb._name_index
+        if index is not None:
+            if removed:
+                index.remove(obj)
+            else:
+                index.add(obj)
+
+    def at_db_key_postsave(self, new):
+        """
+        Called by Evennia after the key was saved.
+
+        Args:
+            new (bool): If the object was just created.
+
+        """
+        if not new:
+            if self.location:
+                self.location.update_name_index(self)
+            fuzzysearch.update_object(self)
+
+    def search(self, searchdata, global_search=False, use_nicks=True, typeclass=None,
+               location=None, attribute_name=None, quiet=False, exact=False,
+               candidates=None, nofound_string=None, multimatch_string=None, **kwargs):
+        """
+        Returns an Object matching a search string/condition. See
+        `DefaultObject.search` for the arguments.
+
+        Notes:
+            Plain local searches by key or alias (the most common kind)
+            are answered from the name indexes of our location and
+            inventory (see `world.nameindex`) without querying the
+            database. Plain global searches use the fuzzy search index
+            (see `server.conf.at_search.global_search`); if nothing has
+            the exact name, the near misses are suggested in the
+            not-found message, but never used as the match. All other
+            searches are passed on to Evennia.
+
+        """
+        search_args = dict(global_search=global_search, use_nicks=use_nicks,
+                           typeclass=typeclass, location=location,
+                           attribute_name=attribute_name, quiet=quiet, exact=exact,
+                           candidates=candidates, nofound_string=nofound_string,
+                           multimatch_string=multimatch_string)
+        search_args.update(kwargs)
+        if (not (_FUZZY_INDEX if global_search else _NAME_INDEX) or typeclass or location or
+                attribute_name or candidates is not None or kwargs or
+                not isinstance(searchdata, string_types)):
+            return super(Object, self).search(searchdata, **search_args)
+        if use_nicks:
+            searchdata = self.nicks.nickreplace(searchdata, categories=("object", "account"),
+                                                include_account=True)
+            search_args["use_nicks"] = False
+        query = searchdata.strip().lower()
+        if query in ("here", "me", "self") or (query.startswith("#") and query[1:].isdigit()):
+            return super(Object, self).search(searchdata, **search_args)
+
+        here = self.location
+        if global_search:
+            results = at_search.global_search(searchdata)
+            if not results and not quiet and nofound_string is None:
+                near = at_search.suggestions(searchdata)
+                if near:
+                    nofound_string = "Could not find '%s'. Did you mean %s?" % (
+                        searchdata, ", ".join(OrderedDict((obj.key, True) for obj in near)))
+        elif here:
+            results = nameindex.search(searchdata, [self, here], extras=[here], exact=exact)
+        else:
+            results = nameindex.search(searchdata, [self], extras=[self], exact=exact)
+        if quiet:
+            return results
+        global _AT_SEARCH_RESULT
+        if _AT_SEARCH_RESULT is None:
+            _AT_SEARCH_RESULT = variable_from_module(*settings.SEARCH_AT_RESULT.rsplit(".", 1))
+        return _AT_SEARCH_RESULT(results, self, query=searchdata,
+                                 nofound_string=nofound_string,
+                                 multimatch_string=multimatch_string)
+
+    def msg_contents(self, text=None, exclude=None, from_obj=None, mapping=None, **kwargs):
+        """
+        Emits a message to all objects inside this object.
+
+        Args:
+            text (str or tuple): Message to send. If a tuple, this should be
+                on the valid OOB outmessage form `(message, {kwargs})`,
+                where kwargs are optional data passed to the `text`
+                outputfunc.
+            exclude (list, optional): A list of objects not to send to.
+            from_obj (Object, optional): An object designated as the
+                "sender" of the message. See `DefaultObject.msg()` for
+                more info.
+            mapping (dict, optional): A mapping of formatting keys
+                `{"key":<object>, "key2":<object2>,...}. The keys
+                must match `{key}` markers in the `text` if this is a string or
+                in the internal `message` if `text` is a tuple. These
+                formatting statements will be
+                replaced by the return of `<object>.get_display_name(looker)`
+                for every looker in contents that receives the
+                message. This allows for every object to potentially
+                get its own customized string.
+        Kwargs:
+            Keyword arguments will be passed on to `obj.msg()` for all
+            messaged objects.
+
+        Notes:
+            Unlike the default implementation this only messages the
+            objects returned by `message_receivers`, and formats the
+            message only once for every distinct set of display names
+            rather than once per receiver.
+
+        """
+        # we also accept an outcommand on the form (message, {kwargs})
+        is_outcmd = text and is_iter(text)
+        inmessage = text[0] if is_outcmd else text
+        outkwargs = text[1] if is_outcmd and len(text) > 1 else {}
+
+        receivers = self.message_receivers()
+        if exclude:
+            exclude = make_iter(exclude)
+            receivers = [obj for obj in receivers if obj not in exclude]
+        if not receivers:
+            return
+
+        if not mapping:
+            outtext = (inmessage, outkwargs)
+            for obj in receivers:
+                obj.msg(text=outtext, from_obj=from_obj, **kwargs)
+            return
+
+        # most receivers see the same display names; format every
+        # distinct combination only once
+        keys, subs = zip(*mapping.items())
+        outtexts = {}
+        for obj in receivers:
+            names = tuple(sub.get_display_name(obj) if hasattr(sub, "get_display_name")
+                          else str(sub) for sub in subs)
+            outtext = outtexts.get(names)
+            if outtext is None:
+                outtext = (inmessage.format(**dict(zip(keys, names))), outkwargs)
+                outtexts[names] = outtext
+            obj.msg(text=outtext, from_obj=from_obj, **kwargs)
+
+    def basetype_posthook_setup(self):
+        """
+        Called once, after the object has been created and all its
+        creation hooks have run.
+        """
+        super(Object, self).basetype_posthook_setup()
+        fuzzysearch.update_object(self)
+        if self.location:
+            # objects created in place never trigger at_object_receive
+            self.location.update_contents_index(self)
+
+    def at_object_receive(self, moved_obj, source_location, **kwargs):
+        """
+        Called after an object has been moved into this object.
+
+        Args:
+            moved_obj (Object): The object moved into this one.
+            source_location (Object): Where `moved_object` came from.
+
+        """
+        self.update_contents_index(moved_obj)
+        super(Object, self).at_object_receive(moved_obj, source_location, **kwargs)
+
+    def at_object_leave(self, moved_obj, target_location, **kwargs):
+        """
+        Called just before an object leaves this object.
+
+        Args:
+            moved_obj (Object): The object leaving.
+            target_location (Object): Where `moved_obj` is going.
+
+        """
+        self.update_contents_index(moved_obj, removed=True)
+        super(Object, self).at_object_leave(moved_obj, target_location, **kwargs)
+
+    def at_object_delete(self):
+        """
+        Called just before the object is deleted.
+
+        Returns:
+            delete (bool): If `False`, deletion is aborted.
+
+        """
+        if self.location:
+            self.location.update_contents_index(self, removed=True)
+        fuzzysearch.remove_object(self)
+        writebehind.discard(self)
+        return super(Object, self).at_object_delete()
@@ -4,11 +4,99 @@ Room
 Rooms are simple containers that has no location of their own.
 
 """
-
+from collections import OrderedDict
 from evennia import DefaultRoom
+from evennia.objects.models import ObjectDB
+from typeclasses.objects import Object
+from world.lazyimport import lazy_import
+
+exitgraph = lazy_import("world.exitgraph")
+mergecache = lazy_import("commands.mergecache")
+zones = lazy_import("world.zones")
+
 
+class ContentsIndex(object):
+    """
+    In-memory index of the contents of a Room, sorted into exits,
+    puppeted objects (those with connected sessions) and all other
+    objects. It is kept up to date by the Room's hooks rather than
+    being recomputed by filtering `contents`.
 
-class Room(DefaultRoom):
+    """
+
+    def __init__(self, contents=()):
+        """
+        Args:
+            contents (list, optional): The objects to index.
+
+        """
+        self.exits = OrderedDict()
+        self.puppets = OrderedDict()
+        self.others = OrderedDict()
+        self._lists = {}
+        for obj in contents:
+            self.add(obj)
+
+    def _category(self, obj):
+        if obj.destination:
+            return self.exits
+        if obj.sessions.count():
+            return self.puppets
+        return self.others
+
+    def add(self, obj):
+        """
+        Add an object to the index, or re-sort it if already indexed.
+
+        Args:
+            obj (Object): The object to add.
+
+        """
+        self.remove(obj)
+        self._category(obj)[obj.id] = obj
+
+    def remove(self, obj):
+        """
+        Remove an object from the index, if it is there.
+
+        Args:
+            obj (Object): The object to remove.
+
+        """
+        for category in (self.exits, self.puppets, self.others):
+            category.pop(obj.id, None)
+        self._lists.clear()
+
+    def get(self, name):
+        """
+        Get the objects in one category of the index.
+
+        Args:
+            name (str): One of `exits`, `puppets` or `others`, or
+                `receivers` for the puppets together with the other
+                objects that have `listens_to_room` set.
+
+        Returns:
+            objects (list): The indexed objects. This is cached until
+                the index changes and should not be modified.
+
+        """
+        objects = self._lists.get(name)
+        if objects is None:
+            if name == "receivers":
+                objects = list(self.puppets.values()) + [
+                    obj for obj in self.others.values()
+                    if getattr(obj, "listens_to_room", False)]
+            else:
+                objects = list(getattr(self, name).values())
+            self._lists[name] = objects
+        return objects
+
+    def __len__(self):
+        return len(self.exits) + len(self.puppets) + len(self.others)
+
+
+class Room(Object, DefaultRoom):
     """
     Rooms are like any Object, except their location is None
     (which is default). They also use basetype_setup() to
@@ -17,5 +105,166 @@ class Room(DefaultRoom):
 
     See examples/object.py for a list of
     properties and methods available on all Objects.
+
+    A room is in the zone given by its tag in the `zone` category.
+    Zones are loaded when a puppeted character enters them and dropped
+    from memory when left idle (see `world.zones`).
+
+    The contents of the room are indexed in memory (see
+    `ContentsIndex`), so `exits`, `puppets` and the receivers of
+    `msg_contents` don't need to be filtered out of `contents`.
+
+    Instead of every exit providing its own cmdset, the room holds one
+    cmdset with the traversal commands of all its exits, rebuilt only
+    when the exits change (see `world.exitgraph`).
     """
-    pass
+    # Exits in this room don't provide their own cmdsets
+    shares_exit_cmdset = True
+
+    @property
+    def zone(self):
+        """
+        The name of the zone this room is in, or None.
+        """
+        return zones.zone_of(self)
+
+    @property
+    def contents_index(self):
+        """
+        The `ContentsIndex` of this room. It is built from `contents`
+        the first time it is needed after the room was cached.
+        """
+        index = self.ndb._contents_index
+        if index is None:
+            index = ContentsIndex(self.contents)
+            self.ndb._contents_index = index
+        return index
+
+    @property
+    def exits(self):
+        """
+        Returns all exits from this room.
+        """
+        return self.contents_index.get("exits")
+
+    @property
+    def puppets(self):
+        """
+        Returns all objects in this room with connected sessions
+        (normally the puppeted Characters).
+        """
+        return self.contents_index.get("puppets")
+
+    def message_receivers(self):
+        """
+        Get the objects in the room that should receive messages sent
+        with `msg_contents`.
+
+        Returns:
+            receivers (list): The receiving objects.
+
+        """
+        return self.contents_index.get("receivers")
+
+    def update_contents_index(self, obj, removed=False):
+        """
+        Update the index for an object entering or leaving the room, or
+        being puppeted/unpuppeted.
+
+        Args:
+            obj (Object): The object in (or just leaving) the room.
+            removed (bool, optional): If `obj` is leaving.
+
+        """
+        self.update_name_index(obj, removed=removed)
+        if not removed and obj.sessions.count():
+            zones.visited(self)
+        index = self.ndb._contents_index
+        if index is not None:
+            if removed:
+                index.remove(obj)
+            else:
+                index.add(obj)
+
+    def reset_contents_index(self):
+        """
+        Drop the contents index (and the name index), so they are
+        rebuilt from `contents` the next time they are needed.
+        """
+        self.ndb._contents_index = None
+        self.ndb._name_index = None
+
+    def check_contents_index(self):
+        """
+        Compare the contents index with the database.
+
+        Returns:
+            errors (list): One string per difference found. Empty if
+                the index is consistent (or not yet built).
+
+        """
+        index = self.ndb._contents_index
+        if index is None:
+            return []
+        errors = []
+        db_contents = dict(ObjectDB.objects.filter(db_location=self).values_list(
+            "id", "db_destination"))
+        indexed = {}
+        for name in ("exits", "puppets", "others"):
+            for obj in index.get(name):
+                indexed[obj.id] = (name, obj)
+
+        for dbid in set(db_contents).difference(indexed):
+            errors.append("#%i is in the room but not in the index." % dbid)
+        for dbid in set(indexed).difference(db_contents):
+            errors.append("#%i is in the index but not in the room." % dbid)
+        for dbid in set(indexed).intersection(db_contents):
+            name, obj = indexed[dbid]
+            if (name == "exits") != (db_contents[dbid] is not None):
+                errors.append("#%i is indexed as %s but its destination is %s." % (
+                    dbid, name, db_contents[dbid]))
+            elif name != "exits" and (name == "puppets") != bool(obj.sessions.count()):
+                errors.append("#%i is indexed as %s but has %i session(s)." % (
+                    dbid, name, obj.sessions.count()))
+        return errors
+
+    def at_cmdset_get(self, **kwargs):
+        """
+        Called just before the command handler requests a cmdset from
+        this room. Replaces the room's exit cmdset if the exits changed
+        since it was added.
+        """
+        super(Room, self).at_cmdset_get(**kwargs)
+        version = exitgraph.room_version(self.id)
+        if self.ndb._exit_cmdset_version != version or "force_init" in kwargs:
+            self.cmdset.remove("_exitset")
+            if self.exits:
+                self.cmdset.add(exitgraph.exit_cmdset(self), permanent=False)
+            self.ndb._exit_cmdset_version = version
+
+    def at_object_receive(self, moved_obj, source_location, **kwargs):
+        """
+        Called after an object has been moved into this room.
+
+        Args:
+            moved_obj (Object): The object moved into this one.
+            source_location (Object): Where `moved_object` came from.
+
+        """
+        super(Room, self).at_object_receive(moved_obj, source_location, **kwargs)
+        if moved_obj.destination:
+            # an exit was added, cached cmdset merges are outdated
+            mergecache.invalidate()
+
+    def at_object_leave(self, moved_obj, target_location, **kwargs):
+        """
+        Called just before an object leaves this room.
+
+        Args:
+            moved_obj (Object): The object leaving.
+            target_location (Object): Where `moved_obj` is going.
+
+        """
+        super(Room, self).at_object_leave(moved_obj, target_location, **kwargs)
+        if moved_obj.destination:
+            mergecache.invalidate()
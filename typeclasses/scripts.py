@@ -13,6 +13,11 @@ just overloads its hooks to have it perform its function.
 """
 
 from evennia import DefaultScript
+from evennia.scripts.scripts import ExtendedLoopingCall
+from world.lazyimport import lazy_import
+
+scheduler = lazy_import("world.scheduler")
+scriptstate = lazy_import("world.scriptstate")
 
 
 class Script(DefaultScript):
@@ -87,5 +92,137 @@ class Script(DefaultScript):
                   save temporary variables you want should survive a reload.
       at_server_shutdown() - called at a full server shutdown.
 
+    * Class attributes
+
+     tick_bucketed (bool) - if set, the script does not get a timer of its own
+                  but shares one with all other bucketed scripts of the same
+                  interval, spreading their at_repeat calls evenly over the
+                  interval (see world/scheduler.py).
+     shadow_state (bool) - if set, the pause state, time remaining and repeat
+                  count (of scripts with limited repeats) are kept in memory and written to the database in
+                  batches (see world/scriptstate.py for the crash trade-off).
+                  This is flushed for all scripts when the server stops, after
+                  at_server_reload()/at_server_shutdown() have been called.
+
     """
-    pass
+    tick_bucketed = False
+    shadow_state = False
+
+    @property
+    def shadow(self):
+        """
+        The in-memory state of a `shadow_state` script, a dict with
+        the keys `paused_time`, `manual_pause` and `callcount`. This
+        is loaded from the database the first time it is needed.
+        """
+        state = self.ndb._shadow_state
+        if state is None:
+            state = dict(self.attributes.get(scriptstate.STATE_ATTRIBUTE, default=None) or {})
+            self.ndb._shadow_state = state
+        return state
+
+    def _start_task(self):
+        """
+        Start the task runner, using a shared scheduler bucket if the
+        class sets `tick_bucketed`.
+        """
+        if not (self.tick_bucketed or self.shadow_state):
+            return super(Script, self)._start_task()
+
+        if self.tick_bucketed:
+            self.ndb._task = scheduler.BucketTask(self._step_task)
+        else:
+            self.ndb._task = ExtendedLoopingCall(self._step_task)
+
+        if self.shadow_state:
+            state = self.shadow
+            paused_time = state.pop("paused_time", None)
+            state.pop("manual_pause", None)
+            callcount = state.get("callcount", 0)
+            scriptstate.mark_dirty(self)
+        else:
+            paused_time = self.db._paused_time
+            callcount = self.db._paused_callcount or 0
+            if paused_time:
+                del self.db._paused_time
+                del self.db._paused_repeats
+
+        if paused_time:
+            # the script was paused; restarting
+            self.ndb._task.start(self.db_interval, now=False,
+                                 start_delay=paused_time,
+                                 count_start=callcount)
+        else:
+            # starting script anew (or after a crash, from the last checkpoint)
+            self.ndb._task.start(self.db_interval, now=not self.db_start_delay,
+                                 count_start=callcount)
+
+    def _step_callback(self):
+        """
+        Called every interval; checkpoints the repeat count of
+        `shadow_state` scripts with a limited number of repeats.
+        """
+        super(Script, self)._step_callback()
+        task = self.ndb._task
+        if self.shadow_state and self.db_repeats > 0 and task and self.pk:
+            self.shadow["callcount"] = task.callcount
+            scriptstate.mark_dirty(self)
+
+    def pause(self, manual_pause=True):
+        """
+        Pause the script, storing the time until the next repeat.
+
+        Args:
+            manual_pause (bool, optional): If `False`, the pause was made
+                by the server (such as for a reload) and the script will
+                be unpaused automatically when it starts again.
+
+        """
+        if not self.shadow_state:
+            return super(Script, self).pause(manual_pause=manual_pause)
+        state = self.shadow
+        if state.get("paused_time") is None:
+            # only allow pause if not already paused
+            task = self.ndb._task
+            if task:
+                state["paused_time"] = task.next_call_time()
+                state["callcount"] = task.callcount
+                state["manual_pause"] = manual_pause
+                self._stop_task()
+            self.db_is_active = False
+            scriptstate.mark_dirty(self)
+
+    def unpause(self, manual_unpause=True):
+        """
+        Restart a paused script, continuing from the paused timer.
+
+        Args:
+            manual_unpause (bool, optional): If `False`, scripts paused
+                manually are not unpaused.
+
+        Returns:
+            unpaused (bool): True if the script was restarted.
+
+        Raises:
+            RuntimeError: If the script was paused manually and
+                `manual_unpause` is False.
+
+        """
+        if not self.shadow_state:
+            return super(Script, self).unpause(manual_unpause=manual_unpause)
+        state = self.shadow
+        if state.get("manual_pause") and not manual_unpause:
+            # don't allow automatic unpausing of manually paused scripts
+            raise RuntimeError
+        if state.get("paused_time") is not None:
+            self.db_is_active = True
+            scriptstate.mark_dirty(self)
+            self.at_start()
+            self._start_task()
+            return True
+
+    def at_stop(self):
+        """
+        Called as the script is stopped and about to be deleted.
+        """
+        scriptstate.discard(self)
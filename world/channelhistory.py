@@ -0,0 +1,376 @@
+"""
+Channel history write-behind
+
+Channel messages sent with `persistent=True` are stored as `Msg` rows
+so they can be read back as channel history. Creating the row, and
+linking its senders and channel, takes several queries, which
+normally run inside the command sending the message.
+
+Here, `typeclasses.channels.Channel` only queues persistent messages.
+They are written in bulk, in one transaction, every
+`CHANNEL_HISTORY_FLUSH_INTERVAL` seconds, as soon as
+`CHANNEL_HISTORY_BATCH_SIZE` messages are waiting, and when the server
+stops (from `server/conf/at_server_startstop.py`). If a batch can't be
+written, its messages are retried one at a time on the next flush,
+and those failing again are logged and dropped.
+
+Until then, `pending(channel)` has the queued messages of a channel,
+which `Channel.history` merges with those in the database. If the
+server crashes, messages queued since the last flush are lost.
+
+Each channel also keeps its latest `CHANNEL_SCROLLBACK_SIZE` persistent
+messages in a `Scrollback`, a ring buffer of compact
+`(timestamp, sender id, text)` tuples. It answers "the last N messages"
+and "messages since T" (by bisecting its timestamps) without querying
+the database; only requests reaching further back than the buffer do.
+
+"""
+import calendar
+from datetime import datetime
+from time import mktime, time
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+from evennia.accounts.models import AccountDB
+from evennia.comms.models import Msg
+from evennia.objects.models import ObjectDB
+from evennia.utils import logger
+from world.spawning import bulk_insert
+
+_FLUSH_INTERVAL = getattr(settings, "CHANNEL_HISTORY_FLUSH_INTERVAL", 5)
+_BATCH_SIZE = getattr(settings, "CHANNEL_HISTORY_BATCH_SIZE", 200)
+SCROLLBACK_SIZE = getattr(settings, "CHANNEL_SCROLLBACK_SIZE", 500)
+
+# queued TempMsgs, oldest first
+_QUEUE = []
+_STATS = {"flushes": 0, "messages": 0, "dropped": 0, "last_flush": None,
+          "last_duration": 0.0}
+_LOOP = [None]
+_FLUSH_CALL = [None]
+
+
+def to_timestamp(date):
+    """
+    Convert a message date to seconds since the epoch.
+
+    Args:
+        date (datetime): A naive (local) or aware date.
+
+    Returns:
+        timestamp (float): The time stamp.
+
+    """
+    if date.tzinfo is not None:
+        seconds = calendar.timegm(date.utctimetuple())
+    else:
+        seconds = mktime(date.timetuple())
+    return seconds + date.microsecond / 1000000.0
+
+
+def from_timestamp(timestamp):
+    """
+    Convert seconds since the epoch to a date comparable with message
+    dates.
+
+    Args:
+        timestamp (float): The time stamp.
+
+    Returns:
+        date (datetime): The date, aware if `USE_TZ` is set.
+
+    """
+    if settings.USE_TZ:
+        return datetime.fromtimestamp(timestamp, timezone.utc)
+    return datetime.fromtimestamp(timestamp)
+
+
+def compact(msgobj):
+    """
+    Get the scrollback entry of a message.
+
+    Args:
+        msgobj (Msg or TempMsg): The message.
+
+    Returns:
+        entry (tuple): `(timestamp, sender id, text)`. The sender id is
+            that of the first sender, or `None`.
+
+    """
+    senders = msgobj.senders
+    return (to_timestamp(msgobj.date_created),
+            getattr(senders[0], "id", None) if senders else None, msgobj.message)
+
+
+class Scrollback(object):
+    """
+    A ring buffer of the latest messages of a channel, oldest first.
+
+    """
+
+    def __init__(self, size=SCROLLBACK_SIZE, entries=(), complete=False):
+        """
+        Args:
+            size (int, optional): The most messages to hold.
+            entries (iterable, optional): `(timestamp, sender id, text)`
+                tuples to start with, oldest first.
+            complete (bool, optional): If `entries` are all messages the
+                channel ever had.
+
+        """
+        self.size = max(1, size)
+        self._entries = [None] * self.size
+        self._timestamps = [0.0] * self.size
+        self._start = 0
+        self._count = 0
+        self.complete = complete
+        for entry in entries:
+            self.append(entry)
+
+    def __len__(self):
+        return self._count
+
+    def _index(self, position):
+        return (self._start + position) % self.size
+
+    def append(self, entry):
+        """
+        Add the newest message, dropping the oldest if full.
+
+        Args:
+            entry (tuple): `(timestamp, sender id, text)`.
+
+        """
+        timestamp = entry[0]
+        if self._count:
+            newest = self._timestamps[self._index(self._count - 1)]
+            if timestamp < newest:
+                # keep the index sorted if the clock went back
+                timestamp = newest
+                entry = (timestamp,) + tuple(entry[1:])
+        if self._count == self.size:
+            index = self._start
+            self._start = self._index(1)
+            self.complete = False
+        else:
+            index = self._index(self._count)
+            self._count += 1
+        self._entries[index] = entry
+        self._timestamps[index] = timestamp
+
+    def oldest(self):
+        """
+        Get the time stamp of the oldest message held.
+
+        Returns:
+            timestamp (float or None): The time stamp, or `None` if empty.
+
+        """
+        return self._timestamps[self._start] if self._count else None
+
+    def bisect(self, timestamp):
+        """
+        Find the position of the first message at or after a time.
+
+        Args:
+            timestamp (float): The time stamp.
+
+        Returns:
+            position (int): From 0 (oldest) to `len(self)`.
+
+        """
+        timestamps = self._timestamps
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if timestamps[self._index(middle)] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def last(self, n):
+        """
+        Get the latest messages.
+
+        Args:
+            n (int): How many messages to get.
+
+        Returns:
+            entries (list): Up to `n` entries, oldest first.
+
+        """
+        return [self._entries[self._index(position)]
+                for position in range(max(0, self._count - n), self._count)]
+
+    def since(self, timestamp):
+        """
+        Get the messages sent at or after a time.
+
+        Args:
+            timestamp (float): The time stamp.
+
+        Returns:
+            entries (list): The entries, oldest first.
+
+        """
+        return [self._entries[self._index(position)]
+                for position in range(self.bisect(timestamp), self._count)]
+
+    def covers_last(self, n):
+        """
+        Check if `last(n)` holds all of the channel's latest `n` messages.
+        """
+        return self.complete or n <= self._count
+
+    def covers_since(self, timestamp):
+        """
+        Check if `since(timestamp)` holds all of the channel's messages
+        since then. Dropped messages are no newer than the oldest held.
+        """
+        return self.complete or bool(self._count and self.oldest() < timestamp)
+
+
+def queue(msgobj):
+    """
+    Queue a message to be stored on the next flush.
+
+    Args:
+        msgobj (TempMsg): The message, as sent. Its `channels` are
+            the channels to store it for.
+
+    """
+    if getattr(msgobj, "date_created", None) is None:
+        msgobj.date_created = timezone.now()
+    _QUEUE.append(msgobj)
+    if len(_QUEUE) >= _BATCH_SIZE and not (_FLUSH_CALL[0] and _FLUSH_CALL[0].active()):
+        # after the sending command is done
+        _FLUSH_CALL[0] = reactor.callLater(0, flush)
+
+
+def pending(channel):
+    """
+    Get the messages of a channel that are not stored yet.
+
+    Args:
+        channel (Channel): The channel.
+
+    Returns:
+        messages (list): The queued messages, oldest first.
+
+    """
+    return [msgobj for msgobj in _QUEUE if channel in msgobj.channels]
+
+
+def _link(field, pairs):
+    """
+    Bulk-insert rows of a Msg many-to-many field, given as
+    `(msg id, other id)` pairs.
+    """
+    if pairs:
+        through = field.through
+        msg_column = "msg_id"
+        other_column = "%s_id" % field.field.related_model._meta.model_name
+        through.objects.bulk_create([through(**{msg_column: msg_id, other_column: other_id})
+                                     for msg_id, other_id in pairs])
+
+
+def _store(messages):
+    """
+    Store messages in one transaction.
+    """
+    with transaction.atomic():
+        ids = bulk_insert(Msg, [Msg(db_header=msgobj.header, db_message=msgobj.message,
+                                    db_lock_storage="")
+                                for msgobj in messages])
+        # keep the time each message was sent, not when it was stored
+        Msg.objects.filter(id__in=ids).update(db_date_created=Case(
+            *[When(id=msg_id, then=Value(msgobj.date_created, output_field=DateTimeField()))
+              for msg_id, msgobj in zip(ids, messages)],
+            output_field=DateTimeField()))
+        accounts, objects, channels = [], [], []
+        for msg_id, msgobj in zip(ids, messages):
+            for sender in msgobj.senders:
+                if isinstance(sender, AccountDB):
+                    accounts.append((msg_id, sender.id))
+                elif isinstance(sender, ObjectDB):
+                    objects.append((msg_id, sender.id))
+            channels.extend((msg_id, channel.id) for channel in msgobj.channels)
+        _link(Msg.db_sender_accounts, accounts)
+        _link(Msg.db_sender_objects, objects)
+        _link(Msg.db_receivers_channels, channels)
+
+
+def flush():
+    """
+    Store all queued messages in the database. Messages are stored in
+    one transaction; if that fails, they are queued again to be stored
+    one by one on the next flush, and those that still fail (such as
+    when their sender or channel was deleted) are dropped.
+
+    Returns:
+        nmessages (int): How many messages were stored.
+
+    """
+    if not _QUEUE:
+        return 0
+    t0 = time()
+    messages = list(_QUEUE)
+    del _QUEUE[:]
+    retries = [msgobj for msgobj in messages if getattr(msgobj, "store_failed", False)]
+    batch = [msgobj for msgobj in messages if not getattr(msgobj, "store_failed", False)]
+    nstored = 0
+    for msgobj in retries:
+        try:
+            _store([msgobj])
+        except Exception:
+            logger.log_trace("Dropped channel message that could not be stored: %s" %
+                             msgobj.message)
+            _STATS["dropped"] += 1
+        else:
+            nstored += 1
+    if batch:
+        try:
+            _store(batch)
+        except Exception:
+            logger.log_trace("Could not store %i channel messages, retrying them one by one." %
+                             len(batch))
+            for msgobj in batch:
+                msgobj.store_failed = True
+            # try again next time, before anything queued meanwhile
+            _QUEUE[:0] = batch
+        else:
+            nstored += len(batch)
+    if nstored:
+        _STATS["flushes"] += 1
+        _STATS["messages"] += nstored
+        _STATS["last_flush"] = t0
+        _STATS["last_duration"] = time() - t0
+    return nstored
+
+
+def start():
+    """
+    Start flushing every `CHANNEL_HISTORY_FLUSH_INTERVAL` seconds.
+    """
+    if _LOOP[0] is None:
+        _LOOP[0] = LoopingCall(flush)
+        _LOOP[0].start(_FLUSH_INTERVAL, now=False)
+
+
+def stats():
+    """
+    Get flush statistics.
+
+    Returns:
+        stats (dict): With keys `queued` (messages waiting), `flushes`,
+            `messages` (total stored), `dropped` (messages that could not
+            be stored), `last_flush` (time stamp) and `last_duration`
+            (seconds).
+
+    """
+    result = dict(_STATS)
+    result["queued"] = len(_QUEUE)
+    return result
@@ -0,0 +1,289 @@
+"""
+Exit graph
+
+An in-memory map of all exits in the game world:
+
+    room id -> {exit id: ExitEdge(id, key, aliases, location, destination)}
+
+It is built with a few queries when the server starts (see
+`server/conf/at_server_startstop.py`) and kept up to date by the hooks
+of `typeclasses.exits.Exit` as exits are created, deleted, moved,
+renamed, linked or re-aliased, and by `world.lockcache` as their locks
+change. Code changing the aliases of an exit directly should call
+`exit.at_cmdset_get(force_init=True)` afterwards, just as the `@alias`
+command does.
+
+Every room has a version number that increases whenever its exits
+change, including their locks. Rooms use it to know when their shared exit cmdset (see
+`exit_cmdset`) must be rebuilt, instead of every exit object providing
+a cmdset of its own.
+
+"""
+from collections import namedtuple, defaultdict, OrderedDict
+from evennia.commands.cmdset import CmdSet
+from evennia.objects.models import ObjectDB
+from evennia.utils import logger
+
+ExitEdge = namedtuple("ExitEdge", ("id", "key", "aliases", "location", "destination"))
+
+# exit id: ExitEdge
+_EXITS = {}
+# room id: {exit id: ExitEdge}
+_ROOMS = defaultdict(OrderedDict)
+# room id: version
+_VERSIONS = defaultdict(int)
+# room id: (version, CmdSet)
+_CMDSETS = {}
+# bumped on every change, for users of the full graph (like pathfinding)
+_GRAPH_VERSION = [0]
+# exit command class: subclass checking the exit's call lock
+_CALL_CHECKED = {}
+# call locks that let everyone through, not worth checking
+_OPEN_CALL_LOCKS = ("true()", "all()")
+
+
+def _add_edge(edge):
+    _EXITS[edge.id] = edge
+    if edge.location is not None:
+        _ROOMS[edge.location][edge.id] = edge
+        _VERSIONS[edge.location] += 1
+
+
+def _remove_edge(exit_id):
+    edge = _EXITS.pop(exit_id, None)
+    if edge and edge.location is not None:
+        _ROOMS[edge.location].pop(exit_id, None)
+        _VERSIONS[edge.location] += 1
+    return edge
+
+
+def build():
+    """
+    (Re)build the graph from the database.
+
+    Returns:
+        nexits (int): The number of exits loaded.
+
+    """
+    aliases = defaultdict(list)
+    for exit_id, alias in ObjectDB.objects.filter(
+            db_destination__isnull=False, db_tags__db_tagtype="alias").values_list(
+                "id", "db_tags__db_key"):
+        aliases[exit_id].append(alias)
+
+    _EXITS.clear()
+    _ROOMS.clear()
+    _CMDSETS.clear()
+    for exit_id, key, location, destination in ObjectDB.objects.filter(
+            db_destination__isnull=False).values_list(
+                "id", "db_key", "db_location", "db_destination"):
+        _add_edge(ExitEdge(exit_id, key.strip().lower(), tuple(aliases[exit_id]),
+                           location, destination))
+    _GRAPH_VERSION[0] += 1
+    logger.log_info("Exit graph: loaded %i exits." % len(_EXITS))
+    return len(_EXITS)
+
+
+def update_exit(exit):
+    """
+    Re-read an exit into the graph. Call this when the exit was
+    created or its key, aliases, location or destination changed.
+
+    Args:
+        exit (Exit): The exit object.
+
+    """
+    _remove_edge(exit.id)
+    location, destination = exit.location, exit.destination
+    if destination:
+        _add_edge(ExitEdge(exit.id, exit.key.strip().lower(), tuple(exit.aliases.all()),
+                           location.id if location else None, destination.id))
+    _GRAPH_VERSION[0] += 1
+
+
+def remove_exit(exit):
+    """
+    Remove an exit from the graph, such as when it is deleted.
+
+    Args:
+        exit (Exit): The exit object.
+
+    """
+    if _remove_edge(exit.id):
+        _GRAPH_VERSION[0] += 1
+
+
+def exits_from(room_id):
+    """
+    Get the exits leading out of a room.
+
+    Args:
+        room_id (int): The id of the room.
+
+    Returns:
+        edges (list): The `ExitEdge`s of the room's exits.
+
+    """
+    return list(_ROOMS[room_id].values()) if room_id in _ROOMS else []
+
+
+def neighbours(room_id):
+    """
+    Get where the exits of a room lead.
+
+    Args:
+        room_id (int): The id of the room.
+
+    Returns:
+        neighbours (dict): Mapping each exit key and alias to the
+            id of its destination.
+
+    """
+    result = {}
+    for edge in exits_from(room_id):
+        result[edge.key] = edge.destination
+        for alias in edge.aliases:
+            result[alias] = edge.destination
+    return result
+
+
+def room_version(room_id):
+    """
+    Get the version of a room's exits.
+
+    Args:
+        room_id (int): The id of the room.
+
+    Returns:
+        version (int): Increases whenever the room's exits change.
+
+    """
+    return _VERSIONS.get(room_id, 0)
+
+
+def forget_rooms(room_ids):
+    """
+    Drop the cached exit cmdsets of rooms that are about to be dropped
+    from memory, and of the rooms with exits leading to them, since
+    their commands hold on to the exit and room instances. The rooms'
+    versions are bumped, so they build new cmdsets when next used.
+
+    Args:
+        room_ids (iterable): Ids of the rooms.
+
+    """
+    room_ids = set(room_ids)
+    affected = set(room_ids)
+    affected.update(edge.location for edge in _EXITS.values()
+                    if edge.destination in room_ids and edge.location is not None)
+    for room_id in affected:
+        _CMDSETS.pop(room_id, None)
+        _VERSIONS[room_id] += 1
+
+
+def locks_changed(obj):
+    """
+    Note that the locks of an object changed. If it is an exit, the
+    cmdset of its room is rebuilt with the new locks and the graph
+    version is bumped. Called through `world.lockcache.on_change`.
+
+    Args:
+        obj (Object): The object whose locks changed.
+
+    """
+    edge = _EXITS.get(getattr(obj, "id", None))
+    if edge is None:
+        return
+    if edge.location is not None:
+        _VERSIONS[edge.location] += 1
+    _GRAPH_VERSION[0] += 1
+
+
+def graph_version():
+    """
+    Get the version of the whole graph.
+
+    Returns:
+        version (int): Increases whenever any exit changes.
+
+    """
+    return _GRAPH_VERSION[0]
+
+
+def all_edges():
+    """
+    Get all exits in the graph.
+
+    Returns:
+        edges (list): All `ExitEdge`s.
+
+    """
+    return list(_EXITS.values())
+
+
+def _call_checked(command_class):
+    """
+    Get a subclass of an exit command class that also checks the
+    exit's `call` lock, the way the cmdhandler checks it before using
+    an object's cmdset: without letting superusers bypass it.
+    """
+    checked = _CALL_CHECKED.get(command_class)
+    if checked is None:
+        def access(self, srcobj, access_type="cmd", default=False):
+            if access_type == "cmd" and not self.obj.access(srcobj, "call",
+                                                             no_superuser_bypass=True):
+                return False
+            return command_class.access(self, srcobj, access_type=access_type,
+                                        default=default)
+
+        checked = _CALL_CHECKED[command_class] = type(
+            "CallChecked%s" % command_class.__name__, (command_class,), {"access": access})
+    return checked
+
+
+def exit_cmdset(room):
+    """
+    Get the shared exit cmdset of a room, holding one traversal
+    command for each of its exits. This is cached until the exits of
+    the room change.
+
+    Args:
+        room (Room): The room.
+
+    Returns:
+        cmdset (CmdSet): A cmdset with key `_exitset`, like the ones
+            created by `DefaultExit.create_exit_cmdset`.
+
+    """
+    version = room_version(room.id)
+    cached = _CMDSETS.get(room.id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    exit_cmdset = CmdSet(None)
+    exit_cmdset.key = "_exitset"
+    exit_cmdset.duplicates = True
+    priority = None
+    for exi in room.exits:
+        if not exi.destination:
+            continue
+        command_class = exi.exit_command
+        call = exi.locks.get("call")
+        if call and call.split(":", 1)[1].strip() not in _OPEN_CALL_LOCKS:
+            # exit cmdsets are only made available to those passing the
+            # exit's call lock; here that has to be checked by the command.
+            command_class = _call_checked(command_class)
+        # not `add`, which would drop exits sharing a key or alias with
+        # an earlier one; like separate exit cmdsets, they all match
+        exit_cmdset.commands.append(command_class(key=exi.db_key.strip().lower(),
+                                                  aliases=exi.aliases.all(),
+                                                  locks=str(exi.locks),
+                                                  auto_help=False,
+                                                  destination=exi.db_destination,
+                                                  arg_regex=r"^$",
+                                                  is_exit=True,
+                                                  obj=exi))
+        priority = max(priority, exi.priority) if priority is not None else exi.priority
+    exit_cmdset.priority = priority if priority is not None else 101
+    _CMDSETS[room.id] = (version, exit_cmdset)
+    return exit_cmdset
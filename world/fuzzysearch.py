@@ -0,0 +1,376 @@
+"""
+Fuzzy global search
+
+Global object searches (such as `@find`, `@teleport` or `@examine` by
+name) look up keys and aliases across the whole ObjectDB table, which
+gets slow as the world grows. This module keeps a trigram index of all
+object keys and aliases in memory, to find objects by name without
+querying the database and to rank near misses (`sord` finding
+"sword").
+
+Names are lowercased and padded (`"  sword "`) and split into all their
+three-letter sequences. Many objects share names (every spawned
+goblin is "goblin"), so the index works on distinct names:
+
+    trigram -> array of name numbers
+    name number -> object id, or set of object ids
+
+Matching names are ranked by their trigram similarity to the query
+(shared trigrams / all distinct trigrams of both). Postings of renamed or
+deleted names are not removed right away: candidates are always
+checked against the current names, and the postings are compacted
+once enough of them are outdated.
+
+The index is built when the server starts (see
+`server/conf/at_server_startstop.py`) and kept up to date by the hooks
+of `typeclasses.objects.Object`. Searches use it through
+`server.conf.at_search.global_search`.
+
+Memory and speed for 500,000 objects with 500,000 distinct names of
+one to three random words, as measured with `benchmark()` (64-bit):
+
+                  Python 2.7    Python 3
+    build         9.3 s         6.6 s
+    memory        154 MB        144 MB
+      names        57 MB         53 MB
+      objects      62 MB         56 MB
+      postings     35 MB         35 MB
+    search        40 ms         5 ms      (mean of 100 misspelled names)
+
+A real world has far fewer distinct names than objects, so the names
+and postings are smaller (the objects part stays about the same).
+
+"""
+from array import array
+from collections import Counter, defaultdict
+from random import Random
+from sys import getsizeof
+from time import time
+from django.conf import settings
+from evennia.utils import logger
+
+_MIN_SCORE = getattr(settings, "SEARCH_FUZZY_MIN_SCORE", 0.3)
+# compact the postings when this part of them is outdated
+_COMPACT_RATIO = 0.25
+
+
+def trigrams(name):
+    """
+    Get the trigrams of a name.
+
+    Args:
+        name (str): The lowercase name.
+
+    Returns:
+        trigrams (set): Its three-letter sequences, padded with spaces.
+
+    """
+    padded = "  %s " % " ".join(name.split())
+    return set(padded[num:num + 3] for num in range(len(padded) - 2))
+
+
+class TrigramIndex(object):
+    """
+    Object names indexed by trigram.
+
+    """
+
+    def __init__(self):
+        self.names = []
+        # name number: number of trigrams
+        self.sizes = array("H")
+        self.name_numbers = {}
+        # name number: object id or set of object ids
+        self.name_objects = {}
+        # object id: name number or tuple of name numbers
+        self.object_names = {}
+        self.postings = defaultdict(lambda: array("i"))
+        self.nentries = 0
+        self.stale = 0
+
+    def __len__(self):
+        return len(self.object_names)
+
+    def _name_number(self, name):
+        number = self.name_numbers.get(name)
+        if number is None:
+            number = self.name_numbers[name] = len(self.names)
+            self.names.append(name)
+            self._post(number, name)
+        return number
+
+    def _post(self, number, name):
+        name_trigrams = trigrams(name)
+        self.sizes.append(min(len(name_trigrams), 65535))
+        for trigram in name_trigrams:
+            self.postings[trigram].append(number)
+        self.nentries += len(name_trigrams)
+
+    def add(self, obj_id, names):
+        """
+        Add an object, or replace its names if already indexed.
+
+        Args:
+            obj_id (int): The object id.
+            names (iterable): Its key and aliases.
+
+        """
+        self.remove(obj_id)
+        numbers = tuple(sorted(set(self._name_number(name.lower()) for name in names if name)))
+        if not numbers:
+            return
+        self.object_names[obj_id] = numbers[0] if len(numbers) == 1 else numbers
+        for number in numbers:
+            objects = self.name_objects.get(number)
+            if objects is None:
+                self.name_objects[number] = obj_id
+            elif isinstance(objects, set):
+                objects.add(obj_id)
+            else:
+                self.name_objects[number] = set((objects, obj_id))
+
+    def remove(self, obj_id):
+        """
+        Remove an object from the index, if it is there.
+
+        Args:
+            obj_id (int): The object id.
+
+        """
+        numbers = self.object_names.pop(obj_id, None)
+        if numbers is None:
+            return
+        for number in (numbers if isinstance(numbers, tuple) else (numbers,)):
+            objects = self.name_objects.get(number)
+            if isinstance(objects, set):
+                objects.discard(obj_id)
+                if len(objects) == 1:
+                    self.name_objects[number] = objects.pop()
+            elif objects == obj_id:
+                del self.name_objects[number]
+                self.stale += self.sizes[number]
+        if self.stale > self.nentries * _COMPACT_RATIO:
+            self.compact()
+
+    def compact(self):
+        """
+        Rebuild the postings without names no object has anymore.
+        """
+        names, numbers = [], {}
+        renumber = {}
+        for number, name in enumerate(self.names):
+            if number in self.name_objects:
+                renumber[number] = numbers[name] = len(names)
+                names.append(name)
+        self.name_objects = dict((renumber[number], objects)
+                                 for number, objects in self.name_objects.items())
+        self.object_names = dict(
+            (obj_id, tuple(renumber[number] for number in value)
+             if isinstance(value, tuple) else renumber[value])
+            for obj_id, value in self.object_names.items())
+        self.names, self.name_numbers = names, numbers
+        self.sizes = array("H")
+        self.postings = defaultdict(lambda: array("i"))
+        self.nentries = self.stale = 0
+        for number, name in enumerate(names):
+            self._post(number, name)
+
+    def _objects(self, number):
+        objects = self.name_objects.get(number)
+        if objects is None:
+            return ()
+        return objects if isinstance(objects, set) else (objects,)
+
+    def exact(self, name):
+        """
+        Get the objects with a key or alias equal to name.
+
+        Args:
+            name (str): The name, in any case.
+
+        Returns:
+            ids (list): The object ids, sorted.
+
+        """
+        number = self.name_numbers.get(name.lower())
+        return sorted(self._objects(number)) if number is not None else []
+
+    def search(self, query, limit=10, min_score=_MIN_SCORE):
+        """
+        Find the objects with names most similar to the query.
+
+        Args:
+            query (str): The search string.
+            limit (int, optional): The most objects to return.
+            min_score (float, optional): Lowest similarity (0-1) to include.
+
+        Returns:
+            matches (list): `(score, object id)` tuples, best first.
+
+        """
+        query_trigrams = trigrams(query.lower())
+        if not query_trigrams:
+            return []
+        counts = Counter()
+        postings = self.postings
+        for trigram in query_trigrams:
+            if trigram in postings:
+                counts.update(postings[trigram])
+        # every name is posted once per trigram, so the count is the
+        # number of shared trigrams; a name scoring min_score shares at
+        # least `needed` of them
+        nquery = len(query_trigrams)
+        needed = max(1, int(min_score * nquery))
+        sizes, name_objects = self.sizes, self.name_objects
+        scored = []
+        for number, shared in counts.items():
+            if shared < needed:
+                continue
+            score = float(shared) / (nquery + sizes[number] - shared)
+            if score >= min_score and number in name_objects:
+                scored.append((score, number))
+        scored.sort(key=lambda match: (-match[0], self.names[match[1]]))
+
+        matches = []
+        seen = set()
+        for score, number in scored:
+            for obj_id in sorted(self._objects(number)):
+                if obj_id not in seen:
+                    seen.add(obj_id)
+                    matches.append((score, obj_id))
+            if len(matches) >= limit:
+                break
+        return matches[:limit]
+
+    def memory(self):
+        """
+        Estimate the memory used by the index.
+
+        Returns:
+            sizes (dict): Bytes used by `names`, `objects` (the mappings
+                between names and objects) and `postings`, and `total`.
+
+        """
+        names = getsizeof(self.names) + getsizeof(self.name_numbers) + getsizeof(
+            self.sizes) + sum(getsizeof(name) for name in self.names)
+        objects = getsizeof(self.name_objects) + getsizeof(self.object_names)
+        for value in self.name_objects.values():
+            if isinstance(value, set):
+                objects += getsizeof(value)
+        for value in self.object_names.values():
+            if isinstance(value, tuple):
+                objects += getsizeof(value)
+        # ints above 256 are objects of their own
+        objects += getsizeof(2 ** 20) * len(self.object_names)
+        postings = getsizeof(self.postings) + sum(
+            getsizeof(trigram) + getsizeof(numbers) for trigram, numbers in self.postings.items())
+        return {"names": names, "objects": objects, "postings": postings,
+                "total": names + objects + postings}
+
+
+_INDEX = [None]
+
+
+def get_index():
+    """
+    Get the index, building it if needed.
+
+    Returns:
+        index (TrigramIndex): The index.
+
+    """
+    if _INDEX[0] is None:
+        build()
+    return _INDEX[0]
+
+
+def build():
+    """
+    (Re)build the index from the database.
+
+    Returns:
+        nobjects (int): The number of objects indexed.
+
+    """
+    from evennia.objects.models import ObjectDB
+    t0 = time()
+    aliases = defaultdict(list)
+    for obj_id, alias in ObjectDB.objects.filter(db_tags__db_tagtype="alias").values_list(
+            "id", "db_tags__db_key").iterator():
+        aliases[obj_id].append(alias)
+    index = TrigramIndex()
+    for obj_id, key in ObjectDB.objects.values_list("id", "db_key").iterator():
+        index.add(obj_id, [key] + aliases.get(obj_id, []))
+    _INDEX[0] = index
+    logger.log_info("Fuzzy search: indexed %i objects (%i names) in %.1fs." % (
+        len(index), len(index.name_objects), time() - t0))
+    return len(index)
+
+
+def update_object(obj):
+    """
+    Re-read the names of an object into the index. Call this when it
+    was created, renamed or its aliases changed.
+
+    Args:
+        obj (Object): The object.
+
+    """
+    if _INDEX[0] is not None:
+        _INDEX[0].add(obj.id, [obj.key] + list(obj.aliases.all()))
+
+
+def remove_object(obj):
+    """
+    Remove an object from the index, such as when it's deleted.
+
+    Args:
+        obj (Object): The object.
+
+    """
+    if _INDEX[0] is not None:
+        _INDEX[0].remove(obj.id)
+
+
+def benchmark(nobjects=500000, nqueries=100, seed=0):
+    """
+    Build an index of synthetic object names and time searches on it.
+
+    Args:
+        nobjects (int, optional): Objects to index, each with its own name.
+        nqueries (int, optional): Misspelled names to search for.
+        seed (int, optional): Seed for making the names.
+
+    Returns:
+        result (dict): With keys `objects`, `build` (seconds), `memory`
+            (as from `TrigramIndex.memory`) and `search_ms` (mean
+            milliseconds per search).
+
+    """
+    rand = Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = ["".join(rand.choice(letters) for _ in range(rand.randint(3, 8)))
+             for _ in range(2000)]
+    names = set()
+    while len(names) < nobjects:
+        names.add(" ".join(rand.choice(words) for _ in range(rand.randint(1, 3))))
+    names = list(names)
+
+    t0 = time()
+    index = TrigramIndex()
+    for obj_id, name in enumerate(names):
+        index.add(obj_id, (name,))
+    build_time = time() - t0
+
+    queries = []
+    for _ in range(nqueries):
+        name = list(rand.choice(names))
+        pos = rand.randrange(len(name))
+        name[pos] = rand.choice(letters)
+        queries.append("".join(name))
+    t0 = time()
+    for query in queries:
+        index.search(query)
+    search_time = time() - t0
+    return {"objects": nobjects, "build": build_time, "memory": index.memory(),
+            "search_ms": search_time * 1000.0 / nqueries}
@@ -0,0 +1,97 @@
+"""
+Lazy imports
+
+The command and typeclass modules import the systems they use (the
+exit graph, the zones, the caches, ...) at the top, so importing any
+one of them imports most of `world/`, whether or not the server ends
+up calling into those systems.
+
+    exitgraph = lazy_import("world.exitgraph")
+
+instead of `from world import exitgraph` binds a stand-in module that
+imports the real one the first time one of its attributes is used,
+and passes all attribute lookups on to it from then on. Only use it
+for modules whose contents are used inside functions and methods, not
+at import time (base classes, decorators, constants in class bodies).
+
+With `LAZY_IMPORTS` off, `lazy_import` imports the module right away,
+which is useful to get import errors at startup. `stats()` lists the
+lazily imported modules, how long each took and which were never
+needed (see also `world/startprofile.py`).
+
+"""
+from importlib import import_module
+from time import time
+from types import ModuleType
+from django.conf import settings
+
+# path: seconds it took to import, or None if not imported yet
+_MODULES = {}
+
+
+class LazyModule(ModuleType):
+    """
+    Stand-in for a module that is imported on first use.
+
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Python path of the module.
+
+        """
+        super(LazyModule, self).__init__(path)
+        self._lazy_path = path
+        self._lazy_module = None
+
+    def __getattr__(self, name):
+        # only called for what the stand-in itself doesn't have
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            path = self.__dict__["_lazy_path"]
+            t0 = time()
+            module = import_module(path)
+            if _MODULES.get(path) is None:
+                _MODULES[path] = time() - t0
+            self.__dict__["_lazy_module"] = module
+        return getattr(module, name)
+
+    def __repr__(self):
+        return "<lazy module '%s'%s>" % (
+            self.__dict__["_lazy_path"],
+            "" if self.__dict__["_lazy_module"] is not None else " (not imported)")
+
+
+def lazy_import(path):
+    """
+    Get a module that is only imported when first used.
+
+    Args:
+        path (str): Python path of the module, such as `world.zones`.
+
+    Returns:
+        module (LazyModule or module): A stand-in for the module, or
+            the module itself if `LAZY_IMPORTS` is off.
+
+    """
+    if not getattr(settings, "LAZY_IMPORTS", True):
+        return import_module(path)
+    _MODULES.setdefault(path, None)
+    return LazyModule(path)
+
+
+def stats():
+    """
+    Get lazy import statistics.
+
+    Returns:
+        stats (dict): With keys `deferred` (modules imported lazily),
+            `imported` (of those, how many were used) and `modules`,
+            mapping each module's path to the seconds its import took,
+            or None if it wasn't imported yet.
+
+    """
+    return {"deferred": len(_MODULES),
+            "imported": len([path for path, seconds in _MODULES.items() if seconds is not None]),
+            "modules": dict(_MODULES)}
@@ -0,0 +1,352 @@
+"""
+Lock cache
+
+Evennia's lockhandler parses a lock string like
+
+    "cmd:perm(Builder) or id(12)"
+
+into the lockfuncs to call and an expression combining their results,
+such as `"%s or %s"`. Every `access()` check then calls all the
+lockfuncs and builds and `eval`s the expression as a new string.
+
+After `install()`, lock definitions are compiled into Python functions
+instead, once per distinct definition in the game (all exits with
+`traverse:all()` share one). A compiled lock calls its lockfuncs
+lazily, stopping at the first `and`/`or` that decides the result, and
+`LockHandler.check` calls it directly, without building and `eval`ing
+an expression. `benchmark()` compares the three ways of checking.
+
+Compiled locks made only of pure lockfuncs can also memoize their
+results per (accessing object, accessed object, lock definition). A
+lockfunc is pure if its result only depends on its arguments and on
+the permissions, tags and locks of the objects involved. The memo is
+dropped whenever any permission, tag or lock in the game changes,
+when a Character is puppeted or unpuppeted, and when an account is
+quelled or unquelled. Declare custom lockfuncs pure with the `pure`
+decorator:
+
+    from world.lockcache import pure
+
+    @pure
+    def mylockfunc(accessing_obj, accessed_obj, *args, **kwargs):
+        ...
+
+Of Evennia's own lockfuncs, those in `PURE_LOCKFUNCS` are pure.
+
+Other systems caching what locks allow (the exit cmdsets and the
+pathfinder) register with `on_change` to hear when an object's locks
+change.
+
+Settings:
+
+    LOCK_COMPILE - use compiled locks (default True).
+    LOCK_RESULT_CACHE - memoize the results of pure locks (default True).
+    LOCK_RESULT_CACHE_SIZE - most results to memoize (default 10000).
+
+"""
+from time import time
+from django.conf import settings
+from evennia.utils import logger
+
+_RESULT_CACHE = getattr(settings, "LOCK_RESULT_CACHE", True)
+_RESULT_CACHE_SIZE = getattr(settings, "LOCK_RESULT_CACHE_SIZE", 10000)
+
+# Evennia lockfuncs depending only on arguments, permissions and tags
+PURE_LOCKFUNCS = ("true", "all", "false", "none", "self", "perm", "perm_above",
+                  "pperm", "pperm_above", "dbref", "id", "pdbref", "pid",
+                  "tag", "objtag", "superuser", "serversetting")
+
+# (definition, evalstring): compiled lock
+_COMPILED = {}
+# (definition, accessing, accessed): result
+_MEMO = {}
+_STATS = {"compiled": 0, "hits": 0, "misses": 0, "invalidations": 0}
+
+# called with the object whenever an object's locks change
+_LISTENERS = []
+
+# the original methods, set by install()
+_ORIG = {}
+
+
+def pure(func):
+    """
+    Decorator declaring a lockfunc pure, so that the results of locks
+    using it may be memoized.
+
+    Args:
+        func (callable): The lockfunc.
+
+    Returns:
+        func (callable): The same lockfunc.
+
+    """
+    func.pure = True
+    return func
+
+
+def is_pure(func):
+    """
+    Check if a lockfunc is pure.
+
+    Args:
+        func (callable): The lockfunc.
+
+    Returns:
+        pure (bool): If results of locks using it may be memoized.
+
+    """
+    if getattr(func, "pure", False):
+        return True
+    return (getattr(func, "__module__", None) == "evennia.locks.lockfuncs" and
+            func.__name__ in PURE_LOCKFUNCS)
+
+
+def changed():
+    """
+    Forget all memoized lock results. Called when permissions, tags or
+    locks change.
+    """
+    if _MEMO:
+        _MEMO.clear()
+        _STATS["invalidations"] += 1
+
+
+def on_change(listener):
+    """
+    Have a function called whenever the locks of an object change
+    through its lockhandler, once `install()` was called.
+
+    Args:
+        listener (callable): Called with the object, after the change.
+
+    """
+    if listener not in _LISTENERS:
+        _LISTENERS.append(listener)
+
+
+def _identity(obj):
+    """
+    Identify a database object for the memo, or None if it can't be.
+    """
+    pk = getattr(obj, "pk", None)
+    if pk is None:
+        return None
+    return (obj._meta.concrete_model, pk)
+
+
+def _memoized(lock, definition):
+    """
+    Wrap a compiled lock of pure lockfuncs to memoize its results.
+    """
+
+    def memoized_lock(accessing_obj, accessed_obj):
+        accessing = _identity(accessing_obj)
+        if accessing is None:
+            return lock(accessing_obj, accessed_obj)
+        key = (definition, accessing, _identity(accessed_obj))
+        result = _MEMO.get(key)
+        if result is None:
+            _STATS["misses"] += 1
+            result = lock(accessing_obj, accessed_obj)
+            if len(_MEMO) >= _RESULT_CACHE_SIZE:
+                _MEMO.clear()
+            _MEMO[key] = result
+        else:
+            _STATS["hits"] += 1
+        return result
+
+    return memoized_lock
+
+
+def compile_lock(evalstring, funcs, definition):
+    """
+    Compile a parsed lock definition into a function.
+
+    Args:
+        evalstring (str): The lock expression, with one `%s` for each
+            lockfunc call, as made by the lockhandler.
+        funcs (tuple): `(lockfunc, args, kwargs)` for each call.
+        definition (str): The lock definition, like `"get:all()"`.
+
+    Returns:
+        lock (callable or None): Called with `(accessing_obj, accessed_obj)`,
+            returns the result of the lock. `None` if it could not be
+            compiled.
+
+    """
+    key = (definition, evalstring)
+    if key in _COMPILED:
+        return _COMPILED[key]
+    namespace = {}
+    calls = []
+    for num, (func, args, kwargs) in enumerate(funcs):
+        namespace["_f%i" % num] = func
+        namespace["_a%i" % num] = args
+        namespace["_k%i" % num] = kwargs
+        calls.append("_f%i(accessing_obj, accessed_obj, *_a%i, **_k%i)" % (num, num, num))
+    try:
+        source = "def lock(accessing_obj, accessed_obj):\n    return bool(%s)\n" % (
+            evalstring % tuple(calls))
+        exec(compile(source, "<lock %s>" % definition, "exec"), namespace)
+    except Exception:
+        logger.log_trace("Could not compile lock '%s'." % definition)
+        _COMPILED[key] = None
+        return None
+    lock = namespace["lock"]
+    if _RESULT_CACHE and all(is_pure(func) for func, _, _ in funcs):
+        lock = _memoized(lock, definition)
+    # lets the patched LockHandler.check call it directly
+    lock.compiled_lock = True
+    _COMPILED[key] = lock
+    _STATS["compiled"] += 1
+    return lock
+
+
+def _bypasses(accessing_obj):
+    """
+    Check if an object bypasses locks as a superuser, the way
+    `LockHandler.check` does.
+    """
+    return bool((hasattr(accessing_obj, "is_superuser") and accessing_obj.is_superuser) or
+                (hasattr(accessing_obj, "account") and
+                 hasattr(accessing_obj.account, "is_superuser") and
+                 accessing_obj.account.is_superuser) or
+                (hasattr(accessing_obj, "get_account") and
+                 (not accessing_obj.get_account() or accessing_obj.get_account().is_superuser)))
+
+
+def _compiled_lock(handler, access_type):
+    """
+    Get the compiled lock of an access type of a lockhandler, or None
+    if it has none.
+    """
+    entry = handler.locks.get(access_type)
+    if entry is not None and len(entry[1]) == 1:
+        lock = entry[1][0][0]
+        if getattr(lock, "compiled_lock", False):
+            return lock
+    return None
+
+
+def benchmark(accessing_obj, accessed_obj, access_type, repeats=10000):
+    """
+    Time lock checks of an object with Evennia's parsed locks, with
+    compiled locks evaluated by Evennia's `LockHandler.check`, and with
+    compiled locks called directly. Superusers are not let through, so
+    the lock itself is always checked. Needs `install()`.
+
+    Args:
+        accessing_obj (Object or Account): Who is checked.
+        accessed_obj (Object): Whose lock is checked.
+        access_type (str): The lock to check, like `"traverse"`.
+        repeats (int, optional): Checks to time of each kind.
+
+    Returns:
+        results (dict): Mean microseconds per check, with keys
+            `parsed_us`, `eval_us` and `compiled_us`.
+
+    """
+    handler = accessed_obj.locks
+    compiled = handler.locks
+    parsed = _ORIG["parse"](handler, accessed_obj.lock_storage)
+    results = {}
+    try:
+        for name, locks, check in (("parsed_us", parsed, _ORIG["check"]),
+                                   ("eval_us", compiled, _ORIG["check"]),
+                                   ("compiled_us", compiled, type(handler).check)):
+            handler.locks = locks
+            t0 = time()
+            for _ in range(repeats):
+                check(handler, accessing_obj, access_type, no_superuser_bypass=True)
+            results[name] = (time() - t0) * 1000000.0 / repeats
+    finally:
+        handler.locks = compiled
+    return results
+
+
+def stats():
+    """
+    Get lock cache statistics.
+
+    Returns:
+        stats (dict): With keys `compiled` (distinct lock definitions),
+            `memoized` (results held), `hits`, `misses` and
+            `invalidations`.
+
+    """
+    result = dict(_STATS)
+    result["memoized"] = len(_MEMO)
+    return result
+
+
+def install():
+    """
+    Make lockhandlers use compiled locks (unless `LOCK_COMPILE` is off),
+    keep the memo of lock results current and call the `on_change`
+    listeners. Calling this more than once has no further effect.
+    """
+    if _ORIG:
+        return
+    from evennia.locks.lockhandler import LockHandler
+    from evennia.typeclasses.attributes import AttributeHandler
+    from evennia.typeclasses.tags import TagHandler
+
+    if getattr(settings, "LOCK_COMPILE", True):
+        _ORIG["parse"] = LockHandler._parse_lockstring
+
+        _ORIG["check"] = LockHandler.check
+
+        def _parse_lockstring(self, storage_lockstring):
+            locks = _ORIG["parse"](self, storage_lockstring)
+            for access_type, (evalstring, funcs, definition) in list(locks.items()):
+                lock = compile_lock(evalstring, funcs, definition)
+                if lock:
+                    # `check` calls this directly; other lockhandler code
+                    # still calls it and evaluates "%s" on its result
+                    locks[access_type] = ("%s", ((lock, (), {}),), definition)
+            return locks
+
+        def check(self, accessing_obj, access_type, default=False, no_superuser_bypass=False):
+            lock = _compiled_lock(self, access_type)
+            if lock is not None:
+                try:
+                    bypass = not no_superuser_bypass and _bypasses(accessing_obj)
+                except AttributeError:
+                    # leave odd accessing objects to Evennia's own check
+                    lock = None
+            if lock is None:
+                return _ORIG["check"](self, accessing_obj, access_type, default=default,
+                                      no_superuser_bypass=no_superuser_bypass)
+            return bypass or lock(accessing_obj, self.obj)
+
+        check.__doc__ = _ORIG["check"].__doc__
+        LockHandler._parse_lockstring = _parse_lockstring
+        LockHandler.check = check
+
+    def wrap(cls, name, check=None, notify=False):
+        orig = _ORIG["%s.%s" % (cls.__name__, name)] = getattr(cls, name)
+
+        def wrapper(self, *args, **kwargs):
+            if check is None or check(*args, **kwargs):
+                changed()
+            result = orig(self, *args, **kwargs)
+            if notify:
+                for listener in _LISTENERS:
+                    listener(self.obj)
+            return result
+
+        wrapper.__name__ = name
+        wrapper.__doc__ = orig.__doc__
+        setattr(cls, name, wrapper)
+
+    for name in ("add", "replace", "delete", "clear"):
+        wrap(LockHandler, name, notify=True)
+    for name in ("add", "remove", "clear"):
+        wrap(TagHandler, name)
+
+    def is_quell(key=None, *args, **kwargs):
+        return key == "_quell"
+
+    for name in ("add", "remove"):
+        wrap(AttributeHandler, name, check=is_quell)
@@ -0,0 +1,287 @@
+"""
+Name index
+
+Local object searches (`look sword`, `get 2-ball`) normally query the
+database for objects in the searcher's location and inventory whose
+key or aliases match. This module answers them from memory instead.
+
+Every object holding other objects (a room, a character's inventory)
+gets a `NameIndex` of the keys and aliases of its contents, built the
+first time something is searched in it. It is kept up to date by the
+hooks of `typeclasses.objects.Object` as objects move, are renamed or
+change aliases.
+
+`search()` matches like Evennia's `ObjectDB.objects.object_search`:
+
+ - an exact (case-insensitive) match of a key or alias is tried first.
+ - otherwise a multimatch query like `2-ball` is split into the number
+   and the name, using `SEARCH_MULTIMATCH_REGEX`.
+ - unless `exact` is set, names are then matched word by word, each
+   query word being the start of a word of the name, in order (so
+   `red b` matches "red ball" and "red big box"). Keys are tried
+   before aliases. A number picks from these matches, so `2-ball`
+   is the second of all objects with "ball" in their names.
+
+The results are lists of objects ordered by id, just as from the
+database, so `at_search_result` handles them unchanged.
+
+"""
+import re
+from bisect import bisect_left, insort
+from django.conf import settings
+from evennia.objects.models import ObjectDB
+
+_MULTIMATCH_REGEX = re.compile(getattr(settings, "SEARCH_MULTIMATCH_REGEX",
+                                       r"(?P<number>[0-9]+)-(?P<name>.*)"), re.I + re.U)
+
+
+def _names(obj):
+    """
+    Get the lowercase key and aliases of an object.
+    """
+    return obj.key.lower(), tuple(alias.lower() for alias in obj.aliases.all())
+
+
+def _partial_match(name, query_words):
+    """
+    Check if every query word starts a word of the name, in order.
+    """
+    words = name.split()
+    start = 0
+    for query_word in query_words:
+        for num in range(start, len(words)):
+            if words[num].startswith(query_word):
+                start = num + 1
+                break
+        else:
+            return False
+    return True
+
+
+class NameIndex(object):
+    """
+    Keys and aliases of the contents of one object.
+
+    """
+
+    def __init__(self, container):
+        """
+        Args:
+            container (Object): The object whose contents to index.
+
+        """
+        self.container = container
+        # obj id: (obj, key, aliases)
+        self.entries = {}
+        # lowercase key or alias: set of obj ids
+        self.exact = {}
+        # sorted (word, obj id) for the words of keys and of aliases
+        self.key_words = []
+        self.alias_words = []
+
+        contents = container.contents
+        aliases = {}
+        for obj_id, alias in ObjectDB.objects.filter(
+                db_location=container, db_tags__db_tagtype="alias").values_list(
+                    "id", "db_tags__db_key"):
+            aliases.setdefault(obj_id, []).append(alias.lower())
+        for obj in contents:
+            self._add(obj, obj.key.lower(), tuple(aliases.get(obj.id, ())))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _add(self, obj, key, aliases):
+        self.entries[obj.id] = (obj, key, aliases)
+        for name in (key,) + aliases:
+            self.exact.setdefault(name, set()).add(obj.id)
+        for word in key.split():
+            insort(self.key_words, (word, obj.id))
+        for alias in aliases:
+            for word in alias.split():
+                insort(self.alias_words, (word, obj.id))
+
+    def add(self, obj):
+        """
+        Add an object to the index, or re-read its names if indexed.
+
+        Args:
+            obj (Object): The object.
+
+        """
+        key, aliases = _names(obj)
+        entry = self.entries.get(obj.id)
+        if entry and entry[1] == key and entry[2] == aliases:
+            return
+        self.remove(obj)
+        self._add(obj, key, aliases)
+
+    def remove(self, obj):
+        """
+        Remove an object from the index, if it is there.
+
+        Args:
+            obj (Object): The object.
+
+        """
+        entry = self.entries.pop(obj.id, None)
+        if entry is None:
+            return
+        _, key, aliases = entry
+        for name in (key,) + aliases:
+            ids = self.exact.get(name)
+            if ids is not None:
+                ids.discard(obj.id)
+                if not ids:
+                    del self.exact[name]
+        for words, names in ((self.key_words, (key,)), (self.alias_words, aliases)):
+            for name in names:
+                for word in name.split():
+                    pos = bisect_left(words, (word, obj.id))
+                    if pos < len(words) and words[pos] == (word, obj.id):
+                        del words[pos]
+
+    def _objects(self, ids):
+        """
+        Get the indexed objects with the given ids that are still here.
+        """
+        container = self.container
+        objects = []
+        for obj_id in ids:
+            obj = self.entries[obj_id][0]
+            if obj.location == container:
+                objects.append(obj)
+        return objects
+
+    def match_exact(self, name):
+        """
+        Get the objects with a key or alias equal to name.
+
+        Args:
+            name (str): The lowercase name.
+
+        Returns:
+            objects (list): The matching objects.
+
+        """
+        return self._objects(self.exact.get(name, ()))
+
+    def match_partial(self, query_words, aliases=False):
+        """
+        Get the objects with a key (or alias) matching the query word
+        by word.
+
+        Args:
+            query_words (list): The lowercase words of the query.
+            aliases (bool, optional): Match aliases instead of keys.
+
+        Returns:
+            objects (list): The matching objects.
+
+        """
+        words = self.alias_words if aliases else self.key_words
+        first = query_words[0]
+        ids = set()
+        pos = bisect_left(words, (first,))
+        while pos < len(words) and words[pos][0].startswith(first):
+            ids.add(words[pos][1])
+            pos += 1
+        query = " ".join(query_words)
+        matches = []
+        for obj_id in ids:
+            _, key, obj_aliases = self.entries[obj_id]
+            if aliases:
+                # the database pre-filters aliases on containing the query
+                if any(query in alias and _partial_match(alias, query_words)
+                       for alias in obj_aliases):
+                    matches.append(obj_id)
+            elif _partial_match(key, query_words):
+                matches.append(obj_id)
+        return self._objects(matches)
+
+
+def get_index(container):
+    """
+    Get the name index of an object's contents, building it if needed.
+
+    Args:
+        container (Object): The object.
+
+    Returns:
+        index (NameIndex): The index.
+
+    """
+    index = container.ndb._name_index
+    if index is None:
+        index = NameIndex(container)
+        container.ndb._name_index = index
+    return index
+
+
+def _match(query, containers, extras, exact):
+    """
+    One search pass over the contents of the containers and the
+    extras, matching either whole names or word by word.
+    """
+    query = query.strip().lower()
+    if not query:
+        return []
+    found = {}
+    indexes = [get_index(container) for container in containers]
+    if exact:
+        for index in indexes:
+            for obj in index.match_exact(query):
+                found[obj.id] = obj
+        for obj in extras:
+            key, aliases = _names(obj)
+            if query == key or query in aliases:
+                found[obj.id] = obj
+        return [found[obj_id] for obj_id in sorted(found)]
+
+    query_words = query.split()
+    for aliases in (False, True):
+        for index in indexes:
+            for obj in index.match_partial(query_words, aliases=aliases):
+                found[obj.id] = obj
+        for obj in extras:
+            key, obj_aliases = _names(obj)
+            if aliases:
+                if any(query in alias and _partial_match(alias, query_words)
+                       for alias in obj_aliases):
+                    found[obj.id] = obj
+            elif _partial_match(key, query_words):
+                found[obj.id] = obj
+        if found:
+            break
+    return [found[obj_id] for obj_id in sorted(found)]
+
+
+def search(query, containers, extras=(), exact=False):
+    """
+    Search the contents of some objects by key and alias.
+
+    Args:
+        query (str): The search string, possibly on the form `2-ball`.
+        containers (list): The objects whose contents to search.
+        extras (list, optional): More objects to match, such as the
+            location itself.
+        exact (bool, optional): Only match whole keys and aliases.
+
+    Returns:
+        matches (list): The matching objects, ordered by id.
+
+    """
+    matches = _match(query, containers, extras, True)
+    if matches:
+        return matches
+    match_number = None
+    match = _MULTIMATCH_REGEX.match(query)
+    if match:
+        match_number = int(match.group("number")) - 1
+        match_number = match_number if match_number >= 0 else None
+        query = match.group("name")
+    if match_number is not None or not exact:
+        matches = _match(query, containers, extras, exact)
+    if len(matches) > 1 and match_number is not None and match_number < len(matches):
+        matches = [matches[match_number]]
+    return matches
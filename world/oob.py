@@ -0,0 +1,212 @@
+"""
+OOB input handling
+
+Support for the high-frequency input functions in
+`server/conf/inputfuncs.py`, which the webclient calls directly (as
+`["cmdname", [args], {kwargs}]`) instead of sending text commands, so
+they skip command parsing and cmdset merging entirely.
+
+Decorating an input function with `handler()` adds:
+
+ - rate limiting: a token bucket per session and function, allowing
+   `rate` calls per second with bursts of up to `burst` calls. Calls
+   over the limit are dropped.
+ - coalescing: with `coalesce` set (in seconds), a call arriving within
+   that time of the last one is not run right away. Instead the last
+   such call runs once when the time is up, so a client polling faster
+   than that gets at most one reply per `coalesce` seconds.
+ - metrics: calls, dropped and coalesced calls, errors and a histogram
+   of run times for every function, see `stats()` and `@oobstats`.
+
+    from world import oob
+
+    @oob.handler(rate=10, burst=20, coalesce=0.25)
+    def status(session, *args, **kwargs):
+        ...
+
+"""
+from functools import wraps
+from time import time
+from twisted.internet import reactor
+from evennia.utils import logger
+
+# upper bounds (ms) of the latency histogram buckets; the last is open
+LATENCY_BUCKETS = (0.1, 0.5, 1, 5, 10, 50, 100)
+
+# function name: FuncStats
+_STATS = {}
+
+
+class FuncStats(object):
+    """
+    Call counts and latencies of one input function.
+
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        """
+        Zero all counts.
+        """
+        self.calls = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.total = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, seconds):
+        """
+        Record the run time of one call.
+
+        Args:
+            seconds (float): How long the call took.
+
+        """
+        self.total += seconds
+        millis = seconds * 1000.0
+        for num, bound in enumerate(LATENCY_BUCKETS):
+            if millis <= bound:
+                self.histogram[num] += 1
+                return
+        self.histogram[-1] += 1
+
+    def as_dict(self):
+        """
+        Get the stats as a dict.
+
+        Returns:
+            stats (dict): With keys `calls`, `dropped`, `coalesced`,
+                `errors`, `mean_ms` and `histogram` (a list of
+                `(upper bound in ms or None, count)`).
+
+        """
+        ran = sum(self.histogram)
+        bounds = list(LATENCY_BUCKETS) + [None]
+        return {"calls": self.calls, "dropped": self.dropped,
+                "coalesced": self.coalesced, "errors": self.errors,
+                "mean_ms": self.total * 1000.0 / ran if ran else 0.0,
+                "histogram": list(zip(bounds, self.histogram))}
+
+
+def _session_state(session, name):
+    """
+    Get the per-session state of an input function, kept on the session.
+    """
+    states = session.ndb._oob_state
+    if states is None:
+        states = session.ndb._oob_state = {}
+    state = states.get(name)
+    if state is None:
+        # [tokens, last refill, last run, pending call]
+        state = states[name] = [None, 0.0, 0.0, None]
+    return state
+
+
+def _allow(state, rate, burst, now):
+    """
+    Take a token from the bucket, if there is one.
+    """
+    tokens = burst if state[0] is None else min(burst, state[0] + (now - state[1]) * rate)
+    state[1] = now
+    if tokens < 1:
+        state[0] = tokens
+        return False
+    state[0] = tokens - 1
+    return True
+
+
+def _run(func, stats, session, args, kwargs):
+    t0 = time()
+    try:
+        func(session, *args, **kwargs)
+    except Exception:
+        stats.errors += 1
+        logger.log_trace("OOB input function %s failed." % stats.name)
+    stats.record(time() - t0)
+
+
+def handler(rate=None, burst=None, coalesce=None):
+    """
+    Decorator for input functions adding rate limiting, coalescing and
+    metrics.
+
+    Args:
+        rate (float, optional): Calls allowed per second and session.
+            No limit if not given.
+        burst (int, optional): Calls allowed in a burst. Defaults to
+            twice `rate`.
+        coalesce (float, optional): Run at most one call per this many
+            seconds and session, running the latest of the calls held
+            back when the time is up.
+
+    Returns:
+        decorator (callable): Wraps the input function. The wrapper
+            keeps the function's name and module, so Evennia still
+            finds it as an input function.
+
+    """
+    burst = burst or (rate * 2 if rate else None)
+
+    def decorator(func):
+        name = func.__name__
+        stats = _STATS[name] = FuncStats(name)
+
+        @wraps(func)
+        def inputfunc(session, *args, **kwargs):
+            stats.calls += 1
+            if not rate and not coalesce:
+                _run(func, stats, session, args, kwargs)
+                return
+            now = time()
+            state = _session_state(session, name)
+            if rate and not _allow(state, rate, burst, now):
+                stats.dropped += 1
+                return
+            if coalesce:
+                pending = state[3]
+                if pending is not None and pending[0].active():
+                    # replace the held back call with this one
+                    stats.coalesced += 1
+                    pending[1], pending[2] = args, kwargs
+                    return
+                wait = state[2] + coalesce - now
+                if wait > 0:
+                    pending = [None, args, kwargs]
+
+                    def run_pending():
+                        state[3] = None
+                        state[2] = time()
+                        _run(func, stats, session, pending[1], pending[2])
+
+                    pending[0] = reactor.callLater(wait, run_pending)
+                    state[3] = pending
+                    return
+                state[2] = now
+            _run(func, stats, session, args, kwargs)
+
+        return inputfunc
+    return decorator
+
+
+def stats():
+    """
+    Get the metrics of all decorated input functions.
+
+    Returns:
+        stats (dict): Mapping function names to `FuncStats.as_dict()`.
+
+    """
+    return dict((name, funcstats.as_dict()) for name, funcstats in _STATS.items())
+
+
+def reset_stats():
+    """
+    Zero the metrics of all decorated input functions.
+    """
+    # the input functions hold on to their FuncStats
+    for funcstats in _STATS.values():
+        funcstats.reset()
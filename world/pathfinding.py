@@ -0,0 +1,382 @@
+"""
+Pathfinding
+
+Finds routes between rooms without touching the database. The exits
+of the world (from `world.exitgraph`) are compacted into integer-indexed
+adjacency arrays: every room gets an index, and the exits leading out
+of room `i` are the array slots `offsets[i]` to `offsets[i + 1]`.
+
+Traverse locks are sorted into lock classes when the arrays are built:
+
+    OPEN   - `traverse:all()` or no traverse lock; always passable.
+    CLOSED - `traverse:false()`; only passable by superusers.
+    CHECK  - anything else; the lock is checked against the traveller
+             (loading the exit) the first time the search reaches it.
+
+If rooms have an Attribute `coordinates` holding a tuple `(x, y[, z])`,
+searches use A* with the Manhattan distance as heuristic. This assumes
+no exit moves further than one step in the coordinate system; rooms
+without coordinates are searched as without heuristic. Without
+coordinates, a plain breadth-first search is used.
+
+The arrays and the recently found paths are rebuilt whenever an exit
+of the world changes: when one is created, deleted, moved, linked to
+another destination or unlinked, or when its locks change (see
+`world.exitgraph`).
+
+    path = find_path(caller.location, target, traveller=caller)
+
+See `benchmark()` for timings on synthetic grids.
+
+"""
+from array import array
+from collections import OrderedDict, defaultdict, deque
+from heapq import heappush, heappop
+from random import Random
+from time import time
+from django.conf import settings
+from evennia.objects.models import ObjectDB
+from world import exitgraph
+
+OPEN, CLOSED, CHECK = 0, 1, 2
+
+_COORDINATES_ATTRIBUTE = getattr(settings, "PATHFINDING_COORDINATES_ATTRIBUTE", "coordinates")
+_PATH_CACHE_SIZE = getattr(settings, "PATHFINDING_PATH_CACHE_SIZE", 1024)
+
+# (graph version, Pathfinder)
+_PATHFINDER = [None, None]
+
+
+def lock_class(lockstring):
+    """
+    Get the lock class of an exit.
+
+    Args:
+        lockstring (str): The full lock string of the exit.
+
+    Returns:
+        lockclass (int): One of `OPEN`, `CLOSED` or `CHECK`.
+
+    """
+    for lock in (lockstring or "").split(";"):
+        access_type, _, definition = lock.partition(":")
+        if access_type.strip() == "traverse":
+            definition = definition.replace(" ", "")
+            if definition in ("all()", "true()"):
+                return OPEN
+            if definition in ("false()", "none()"):
+                return CLOSED
+            return CHECK
+    return OPEN
+
+
+class Pathfinder(object):
+    """
+    Shortest-path searches over a compact copy of the exit graph.
+
+    """
+
+    def __init__(self, edges, coords=None):
+        """
+        Args:
+            edges (iterable): Tuples `(exit_id, location_id, destination_id, lockclass)`.
+            coords (dict, optional): Mapping room ids to coordinate tuples. If
+                given, searches use A*.
+
+        """
+        index = {}
+        rooms = []
+        outgoing = defaultdict(list)
+        for exit_id, location, destination, lockclass in edges:
+            if location is None or destination is None:
+                continue
+            for room in (location, destination):
+                if room not in index:
+                    index[room] = len(rooms)
+                    rooms.append(room)
+            outgoing[index[location]].append((index[destination], exit_id, lockclass))
+
+        offsets = array("l", [0])
+        sources, targets, exits = array("l"), array("l"), array("l")
+        lockclasses = array("b")
+        for iroom in range(len(rooms)):
+            for target, exit_id, lockclass in outgoing.get(iroom, ()):
+                sources.append(iroom)
+                targets.append(target)
+                exits.append(exit_id)
+                lockclasses.append(lockclass)
+            offsets.append(len(targets))
+
+        self.index = index
+        self.rooms = rooms
+        self.offsets = offsets
+        self.sources = sources
+        self.targets = targets
+        self.exits = exits
+        self.lockclasses = lockclasses
+        self.coords = None
+        if coords:
+            self.coords = [coords.get(room) for room in rooms]
+        self._cache = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def _make_passable(self, traveller):
+        """
+        Get a function telling if the traveller may pass an edge. Lock
+        results for CHECK edges are remembered for the search.
+        """
+        lockclasses = self.lockclasses
+        superuser = bool(traveller and getattr(traveller, "is_superuser", False))
+        checked = {}
+
+        def passable(edge):
+            lockclass = lockclasses[edge]
+            if lockclass == OPEN or superuser:
+                return True
+            if lockclass == CLOSED:
+                return False
+            if traveller is None:
+                checked[edge] = False
+                return False
+            result = checked.get(edge)
+            if result is None:
+                exi = ObjectDB.objects.get_id(self.exits[edge])
+                result = bool(exi and exi.access(traveller, "traverse"))
+                checked[edge] = result
+            return result
+
+        passable.checked = checked
+        return passable
+
+    def _bfs(self, istart, igoal, passable):
+        offsets, targets = self.offsets, self.targets
+        previous = {istart: -1}
+        queue = deque([istart])
+        while queue:
+            node = queue.popleft()
+            if node == igoal:
+                return previous
+            for edge in range(offsets[node], offsets[node + 1]):
+                target = targets[edge]
+                if target not in previous and passable(edge):
+                    previous[target] = edge
+                    queue.append(target)
+        return None
+
+    def _astar(self, istart, igoal, passable):
+        offsets, targets, coords = self.offsets, self.targets, self.coords
+        goal = coords[igoal]
+
+        def heuristic(node):
+            pos = coords[node]
+            if pos is None or goal is None:
+                return 0
+            return sum(abs(a - b) for a, b in zip(pos, goal))
+
+        previous = {istart: -1}
+        costs = {istart: 0}
+        heap = [(heuristic(istart), 0, istart)]
+        while heap:
+            _, cost, node = heappop(heap)
+            if node == igoal:
+                return previous
+            if cost > costs[node]:
+                # outdated heap entry
+                continue
+            cost += 1
+            for edge in range(offsets[node], offsets[node + 1]):
+                target = targets[edge]
+                if cost < costs.get(target, cost + 1) and passable(edge):
+                    costs[target] = cost
+                    previous[target] = edge
+                    heappush(heap, (cost + heuristic(target), cost, target))
+        return None
+
+    def find_path(self, start, goal, traveller=None):
+        """
+        Find the shortest route between two rooms.
+
+        Args:
+            start (int): Id of the room to start from.
+            goal (int): Id of the room to go to.
+            traveller (Object, optional): Who is going to walk the route,
+                used for checking traverse locks. If not given, only
+                exits with an `OPEN` lock class are used.
+
+        Returns:
+            path (list or None): The ids of the exits to traverse, in
+                order, or `None` if there is no route.
+
+        """
+        if start == goal:
+            return []
+        istart, igoal = self.index.get(start), self.index.get(goal)
+        if istart is None or igoal is None:
+            return None
+
+        # paths that didn't need any per-traveller lock checks are
+        # cached for everyone
+        traveller_key = ("traveller", getattr(traveller, "id", None))
+        for key in ((start, goal, None), (start, goal, traveller_key)):
+            if key in self._cache:
+                self.stats["hits"] += 1
+                path = self._cache.pop(key)
+                self._cache[key] = path
+                return list(path) if path is not None else None
+        self.stats["misses"] += 1
+
+        passable = self._make_passable(traveller)
+        if self.coords is not None:
+            previous = self._astar(istart, igoal, passable)
+        else:
+            previous = self._bfs(istart, igoal, passable)
+
+        path = None
+        if previous is not None:
+            path = []
+            node = igoal
+            while node != istart:
+                edge = previous[node]
+                path.append(self.exits[edge])
+                node = self.sources[edge]
+            path.reverse()
+
+        key = (start, goal, traveller_key if passable.checked or
+               getattr(traveller, "is_superuser", False) else None)
+        if len(self._cache) >= _PATH_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        self._cache[key] = tuple(path) if path is not None else None
+        return path
+
+
+def _load_coordinates():
+    """
+    Load the coordinates of all rooms that have them.
+    """
+    coords = {}
+    for room_id, value in ObjectDB.objects.filter(
+            db_attributes__db_key=_COORDINATES_ATTRIBUTE).values_list(
+                "id", "db_attributes__db_value"):
+        try:
+            coords[room_id] = tuple(int(val) for val in value)
+        except (TypeError, ValueError):
+            continue
+    return coords
+
+
+def get_pathfinder():
+    """
+    Get the Pathfinder for the current world, rebuilding it if any exit
+    changed since it was last built.
+
+    Returns:
+        pathfinder (Pathfinder): The pathfinder.
+
+    """
+    version = exitgraph.graph_version()
+    if _PATHFINDER[0] != version or _PATHFINDER[1] is None:
+        lockstrings = dict(ObjectDB.objects.filter(
+            db_destination__isnull=False).values_list("id", "db_lock_storage"))
+        edges = ((edge.id, edge.location, edge.destination,
+                  lock_class(lockstrings.get(edge.id)))
+                 for edge in exitgraph.all_edges())
+        _PATHFINDER[1] = Pathfinder(edges, coords=_load_coordinates())
+        _PATHFINDER[0] = version
+    return _PATHFINDER[1]
+
+
+def find_path(start, goal, traveller=None):
+    """
+    Find the shortest route between two rooms.
+
+    Args:
+        start (Room or int): The room (or room id) to start from.
+        goal (Room or int): The room (or room id) to go to.
+        traveller (Object, optional): Who is going to walk the route.
+            Used for checking traverse locks.
+
+    Returns:
+        path (list or None): The ids of the exits to traverse, in
+            order, or `None` if there is no route.
+
+    """
+    start = getattr(start, "id", start)
+    goal = getattr(goal, "id", goal)
+    return get_pathfinder().find_path(start, goal, traveller=traveller)
+
+
+def grid_edges(side):
+    """
+    Create the exits of a synthetic square grid, where every room
+    connects to its four neighbours.
+
+    Args:
+        side (int): Rooms along each side of the grid.
+
+    Returns:
+        edges, coords (tuple): Edges in the form taken by `Pathfinder`
+            and a dict of room coordinates.
+
+    """
+    edges = []
+    coords = {}
+    exit_id = 0
+    for y in range(side):
+        for x in range(side):
+            room = y * side + x
+            coords[room] = (x, y)
+            for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+                nx, ny = x + dx, y + dy
+                if 0 <= nx < side and 0 <= ny < side:
+                    edges.append((exit_id, room, ny * side + nx, OPEN))
+                    exit_id += 1
+    return edges, coords
+
+
+def benchmark(sizes=(10000, 50000, 100000), queries=100, seed=0):
+    """
+    Time searches on synthetic grids of rooms.
+
+    Args:
+        sizes (tuple, optional): Approximate numbers of rooms to test.
+        queries (int, optional): Random start/goal pairs per size.
+        seed (int, optional): Seed for choosing the pairs.
+
+    Returns:
+        results (list): One dict per size with keys `rooms`, `build`
+            (seconds to build the arrays), `bfs_ms` and `astar_ms` (mean
+            milliseconds per uncached search) and `cached_ms` (mean
+            milliseconds per cached lookup).
+
+    """
+    rand = Random(seed)
+    results = []
+    for size in sizes:
+        side = int(size ** 0.5)
+        edges, coords = grid_edges(side)
+        nrooms = side * side
+        pairs = [(rand.randrange(nrooms), rand.randrange(nrooms)) for _ in range(queries)]
+
+        t0 = time()
+        bfs = Pathfinder(edges)
+        build = time() - t0
+        astar = Pathfinder(edges, coords=coords)
+
+        timings = {}
+        for name, pathfinder in (("bfs_ms", bfs), ("astar_ms", astar)):
+            t0 = time()
+            for start, goal in pairs:
+                pathfinder.find_path(start, goal)
+            timings[name] = (time() - t0) * 1000.0 / queries
+        t0 = time()
+        for start, goal in pairs:
+            astar.find_path(start, goal)
+        timings["cached_ms"] = (time() - t0) * 1000.0 / queries
+
+        result = {"rooms": nrooms, "build": build}
+        result.update(timings)
+        results.append(result)
+    return results
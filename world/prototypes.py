@@ -33,6 +33,8 @@ Possible keywords are:
     any other keywords are interpreted as Attributes and their values.
 
 See the `@spawn` command and `evennia.utils.spawner` for more info.
+To spawn many objects of one prototype at once from code, see
+`world.spawning.spawn_bulk`.
 
 """
 
@@ -0,0 +1,172 @@
+"""
+Render cache
+
+Evennia's portal turns the `|r`/`|n` markup of outgoing text into ANSI
+codes (telnet, ssh) or HTML (webclient) separately for every session,
+so a message broadcast to 300 sessions is rendered 300 times, though
+there are only a few kinds of client.
+
+`server.conf.serversession.ServerSession` renders text itself instead,
+through this cache, and sends it on as `raw` so the portal leaves it
+alone. The cache is keyed on the text and the session's capability
+profile, such as `"xterm256"`, `"ansi"`, `"none"` (no colors),
+`"html"` or `"html-nocolor"` (`+mxp` is added for MXP clients). A
+broadcast is then rendered once per profile among its receivers.
+
+The cache holds at most `RENDER_CACHE_MEMORY` bytes of texts and
+renderings, dropping the least recently used ones first. Longer texts
+than an eighth of that are rendered without being cached.
+
+"""
+import re
+from collections import OrderedDict
+from django.conf import settings
+from evennia.utils.utils import to_str
+
+_MEMORY = getattr(settings, "RENDER_CACHE_MEMORY", 4 * 1024 * 1024)
+_MAX_TEXT = _MEMORY // 8
+# rough bytes used by an entry besides its strings
+_ENTRY_OVERHEAD = 200
+
+# the same as the telnet protocol, which always ends text with |n
+_RE_N = re.compile(r"\|n$")
+
+# (profile, text): rendered text
+_CACHE = OrderedDict()
+_SIZE = [0]
+_STATS = {"hits": 0, "misses": 0, "evictions": 0, "uncacheable": 0}
+# profile: [hits, misses]
+_PROFILES = {}
+_RENDERERS = {}
+
+
+def _render_ansi(text, xterm256, nocolor, mxp):
+    """
+    Render text like the telnet protocol.
+    """
+    from evennia.utils.ansi import parse_ansi
+    text = parse_ansi(_RE_N.sub("", text) + ("||n" if text.endswith("|") else "|n"),
+                      strip_ansi=nocolor, xterm256=xterm256, mxp=mxp)
+    if mxp:
+        from evennia.server.portal.mxp import mxp_parse
+        text = mxp_parse(text)
+    return text
+
+
+def _render_html(text, nocolor):
+    """
+    Render text like the webclient protocols.
+    """
+    from evennia.utils.text2html import parse_html
+    return parse_html(text, strip_ansi=nocolor)
+
+
+def telnet_profile(xterm256=False, ansi=False, nocolor=False, mxp=False):
+    """
+    Get the profile of a telnet-like client.
+
+    Args:
+        xterm256 (bool, optional): If it shows 256 colors.
+        ansi (bool, optional): If it shows ANSI colors.
+        nocolor (bool, optional): If colors are turned off.
+        mxp (bool, optional): If it understands MXP links.
+
+    Returns:
+        profile (str): The profile.
+
+    """
+    nocolor = nocolor or not (xterm256 or ansi)
+    profile = "none" if nocolor else "xterm256" if xterm256 else "ansi"
+    if mxp:
+        profile += "+mxp"
+    if profile not in _RENDERERS:
+        _RENDERERS[profile] = lambda text: _render_ansi(text, bool(xterm256) and not nocolor,
+                                                        bool(nocolor), bool(mxp))
+    return profile
+
+
+def web_profile(nocolor=False):
+    """
+    Get the profile of a webclient.
+
+    Args:
+        nocolor (bool, optional): If colors are turned off.
+
+    Returns:
+        profile (str): The profile.
+
+    """
+    profile = "html-nocolor" if nocolor else "html"
+    if profile not in _RENDERERS:
+        _RENDERERS[profile] = lambda text: _render_html(text, bool(nocolor))
+    return profile
+
+
+def render(text, profile):
+    """
+    Render markup for a kind of client, using the cache.
+
+    Args:
+        text (str): The text with markup.
+        profile (str): The client's profile, as from `telnet_profile`
+            or `web_profile`.
+
+    Returns:
+        rendered (str): The text as the client should get it.
+
+    """
+    text = to_str(text, force_string=True)
+    counts = _PROFILES.get(profile)
+    if counts is None:
+        counts = _PROFILES[profile] = [0, 0]
+    key = (profile, text)
+    rendered = _CACHE.pop(key, None)
+    if rendered is not None:
+        _STATS["hits"] += 1
+        counts[0] += 1
+        _CACHE[key] = rendered
+        return rendered
+    _STATS["misses"] += 1
+    counts[1] += 1
+    rendered = to_str(_RENDERERS[profile](text), force_string=True)
+    size = len(text) + len(rendered) + _ENTRY_OVERHEAD
+    if size > _MAX_TEXT:
+        _STATS["uncacheable"] += 1
+        return rendered
+    _CACHE[key] = rendered
+    _SIZE[0] += size
+    while _SIZE[0] > _MEMORY and _CACHE:
+        (_, old_text), old_rendered = _CACHE.popitem(last=False)
+        _SIZE[0] -= len(old_text) + len(old_rendered) + _ENTRY_OVERHEAD
+        _STATS["evictions"] += 1
+    return rendered
+
+
+def clear_cache():
+    """
+    Forget all renderings.
+    """
+    _CACHE.clear()
+    _SIZE[0] = 0
+
+
+def stats():
+    """
+    Get render cache statistics.
+
+    Returns:
+        stats (dict): With keys `entries`, `bytes` (estimated memory
+            used), `hits`, `misses`, `evictions`, `uncacheable` (texts
+            too long to cache), `hit_ratio` and `profiles` (mapping each
+            profile to its `(hits, misses, hit ratio)`).
+
+    """
+    result = dict(_STATS)
+    result["entries"] = len(_CACHE)
+    result["bytes"] = _SIZE[0]
+    lookups = _STATS["hits"] + _STATS["misses"]
+    result["hit_ratio"] = float(_STATS["hits"]) / lookups if lookups else 0.0
+    result["profiles"] = dict(
+        (profile, (hits, misses, float(hits) / (hits + misses) if hits + misses else 0.0))
+        for profile, (hits, misses) in _PROFILES.items())
+    return result
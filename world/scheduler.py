@@ -0,0 +1,282 @@
+"""
+Tick scheduler
+
+Shared timers for Scripts. Normally every Script with an `interval`
+gets its own Twisted LoopingCall, so thousands of NPC scripts mean
+thousands of reactor timers, and scripts started together fire in
+bursts.
+
+Here, Scripts with the same interval share a `Bucket`: a timing wheel
+with one reactor timer that steps through a number of slots over the
+course of each interval. Every Script is placed in one slot and fires
+when the wheel reaches it, so the `at_repeat` calls of a bucket are
+spread evenly across the interval.
+
+To keep the slots evenly loaded, the first repeat of a newly started
+Script may come up to half an interval earlier or later than with a
+timer of its own. Resumed (unpaused) Scripts keep their timing.
+
+Which slots are due is worked out from the time since the wheel
+started, so when the reactor was blocked for a while, the slots passed
+over are all ticked at once and the wheel doesn't fall behind.
+
+Each slot tick has a time budget (by default half of the time between
+slots). Ticks running over it are counted and logged, see `stats()`.
+
+Scripts use this by setting `tick_bucketed = True` on their class
+(see `typeclasses.scripts.Script`). Their `ndb._task` is then a
+`BucketTask`, which has the same interface as the `ExtendedLoopingCall`
+Evennia normally uses.
+
+"""
+from math import ceil
+from time import time
+from django.conf import settings
+from twisted.internet.task import LoopingCall
+from evennia.utils import logger
+
+# shortest time between two slots of a bucket, and most slots a bucket can have
+_MIN_SLOT_TIME = getattr(settings, "SCRIPT_BUCKET_MIN_SLOT_TIME", 0.1)
+_MAX_SLOTS = getattr(settings, "SCRIPT_BUCKET_MAX_SLOTS", 100)
+# part of the time between slots one slot tick may use before being reported
+_BUDGET_FRACTION = getattr(settings, "SCRIPT_BUCKET_BUDGET", 0.5)
+# don't log overruns of a bucket more often than this (seconds)
+_OVERRUN_LOG_INTERVAL = 60
+
+# interval: Bucket
+_BUCKETS = {}
+
+
+class Bucket(object):
+    """
+    A timing wheel for all tasks with the same interval.
+
+    """
+
+    def __init__(self, interval):
+        """
+        Args:
+            interval (float): The repeat interval of the tasks, in seconds.
+
+        """
+        self.interval = interval
+        nslots = int(interval / _MIN_SLOT_TIME)
+        self.nslots = max(1, min(_MAX_SLOTS, nslots))
+        self.slot_time = float(interval) / self.nslots
+        self.budget = self.slot_time * _BUDGET_FRACTION
+        self.slots = [set() for _ in range(self.nslots)]
+        # number of the next slot tick since the wheel started
+        self.next_tick = 0
+        self.started = None
+        self.ticks = 0
+        self.overruns = 0
+        self.worst = 0.0
+        self._last_overrun_log = 0
+        self._loop = LoopingCall(self._tick)
+
+    def __len__(self):
+        return sum(len(slot) for slot in self.slots)
+
+    def slot_due_time(self, islot, after):
+        """
+        Get the first time a slot is ticked at or after a given time.
+
+        Args:
+            islot (int): The slot.
+            after (float): Time stamp.
+
+        Returns:
+            due (float): Time stamp of the tick.
+
+        """
+        # the wheel's timer first fires one slot_time after starting,
+        # ticking slot 0.
+        first = self.started + (islot + 1) * self.slot_time
+        nturns = max(0, int(ceil((after - first) / self.interval)))
+        return first + nturns * self.interval
+
+    def add(self, task, first_call):
+        """
+        Place a task in the wheel.
+
+        Args:
+            task (BucketTask): The task to add.
+            first_call (float or None): Time stamp of when the task should
+                first be called. If `None`, the task goes into the slot with
+                fewest tasks, and is first called between a half and one and
+                a half intervals from now.
+
+        """
+        if not self._loop.running:
+            self.started = time()
+            self.next_tick = 0
+            self._loop.start(self.slot_time, now=False)
+        if first_call is None:
+            islot = min(range(self.nslots), key=lambda i: len(self.slots[i]))
+            first_call = self.slot_due_time(islot, time() + self.interval / 2.0)
+        else:
+            phase = (first_call - self.started - self.slot_time) % self.interval
+            islot = int(round(phase / self.slot_time)) % self.nslots
+            first_call = self.slot_due_time(islot, first_call - self.slot_time / 2.0)
+        task.islot = islot
+        task.due = first_call
+        self.slots[islot].add(task)
+
+    def remove(self, task):
+        """
+        Remove a task from the wheel, stopping the wheel if it's empty.
+
+        Args:
+            task (BucketTask): The task to remove.
+
+        """
+        self.slots[task.islot].discard(task)
+        if not any(self.slots):
+            if self._loop.running:
+                self._loop.stop()
+            _BUCKETS.pop(self.interval, None)
+
+    def _tick(self):
+        """
+        Called once per slot time; fires the tasks in the slots the
+        wheel reached since the last call. The LoopingCall skips calls
+        when the reactor was blocked, so that may be several slots.
+        """
+        t0 = time()
+        # slot ticks are due one slot_time after starting and every
+        # slot_time after that; allow for the timer firing a little early
+        last_tick = int(round((t0 - self.started) / self.slot_time)) - 1
+        # after a long stall, every slot is ticked once
+        first_tick = max(self.next_tick, last_tick - self.nslots + 1)
+        self.next_tick = max(self.next_tick, last_tick + 1)
+        horizon = t0 + self.slot_time / 2.0
+        ntasks = 0
+        for tick in range(first_tick, last_tick + 1):
+            islot = tick % self.nslots
+            self.ticks += 1
+            ntasks += len(self.slots[islot])
+            for task in list(self.slots[islot]):
+                if task.running and task.due <= horizon:
+                    task.due += self.interval
+                    if task.due < t0:
+                        # we fell far behind; don't try to catch up
+                        task.due = self.slot_due_time(islot, t0)
+                    task.fire()
+        spent = time() - t0
+        nslots = last_tick - first_tick + 1
+        if nslots > 0 and spent > self.budget * nslots:
+            self.overruns += 1
+            self.worst = max(self.worst, spent)
+            if t0 - self._last_overrun_log > _OVERRUN_LOG_INTERVAL:
+                self._last_overrun_log = t0
+                logger.log_warn(
+                    "Script bucket %ss: %i slot(s) took %.1fms (budget %.1fms, %i tasks). "
+                    "%i overruns so far." % (self.interval, nslots, spent * 1000,
+                                             self.budget * nslots * 1000, ntasks,
+                                             self.overruns))
+
+
+class BucketTask(object):
+    """
+    Stand-in for Evennia's `ExtendedLoopingCall`, running a callback
+    from a shared `Bucket` instead of from its own timer.
+
+    """
+
+    def __init__(self, callback):
+        """
+        Args:
+            callback (callable): Called every interval.
+
+        """
+        self.callback = callback
+        self.interval = None
+        self.callcount = 0
+        self.running = False
+        self.bucket = None
+        self.islot = None
+        self.due = None
+
+    def start(self, interval, now=True, start_delay=None, count_start=0):
+        """
+        Start calling the callback every `interval` seconds.
+
+        Args:
+            interval (int): Repeat interval in seconds.
+            now (bool, optional): Call the callback right away.
+            start_delay (float, optional): Seconds until the first call,
+                used when resuming a paused Script.
+            count_start (int, optional): Calls already made, when resuming.
+
+        """
+        self.interval = interval
+        self.callcount = count_start
+        self.running = True
+        bucket = _BUCKETS.get(interval)
+        if bucket is None:
+            bucket = _BUCKETS[interval] = Bucket(interval)
+        self.bucket = bucket
+        bucket.add(task=self, first_call=time() + start_delay if start_delay else None)
+        if now and not start_delay:
+            self.fire()
+
+    def stop(self):
+        """
+        Stop repeating.
+        """
+        if self.running:
+            self.running = False
+            self.bucket.remove(self)
+
+    def force_repeat(self):
+        """
+        Call the callback now, and the next time an interval from now,
+        like `ExtendedLoopingCall.force_repeat`.
+        """
+        assert self.running, "Tried to fire a BucketTask that was not running."
+        bucket = self.bucket
+        bucket.slots[self.islot].discard(self)
+        bucket.add(task=self, first_call=time() + self.interval)
+        self.fire()
+
+    def fire(self):
+        """
+        Call the callback once.
+        """
+        self.callcount += 1
+        try:
+            self.callback()
+        except Exception:
+            logger.log_trace()
+
+    def next_call_time(self):
+        """
+        Get the time until the next call.
+
+        Returns:
+            seconds (float or None): Seconds until the next call, or `None`
+                if not running.
+
+        """
+        if not self.running:
+            return None
+        return max(0.0, self.due - time())
+
+
+def stats():
+    """
+    Get the state of all buckets.
+
+    Returns:
+        stats (list): One dict per bucket with keys `interval`, `tasks`,
+            `slots`, `ticks`, `budget_ms`, `overruns` and `worst_ms`.
+
+    """
+    return [{"interval": bucket.interval,
+             "tasks": len(bucket),
+             "slots": bucket.nslots,
+             "ticks": bucket.ticks,
+             "budget_ms": bucket.budget * 1000,
+             "overruns": bucket.overruns,
+             "worst_ms": bucket.worst * 1000}
+            for _, bucket in sorted(_BUCKETS.items())]
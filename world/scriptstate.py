@@ -0,0 +1,144 @@
+"""
+Script state checkpointing
+
+Scripts keep their pause state, the time left to their next repeat
+and how many times they have repeated in the database. Saving these on
+every change means a steady stream of small UPDATEs from scripts with
+short intervals, and thousands of them when all scripts are paused
+for a reload.
+
+Scripts with `shadow_state` set (see `typeclasses.scripts.Script`)
+instead keep this state in memory and mark themselves dirty here. All
+dirty scripts are written in one transaction every
+`SCRIPT_STATE_FLUSH_INTERVAL` seconds, and always when the server
+stops (from `server/conf/at_server_startstop.py`), after Evennia has
+paused all scripts. When the server starts again, `resume()` unpauses
+them.
+
+The trade-off: if the server crashes (rather than being stopped or
+reloaded), changes made since the last flush are lost. A script may
+then restart as running although it was paused in the last window,
+and with the repeat count of the last flush, so a script with a
+limited number of `repeats` may repeat up to one flush window's worth
+of times more than it should.
+
+"""
+from time import time
+from django.conf import settings
+from django.db import transaction
+from twisted.internet.task import LoopingCall
+from evennia.scripts.models import ScriptDB
+from evennia.utils import logger
+
+_FLUSH_INTERVAL = getattr(settings, "SCRIPT_STATE_FLUSH_INTERVAL", 30)
+
+# name of the Attribute storing the state
+STATE_ATTRIBUTE = "_shadow_state"
+
+# script id: script
+_DIRTY = {}
+_STATS = {"flushes": 0, "scripts": 0, "last_flush": None, "last_duration": 0.0}
+_LOOP = [None]
+
+
+def mark_dirty(script):
+    """
+    Queue the state of a script to be written on the next flush.
+
+    Args:
+        script (Script): The script whose state changed.
+
+    """
+    _DIRTY[script.id] = script
+
+
+def discard(script):
+    """
+    Don't write the state of a script, such as when it's deleted.
+
+    Args:
+        script (Script): The script.
+
+    """
+    _DIRTY.pop(script.id, None)
+
+
+def flush():
+    """
+    Write the state of all dirty scripts to the database, in one
+    transaction.
+
+    Returns:
+        nscripts (int): How many scripts were written.
+
+    """
+    if not _DIRTY:
+        return 0
+    t0 = time()
+    scripts = [script for script in _DIRTY.values() if script.pk]
+    _DIRTY.clear()
+    try:
+        with transaction.atomic():
+            for is_active in (True, False):
+                ids = [script.id for script in scripts if bool(script.db_is_active) == is_active]
+                if ids:
+                    ScriptDB.objects.filter(id__in=ids).update(db_is_active=is_active)
+            for script in scripts:
+                script.attributes.add(STATE_ATTRIBUTE, dict(script.shadow))
+    except Exception:
+        logger.log_trace("Could not flush the state of %i scripts." % len(scripts))
+        # try again next time
+        for script in scripts:
+            _DIRTY.setdefault(script.id, script)
+        return 0
+    _STATS["flushes"] += 1
+    _STATS["scripts"] += len(scripts)
+    _STATS["last_flush"] = t0
+    _STATS["last_duration"] = time() - t0
+    return len(scripts)
+
+
+def resume():
+    """
+    Unpause the scripts paused by the server when it last stopped.
+    Evennia looks for the `_paused_time` Attribute to find those, which
+    scripts with `shadow_state` don't have.
+
+    Returns:
+        nscripts (int): How many scripts were unpaused.
+
+    """
+    nscripts = 0
+    for script in ScriptDB.objects.filter(db_is_active=False,
+                                          db_attributes__db_key=STATE_ATTRIBUTE):
+        if not getattr(script, "shadow_state", False):
+            continue
+        state = script.shadow
+        if state.get("paused_time") is not None and not state.get("manual_pause"):
+            script.unpause(manual_unpause=False)
+            nscripts += 1
+    return nscripts
+
+
+def start():
+    """
+    Start flushing every `SCRIPT_STATE_FLUSH_INTERVAL` seconds.
+    """
+    if _LOOP[0] is None:
+        _LOOP[0] = LoopingCall(flush)
+        _LOOP[0].start(_FLUSH_INTERVAL, now=False)
+
+
+def stats():
+    """
+    Get flush statistics.
+
+    Returns:
+        stats (dict): With keys `dirty` (scripts waiting), `flushes`,
+            `scripts` (total written), `last_flush` (time stamp) and
+            `last_duration` (seconds).
+
+    """
+    result = dict(_STATS)
+    result["dirty"] = len(_DIRTY)
+    return result
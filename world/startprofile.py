@@ -0,0 +1,288 @@
+"""
+Startup profiler
+
+Set the environment variable `STARTUP_PROFILE` when starting or
+reloading the game (`STARTUP_PROFILE=1 evennia reload`) to find out
+where the Server and Portal spend their startup time. It records:
+
+ - imports: how long each imported module took, both in total and
+   without the modules it imported itself. `server/conf/settings.py`
+   starts the profiler before its `from evennia.settings_default
+   import *`, so everything after it is covered. Modules imported with
+   `importlib.import_module` (as Evennia does for typeclasses and
+   cmdsets) are not timed on their own but count towards whatever
+   imported them;
+ - hooks: the functions decorated with `timed`, which are the startup
+   hooks in `server/conf/at_server_startstop.py` and the
+   `start_plugin_services` functions of both plugin modules;
+ - cmdsets: how many of each cmdset class were created, and how long
+   that took (mostly `at_cmdset_creation`);
+ - lazy imports: which modules imported with `world.lazyimport` were
+   needed, and how long they took.
+
+`STARTUP_PROFILE_REPORT_DELAY` seconds after its plugin services were
+started, each process writes a report to `startup_profile_server.txt`
+or `startup_profile_portal.txt` in the log directory, and the
+profiler is removed again.
+
+Without `STARTUP_PROFILE` none of this is installed and `timed` hooks
+cost one extra function call.
+
+"""
+import os
+import sys
+from functools import wraps
+from time import time
+
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+ENVIRONMENT_VARIABLE = "STARTUP_PROFILE"
+# patched once imported, see _import
+_CMDSET_MODULE = "evennia.commands.cmdset"
+_REPORT_LINES = 30
+
+_ENABLED = [False]
+_T0 = [None]
+_ORIG = {}
+# module: [seconds, seconds without imported modules]
+_IMPORTS = {}
+# seconds spent in imported modules, for each import in progress
+_STACK = []
+# (hook name, seconds)
+_HOOKS = []
+# cmdset class path: [number created, seconds]
+_CMDSETS = {}
+
+
+def enabled():
+    """
+    Check if the profiler is running.
+
+    Returns:
+        enabled (bool): If it's running.
+
+    """
+    return _ENABLED[0]
+
+
+def _targets(name, globals_, fromlist, level):
+    """
+    Get the modules an import statement will load.
+    """
+    if level and level > 0 and globals_:
+        package = globals_.get("__package__") or globals_.get("__name__", "")
+        if "__path__" not in globals_ and not globals_.get("__package__"):
+            package = package.rpartition(".")[0]
+        for _ in range(level - 1):
+            package = package.rpartition(".")[0]
+        name = "%s.%s" % (package, name) if name else package
+    names = [name]
+    if fromlist:
+        names.extend("%s.%s" % (name, attr) for attr in fromlist if attr != "*")
+    return [module for module in names if module not in sys.modules]
+
+
+def _import(name, *args, **kwargs):
+    """
+    Replacement of `__import__` timing the modules it loads.
+    """
+    orig = _ORIG["import"]
+    globals_ = args[0] if args else kwargs.get("globals")
+    fromlist = args[2] if len(args) > 2 else kwargs.get("fromlist")
+    level = args[3] if len(args) > 3 else kwargs.get("level", 0)
+    targets = _targets(name, globals_, fromlist, level)
+    if not targets:
+        return orig(name, *args, **kwargs)
+    _STACK.append(0.0)
+    t0 = time()
+    try:
+        return orig(name, *args, **kwargs)
+    finally:
+        elapsed = time() - t0
+        nested = _STACK.pop()
+        if _STACK:
+            _STACK[-1] += elapsed
+        loaded = [module for module in targets if module in sys.modules]
+        if loaded:
+            entry = _IMPORTS.setdefault(", ".join(loaded), [0.0, 0.0])
+            entry[0] += elapsed
+            entry[1] += elapsed - nested
+        if "cmdset" not in _ORIG and _CMDSET_MODULE in sys.modules:
+            _patch_cmdset()
+
+
+def _patch_cmdset():
+    """
+    Time the creation of cmdsets.
+    """
+    cmdset_class = getattr(sys.modules[_CMDSET_MODULE], "CmdSet", None)
+    if cmdset_class is None:
+        # still being imported
+        return
+    orig = _ORIG["cmdset"] = cmdset_class.__init__
+
+    def __init__(self, *args, **kwargs):
+        t0 = time()
+        try:
+            orig(self, *args, **kwargs)
+        finally:
+            cls = self.__class__
+            entry = _CMDSETS.setdefault("%s.%s" % (cls.__module__, cls.__name__), [0, 0.0])
+            entry[0] += 1
+            entry[1] += time() - t0
+
+    cmdset_class.__init__ = __init__
+
+
+def start():
+    """
+    Start profiling, if the `STARTUP_PROFILE` environment variable is
+    set. Called first thing by `server/conf/settings.py`.
+
+    Returns:
+        started (bool): If the profiler was started.
+
+    """
+    if _ENABLED[0] or not os.environ.get(ENVIRONMENT_VARIABLE):
+        return False
+    _ENABLED[0] = True
+    _T0[0] = time()
+    _ORIG["import"] = builtins.__import__
+    builtins.__import__ = _import
+    if _CMDSET_MODULE in sys.modules:
+        _patch_cmdset()
+    return True
+
+
+def stop():
+    """
+    Stop profiling and remove the patches.
+    """
+    if not _ENABLED[0]:
+        return
+    _ENABLED[0] = False
+    builtins.__import__ = _ORIG.pop("import")
+    if "cmdset" in _ORIG:
+        sys.modules[_CMDSET_MODULE].CmdSet.__init__ = _ORIG.pop("cmdset")
+
+
+def timed(name):
+    """
+    Decorator recording how long a startup hook takes, while the
+    profiler is running.
+
+    Args:
+        name (str): Name of the hook in the report.
+
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _ENABLED[0]:
+                return func(*args, **kwargs)
+            t0 = time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _HOOKS.append((name, time() - t0))
+        return wrapper
+    return decorator
+
+
+def report(process):
+    """
+    Get the results so far.
+
+    Args:
+        process (str): `"server"` or `"portal"`.
+
+    Returns:
+        report (str): The report.
+
+    """
+    from world import lazyimport
+
+    lines = ["Startup profile of the %s (pid %i), %.2fs after settings were loaded." % (
+        process, os.getpid(), time() - _T0[0]), ""]
+
+    total = sum(entry[1] for entry in _IMPORTS.values())
+    lines.append("Imports: %i statements loading modules, %.3fs in total." % (
+        len(_IMPORTS), total))
+    for title, column in (("Slowest with what they import", 0),
+                          ("Slowest by themselves", 1)):
+        lines.append("  %s:" % title)
+        for module, entry in sorted(_IMPORTS.items(), key=lambda item: -item[1][column]
+                                    )[:_REPORT_LINES]:
+            lines.append("    %8.3fs  %s" % (entry[column], module))
+    lines.append("")
+
+    lines.append("Hooks:")
+    for name, seconds in _HOOKS:
+        lines.append("    %8.3fs  %s" % (seconds, name))
+    if not _HOOKS:
+        lines.append("    (none ran)")
+    lines.append("")
+
+    lines.append("Cmdsets created: %i, %.3fs in total." % (
+        sum(entry[0] for entry in _CMDSETS.values()),
+        sum(entry[1] for entry in _CMDSETS.values())))
+    for path, (count, seconds) in sorted(_CMDSETS.items(), key=lambda item: -item[1][1]):
+        lines.append("    %8.3fs  %5i x %s" % (seconds, count, path))
+    lines.append("")
+
+    lazy = lazyimport.stats()
+    lines.append("Lazy imports: %i modules, %i imported." % (lazy["deferred"], lazy["imported"]))
+    for path in sorted(lazy["modules"]):
+        seconds = lazy["modules"][path]
+        lines.append("    %9s  %s" % ("%.3fs" % seconds if seconds is not None else "unused",
+                                      path))
+    return "\n".join(lines) + "\n"
+
+
+def write_report(process):
+    """
+    Write the report to the log directory and stop profiling.
+
+    Args:
+        process (str): `"server"` or `"portal"`.
+
+    Returns:
+        path (str or None): The report's file, or None if the profiler
+            wasn't running.
+
+    """
+    if not _ENABLED[0]:
+        return None
+    from django.conf import settings
+    from evennia.utils import logger
+
+    text = report(process)
+    stop()
+    path = os.path.join(settings.LOG_DIR, "startup_profile_%s.txt" % process)
+    try:
+        with open(path, "w") as report_file:
+            report_file.write(text)
+    except IOError:
+        logger.log_trace("Could not write the startup profile to %s." % path)
+        return None
+    logger.log_info("Startup profile written to %s." % path)
+    return path
+
+
+def schedule_report(process):
+    """
+    Write the report `STARTUP_PROFILE_REPORT_DELAY` seconds from now,
+    if the profiler is running.
+
+    Args:
+        process (str): `"server"` or `"portal"`.
+
+    """
+    if _ENABLED[0]:
+        from django.conf import settings
+        from twisted.internet import reactor
+        reactor.callLater(getattr(settings, "STARTUP_PROFILE_REPORT_DELAY", 10),
+                          write_report, process)
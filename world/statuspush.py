@@ -0,0 +1,105 @@
+"""
+Status push
+
+Instead of polling (the `status` input function) or reading prompts,
+the webclient can subscribe to fields of its character's status with
+the `status_subscribe` input function (see `server/conf/inputfuncs.py`).
+It then gets the current values once, and afterwards only the fields
+that changed:
+
+    ["status", [], {"hp": 7}]
+
+`typeclasses.characters.Character` calls `mark()` whenever one of its
+fields may have changed (its `hp` Attribute is set, it moves, something
+enters, leaves or is renamed in its inventory). Marks are collected
+until the current reactor tick is done, so a command changing many
+things (like `get all`) sends one message. Then each subscribed
+character reads its fields once and sends each session the fields that
+differ from what that session was last sent.
+
+"""
+from twisted.internet import reactor
+
+# character id: [character, set of fields]
+_DIRTY = {}
+_PUSH_CALL = [None]
+_STATS = {"marks": 0, "pushes": 0, "messages": 0, "fields": 0, "unchanged": 0}
+
+
+def mark(character, fields):
+    """
+    Note that fields of a subscribed character may have changed, to
+    push them at the end of this reactor tick.
+
+    Args:
+        character (Character): The character.
+        fields (iterable): The fields that may have changed.
+
+    """
+    _STATS["marks"] += 1
+    entry = _DIRTY.get(character.id)
+    if entry is None:
+        _DIRTY[character.id] = [character, set(fields)]
+    else:
+        entry[1].update(fields)
+    if not (_PUSH_CALL[0] and _PUSH_CALL[0].active()):
+        _PUSH_CALL[0] = reactor.callLater(0, push)
+
+
+def push():
+    """
+    Send the changed fields of all marked characters to their
+    subscribed sessions.
+
+    Returns:
+        nmessages (int): How many messages were sent.
+
+    """
+    dirty = list(_DIRTY.values())
+    _DIRTY.clear()
+    nmessages = 0
+    for character, fields in dirty:
+        sent = character.push_status(fields)
+        _STATS["pushes"] += 1
+        nmessages += sent
+        if not sent:
+            _STATS["unchanged"] += 1
+    _STATS["messages"] += nmessages
+    return nmessages
+
+
+def diff(values, sent):
+    """
+    Get the values that differ from those sent before, and remember them
+    as sent.
+
+    Args:
+        values (dict): The current values of some fields.
+        sent (dict): The values last sent for each field. Updated.
+
+    Returns:
+        delta (dict): The fields whose values changed.
+
+    """
+    delta = {}
+    for field, value in values.items():
+        if field not in sent or sent[field] != value:
+            delta[field] = sent[field] = value
+    _STATS["fields"] += len(delta)
+    return delta
+
+
+def stats():
+    """
+    Get push statistics.
+
+    Returns:
+        stats (dict): With keys `marks` (changes noted), `pushes`
+            (characters pushed), `unchanged` (of those, how many had
+            nothing to send), `messages` and `fields` (sent in total)
+            and `pending` (characters waiting for the end of the tick).
+
+    """
+    result = dict(_STATS)
+    result["pending"] = len(_DIRTY)
+    return result
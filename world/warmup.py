@@ -0,0 +1,199 @@
+"""
+Cache warm-up
+
+After the server starts, objects are loaded from the database the
+first time something needs them: the first player entering an area
+triggers queries for every room, its contents, and each object's
+Attributes and tags, one at a time.
+
+`run()` loads the objects of the typeclasses in `WARMUP_TYPECLASSES`
+(and their child typeclasses) up front, with a few large queries:
+
+ - the objects, in batches, which puts them in Evennia's object cache
+   (the idmapper);
+ - all their Attributes, and all their tags, aliases and permissions,
+   which fill each object's attribute and tag handler caches;
+ - their locks are parsed (and compiled, see `world/lockcache.py`).
+
+It is run from `server/conf/at_server_startstop.py` on cold starts and
+reloads, if `WARMUP_ENABLED` is set. With `WARMUP_THREAD` set it runs
+in a background thread, so the server and logins are not held up;
+objects are then loaded normally if needed before it is done.
+
+"""
+from collections import defaultdict
+from time import time
+from django.conf import settings
+from django.db import connection
+from twisted.internet import threads
+from evennia.objects.models import ObjectDB
+from evennia.utils import logger
+from evennia.utils.utils import class_from_module
+
+_TYPECLASSES = getattr(settings, "WARMUP_TYPECLASSES",
+                       ("typeclasses.rooms.Room", "typeclasses.exits.Exit"))
+_BATCH_SIZE = getattr(settings, "WARMUP_BATCH_SIZE", 500)
+
+_STATS = {"runs": 0, "objects": 0, "attributes": 0, "tags": 0, "duration": 0.0,
+          "running": False}
+
+
+def typeclass_paths(typeclasses=_TYPECLASSES):
+    """
+    Get the paths of typeclasses and all their child typeclasses.
+
+    Args:
+        typeclasses (iterable): Python paths of typeclasses.
+
+    Returns:
+        paths (set): The paths, including those of loaded subclasses.
+
+    """
+    paths = set()
+    classes = []
+    for path in typeclasses:
+        try:
+            classes.append(class_from_module(path))
+        except ImportError:
+            logger.log_err("Warm-up: could not import typeclass %s." % path)
+    while classes:
+        cls = classes.pop()
+        path = "%s.%s" % (cls.__module__, cls.__name__)
+        if path not in paths:
+            paths.add(path)
+            classes.extend(cls.__subclasses__())
+    return paths
+
+
+def _fill(handler, pairs):
+    """
+    Put `(key, category, obj)` into an attribute or tag handler's cache
+    and mark it complete, so it doesn't query the database.
+    """
+    if handler._cache_complete:
+        # already loaded (and maybe changed) since the warm-up started
+        return
+    for key, category, obj in pairs:
+        handler._setcache(key, category, obj)
+    handler._cache_complete = True
+
+
+def load_objects(ids):
+    """
+    Load objects with their Attributes and tags, in one query each.
+
+    Args:
+        ids (list): Object ids.
+
+    Returns:
+        loaded (tuple): `(nobjects, nattributes, ntags)` loaded.
+
+    """
+    objects = dict((obj.id, obj) for obj in ObjectDB.objects.filter(id__in=ids))
+
+    attributes = defaultdict(list)
+    through = ObjectDB.db_attributes.through
+    for link in through.objects.filter(objectdb_id__in=ids).select_related("attribute"):
+        attr = link.attribute
+        if attr.db_attrtype is None:
+            attributes[link.objectdb_id].append((attr.db_key, attr.db_category, attr))
+    tags = defaultdict(list)
+    through = ObjectDB.db_tags.through
+    for link in through.objects.filter(objectdb_id__in=ids).select_related("tag"):
+        tag = link.tag
+        tags[(link.objectdb_id, tag.db_tagtype)].append((tag.db_key, tag.db_category, tag))
+
+    nattributes = ntags = 0
+    for obj_id, obj in objects.items():
+        obj_attributes = attributes.get(obj_id, ())
+        _fill(obj.attributes, obj_attributes)
+        nattributes += len(obj_attributes)
+        for handler, tagtype in ((obj.tags, None), (obj.aliases, "alias"),
+                                 (obj.permissions, "permission")):
+            obj_tags = tags.get((obj_id, tagtype), ())
+            _fill(handler, obj_tags)
+            ntags += len(obj_tags)
+        # parses (and compiles) the locks
+        obj.locks.get()
+    return len(objects), nattributes, ntags
+
+
+def run(typeclasses=_TYPECLASSES):
+    """
+    Load the objects of some typeclasses, with their Attributes, tags
+    and locks.
+
+    Args:
+        typeclasses (iterable, optional): Python paths of typeclasses.
+            Defaults to `WARMUP_TYPECLASSES`.
+
+    Returns:
+        nobjects (int): How many objects were loaded.
+
+    """
+    t0 = time()
+    _STATS["running"] = True
+    nobjects = nattributes = ntags = 0
+    try:
+        ids = list(ObjectDB.objects.filter(
+            db_typeclass_path__in=typeclass_paths(typeclasses)).values_list("id", flat=True))
+        for start in range(0, len(ids), _BATCH_SIZE):
+            loaded = load_objects(ids[start:start + _BATCH_SIZE])
+            nobjects += loaded[0]
+            nattributes += loaded[1]
+            ntags += loaded[2]
+    except Exception:
+        logger.log_trace("Warm-up failed after %i objects." % nobjects)
+    finally:
+        _STATS["running"] = False
+    duration = time() - t0
+    _STATS["runs"] += 1
+    _STATS["objects"] = nobjects
+    _STATS["attributes"] = nattributes
+    _STATS["tags"] = ntags
+    _STATS["duration"] = duration
+    logger.log_info("Warm-up: loaded %i objects, %i Attributes and %i tags in %.2fs." % (
+        nobjects, nattributes, ntags, duration))
+    return nobjects
+
+
+def _run_in_thread(typeclasses):
+    try:
+        return run(typeclasses)
+    finally:
+        # the thread's own database connection
+        connection.close()
+
+
+def start(typeclasses=_TYPECLASSES):
+    """
+    Warm up the caches, in a background thread if `WARMUP_THREAD` is
+    set.
+
+    Args:
+        typeclasses (iterable, optional): Python paths of typeclasses.
+            Defaults to `WARMUP_TYPECLASSES`.
+
+    Returns:
+        result (int or Deferred): The number of objects loaded, or a
+            Deferred firing with it when run in a thread.
+
+    """
+    if getattr(settings, "WARMUP_THREAD", False):
+        deferred = threads.deferToThread(_run_in_thread, typeclasses)
+        deferred.addErrback(logger.log_trace)
+        return deferred
+    return run(typeclasses)
+
+
+def stats():
+    """
+    Get warm-up statistics.
+
+    Returns:
+        stats (dict): With keys `runs`, `running` and, for the last
+            run, `objects`, `attributes`, `tags` (loaded) and
+            `duration` (seconds).
+
+    """
+    return dict(_STATS)
@@ -0,0 +1,164 @@
+"""
+Attribute write-behind
+
+Every `obj.db.x = value` pickles the value and UPDATEs its Attribute
+row right away. Code updating many Attributes in quick succession (a
+round of combat for 50 NPCs) causes hundreds of small writes, and the
+same Attribute is often written several times within one round.
+
+Objects whose typeclass sets `write_behind` (see
+`typeclasses.objects.Object`) instead only change the Attribute in
+memory and mark it dirty here, so reads (`obj.db.x`,
+`obj.attributes.get`) always see the latest value. Dirty Attributes
+are written in one transaction, with one statement for all of them,
+every `ATTRIBUTE_WRITE_BEHIND_INTERVAL` seconds, as soon as
+`ATTRIBUTE_WRITE_BEHIND_BATCH_SIZE` are waiting, on `flush()`, and
+always when the server stops or reloads (from
+`server/conf/at_server_startstop.py`). Writing an Attribute again
+before it was flushed costs nothing more: the writes are coalesced.
+
+Only plain updates of existing Attributes are deferred. Creating an
+Attribute, or setting one with a lockstring, as a string attribute or
+with an access check, is written right away as usual, as are in-place
+changes of stored lists and dicts (`obj.db.inventory.append(x)`).
+
+The trade-offs: if the server crashes, writes since the last flush are
+lost, and database queries on Attribute values (such as
+`search_object_attribute`) don't see unflushed values.
+
+"""
+from time import time
+from django.conf import settings
+from django.db import connection, transaction
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+from evennia.typeclasses.attributes import Attribute
+from evennia.utils import logger
+from evennia.utils.dbserialize import to_pickle
+
+_FLUSH_INTERVAL = getattr(settings, "ATTRIBUTE_WRITE_BEHIND_INTERVAL", 2)
+_BATCH_SIZE = getattr(settings, "ATTRIBUTE_WRITE_BEHIND_BATCH_SIZE", 1000)
+
+# attribute id: (attribute, object id)
+_DIRTY = {}
+_STATS = {"writes": 0, "coalesced": 0, "flushes": 0, "rows": 0,
+          "last_flush": None, "last_duration": 0.0}
+_LOOP = [None]
+_FLUSH_CALL = [None]
+
+
+def write(obj, attr, value):
+    """
+    Set the value of an Attribute in memory, to be written on the next
+    flush.
+
+    Args:
+        obj (Object): The object the Attribute is on.
+        attr (Attribute): The stored Attribute.
+        value (any): The new value.
+
+    """
+    attr.db_value = to_pickle(value)
+    _STATS["writes"] += 1
+    if attr.id in _DIRTY:
+        _STATS["coalesced"] += 1
+        return
+    _DIRTY[attr.id] = (attr, obj.id)
+    if len(_DIRTY) >= _BATCH_SIZE and not (_FLUSH_CALL[0] and _FLUSH_CALL[0].active()):
+        # after the writing code is done
+        _FLUSH_CALL[0] = reactor.callLater(0, flush)
+
+
+def discard(obj):
+    """
+    Drop the unwritten Attributes of an object, such as when it's
+    deleted.
+
+    Args:
+        obj (Object): The object.
+
+    """
+    for attr_id in [attr_id for attr_id, (_, obj_id) in _DIRTY.items() if obj_id == obj.id]:
+        del _DIRTY[attr_id]
+
+
+def dirty_objects():
+    """
+    Get the objects with unwritten Attributes.
+
+    Returns:
+        ids (set): Their object ids.
+
+    """
+    return set(obj_id for _, obj_id in _DIRTY.values())
+
+
+def flush(obj=None):
+    """
+    Write dirty Attributes to the database, in one transaction.
+
+    Args:
+        obj (Object, optional): Only write the Attributes of this
+            object. Defaults to writing all.
+
+    Returns:
+        nattributes (int): How many Attributes were written.
+
+    """
+    if obj is None:
+        dirty = list(_DIRTY.values())
+        _DIRTY.clear()
+    else:
+        dirty = [entry for entry in _DIRTY.values() if entry[1] == obj.id]
+        for attr, _ in dirty:
+            del _DIRTY[attr.id]
+    if not dirty:
+        return 0
+    t0 = time()
+    field = Attribute._meta.get_field("db_value")
+    sql = "UPDATE %s SET %s = %%s WHERE %s = %%s" % (
+        connection.ops.quote_name(Attribute._meta.db_table),
+        connection.ops.quote_name(field.column),
+        connection.ops.quote_name(Attribute._meta.pk.column))
+    try:
+        rows = [(field.get_db_prep_save(attr.db_value, connection), attr.id)
+                for attr, _ in dirty]
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.executemany(sql, rows)
+    except Exception:
+        logger.log_trace("Could not write %i Attributes." % len(dirty))
+        # try again next time, unless written again meanwhile
+        for attr, obj_id in dirty:
+            _DIRTY.setdefault(attr.id, (attr, obj_id))
+        return 0
+    _STATS["flushes"] += 1
+    _STATS["rows"] += len(dirty)
+    _STATS["last_flush"] = t0
+    _STATS["last_duration"] = time() - t0
+    return len(dirty)
+
+
+def start():
+    """
+    Start flushing every `ATTRIBUTE_WRITE_BEHIND_INTERVAL` seconds.
+    """
+    if _LOOP[0] is None:
+        _LOOP[0] = LoopingCall(flush)
+        _LOOP[0].start(_FLUSH_INTERVAL, now=False)
+
+
+def stats():
+    """
+    Get write-behind statistics.
+
+    Returns:
+        stats (dict): With keys `dirty` (Attributes waiting), `writes`
+            (values set), `coalesced` (of those, how many replaced an
+            unwritten value), `flushes`, `rows` (total written),
+            `last_flush` (time stamp) and `last_duration` (seconds).
+
+    """
+    result = dict(_STATS)
+    result["dirty"] = len(_DIRTY)
+    return result
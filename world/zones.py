@@ -0,0 +1,403 @@
+"""
+Zones
+
+A zone is a group of rooms, marked by a tag in the `zone` category on
+each room (`@tag room = forest:zone`). Zones let the server keep only
+the parts of the world that are in use in memory:
+
+ - when the first puppeted character enters a room of a zone that is
+   not loaded, all its rooms, their contents (exits, objects, NPCs)
+   and the contents of those are loaded with a few bulk queries,
+   Attributes and tags included (see `world.warmup.load_objects`),
+   instead of one by one as they are looked at;
+ - every `ZONE_CHECK_INTERVAL` seconds, loaded zones without puppeted
+   characters for `ZONE_IDLE_TIME` seconds are evicted: their objects
+   and Attributes are dropped from Evennia's object cache (the
+   idmapper), to be loaded again from the database when needed.
+
+Evicting also drops what refers to the evicted instances: the exit
+cmdsets of its rooms and of the rooms with exits into them, the cached
+cmdset merges, and the cached location, destination and home of the
+objects still in memory.
+
+A zone is not evicted while anything in it holds state that is only
+in memory: a connected session, Attributes not yet written (see
+`world.writebehind`), non-persistent Attributes (`ndb`) or an active
+script. It is checked again on the next round.
+
+What belongs to a zone is worked out from the object cache: its rooms
+and everything cached whose location (or the location's location)
+is one of them. An item carried out of the zone leaves it.
+
+`memory()` estimates the memory used by a zone's objects, their
+Attributes, handlers and `ndb` data; objects referenced from outside
+the zone are not counted.
+
+To load rooms only through their zones, leave them out of
+`WARMUP_TYPECLASSES`. Rooms without a zone tag are never evicted.
+
+"""
+from sys import getsizeof
+from time import time
+from django.conf import settings
+from django.db.models import Model
+from twisted.internet.task import LoopingCall
+from evennia.objects.models import ObjectDB
+from evennia.scripts.models import ScriptDB
+from evennia.utils import logger
+from world import exitgraph, warmup, writebehind
+from world.lazyimport import lazy_import
+
+cmdparser = lazy_import("server.conf.cmdparser")
+mergecache = lazy_import("commands.mergecache")
+
+ZONE_CATEGORY = "zone"
+
+_IDLE_TIME = getattr(settings, "ZONE_IDLE_TIME", 600)
+_CHECK_INTERVAL = getattr(settings, "ZONE_CHECK_INTERVAL", 60)
+_BATCH_SIZE = getattr(settings, "WARMUP_BATCH_SIZE", 500)
+# levels of contents loaded below the rooms
+_DEPTH = 2
+# how deep `memory()` follows containers and handlers
+_SIZE_DEPTH = 6
+# relations whose cached instances must not outlive an eviction
+_RELATIONS = ("db_location", "db_destination", "db_home")
+
+# zone name: Zone
+_ZONES = {}
+# room id: zone name, for the rooms of loaded zones
+_ROOMS = {}
+_STATS = {"loads": 0, "evictions": 0, "held": 0, "flushed": 0}
+_LOOP = [None]
+
+
+class Zone(object):
+    """
+    The state of one zone.
+
+    """
+
+    def __init__(self, name):
+        """
+        Args:
+            name (str): The zone's tag.
+
+        """
+        self.name = name
+        self.loaded = False
+        self.room_ids = set()
+        self.nobjects = 0
+        self.last_active = time()
+        self.loads = 0
+        self.evictions = 0
+        # why the last eviction attempt was refused
+        self.held = None
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), _BATCH_SIZE):
+        yield ids[start:start + _BATCH_SIZE]
+
+
+def zone_of(room):
+    """
+    Get the zone of a room.
+
+    Args:
+        room (Object): The room.
+
+    Returns:
+        name (str or None): Its zone, if it is in one.
+
+    """
+    name = room.tags.get(category=ZONE_CATEGORY)
+    if isinstance(name, list):
+        # in several zones; use one, consistently
+        name = min(name)
+    return name
+
+
+def load(name):
+    """
+    Load the rooms of a zone and their contents, with their Attributes
+    and tags.
+
+    Args:
+        name (str): The zone.
+
+    Returns:
+        nobjects (int): How many objects were loaded.
+
+    """
+    t0 = time()
+    zone = _ZONES.get(name)
+    if zone is None:
+        zone = _ZONES[name] = Zone(name)
+    room_ids = set(ObjectDB.objects.filter(
+        db_tags__db_key=name, db_tags__db_category=ZONE_CATEGORY,
+        db_tags__db_tagtype=None).values_list("id", flat=True))
+    ids = set(room_ids)
+    level = room_ids
+    for _ in range(_DEPTH):
+        contents = set()
+        for chunk in _chunks(level):
+            contents.update(ObjectDB.objects.filter(
+                db_location_id__in=chunk).values_list("id", flat=True))
+        level = contents.difference(ids)
+        ids.update(level)
+    nobjects = 0
+    for chunk in _chunks(ids):
+        nobjects += warmup.load_objects(chunk)[0]
+
+    for room_id in zone.room_ids.difference(room_ids):
+        _ROOMS.pop(room_id, None)
+    zone.room_ids = room_ids
+    for room_id in room_ids:
+        _ROOMS[room_id] = name
+    zone.loaded = True
+    zone.nobjects = nobjects
+    zone.last_active = time()
+    zone.loads += 1
+    _STATS["loads"] += 1
+    logger.log_info("Zone %s: loaded %i rooms and %i objects in %.2fs." % (
+        name, len(room_ids), nobjects, time() - t0))
+    return nobjects
+
+
+def visited(room):
+    """
+    Note that a puppeted character is in a room, loading the room's
+    zone if it isn't. Called by `typeclasses.rooms.Room`.
+
+    Args:
+        room (Room): The room.
+
+    """
+    name = _ROOMS.get(room.id) or zone_of(room)
+    if not name:
+        return
+    zone = _ZONES.get(name)
+    if zone is None or not zone.loaded:
+        load(name)
+    else:
+        zone.last_active = time()
+
+
+def members():
+    """
+    Sort the cached objects into the loaded zones.
+
+    Returns:
+        members (dict): Mapping zone names to lists of objects.
+
+    """
+    cached = dict((obj.id, obj) for obj in ObjectDB.get_all_cached_instances())
+    result = dict((name, []) for name, zone in _ZONES.items() if zone.loaded)
+    for obj in cached.values():
+        top = obj
+        for _ in range(_DEPTH + 1):
+            if top.db_location_id is None or top.id in _ROOMS:
+                break
+            parent = cached.get(top.db_location_id)
+            if parent is None:
+                top = None
+                break
+            top = parent
+        name = _ROOMS.get(top.id) if top is not None else None
+        if name in result:
+            result[name].append(obj)
+    return result
+
+
+def _holder(objects):
+    """
+    Get why a zone's objects can't be dropped from memory, if they
+    can't.
+    """
+    dirty = writebehind.dirty_objects()
+    for obj in objects:
+        if obj.sessions.count():
+            return "%s (#%i) is puppeted" % (obj.key, obj.id)
+        if obj.id in dirty:
+            return "%s (#%i) has unwritten Attributes" % (obj.key, obj.id)
+        if obj.nattributes.all():
+            return "%s (#%i) has ndb Attributes" % (obj.key, obj.id)
+    for chunk in _chunks(obj.id for obj in objects):
+        script = ScriptDB.objects.filter(db_obj_id__in=chunk, db_is_active=True).first()
+        if script:
+            return "script %s runs on #%i" % (script.key, script.db_obj_id)
+    return None
+
+
+def _forget_references(evicted):
+    """
+    Make the objects still cached forget the evicted instances they
+    are related to (their location, destination or home), so they load
+    the current ones instead of moving things into a stale copy.
+    """
+    if not evicted:
+        return
+    cache_names = [ObjectDB._meta.get_field(name).get_cache_name() for name in _RELATIONS]
+    for obj in ObjectDB.get_all_cached_instances():
+        for cache_name in cache_names:
+            related = obj.__dict__.get(cache_name)
+            if related is not None and related.id in evicted:
+                del obj.__dict__[cache_name]
+
+
+def evict(name, objects=None):
+    """
+    Drop a zone's objects from memory, unless something holds them.
+
+    Args:
+        name (str): The zone.
+        objects (list, optional): Its cached objects, from `members()`.
+
+    Returns:
+        nobjects (int or None): How many objects were dropped, or None
+            if the zone was held (see `stats()`) or not loaded.
+
+    """
+    zone = _ZONES.get(name)
+    if zone is None or not zone.loaded:
+        return None
+    if objects is None:
+        objects = members().get(name, [])
+    zone.held = _holder(objects)
+    if zone.held:
+        _STATS["held"] += 1
+        return None
+    # the exit commands of these rooms (and of those leading here) hold
+    # the instances being dropped, as do the merged cmdsets using them
+    exitgraph.forget_rooms(zone.room_ids)
+    mergecache.invalidate()
+    cmdparser.clear_cache()
+    evicted = set()
+    for obj in objects:
+        for attr in list(obj.attributes._cache.values()):
+            if attr is not None:
+                attr.flush_from_cache()
+        obj.flush_from_cache()
+        if ObjectDB.get_cached_instance(obj.id) is None:
+            evicted.add(obj.id)
+    _forget_references(evicted)
+    nobjects = len(evicted)
+    for room_id in zone.room_ids:
+        _ROOMS.pop(room_id, None)
+    zone.loaded = False
+    zone.evictions += 1
+    _STATS["evictions"] += 1
+    _STATS["flushed"] += nobjects
+    logger.log_info("Zone %s: evicted %i of %i objects." % (name, nobjects, len(objects)))
+    return nobjects
+
+
+def check():
+    """
+    Evict the loaded zones no puppeted character has been in for
+    `ZONE_IDLE_TIME` seconds.
+
+    Returns:
+        evicted (list): The names of the evicted zones.
+
+    """
+    now = time()
+    evicted = []
+    for name, objects in members().items():
+        zone = _ZONES[name]
+        if any(obj.sessions.count() for obj in objects):
+            zone.last_active = now
+        elif now - zone.last_active >= _IDLE_TIME and evict(name, objects) is not None:
+            evicted.append(name)
+    return evicted
+
+
+def start():
+    """
+    Start checking for idle zones every `ZONE_CHECK_INTERVAL` seconds,
+    unless `ZONE_IDLE_TIME` is 0.
+    """
+    if _LOOP[0] is None and _IDLE_TIME:
+        _LOOP[0] = LoopingCall(check)
+        _LOOP[0].start(_CHECK_INTERVAL, now=False)
+
+
+def _sizeof(value, seen, depth=0):
+    """
+    Estimate the memory used by a value and what it contains, counting
+    everything in `seen` only once. Other database objects are not
+    followed.
+    """
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = getsizeof(value)
+    if depth >= _SIZE_DEPTH:
+        return size
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += _sizeof(key, seen, depth + 1) + _sizeof(item, seen, depth + 1)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += _sizeof(item, seen, depth + 1)
+    elif hasattr(value, "__dict__") and not isinstance(value, type) and (
+            depth == 0 or not isinstance(value, Model)):
+        size += _sizeof(value.__dict__, seen, depth + 1)
+    return size
+
+
+def memory(name, objects=None):
+    """
+    Estimate the memory used by a zone's cached objects.
+
+    Args:
+        name (str): The zone.
+        objects (list, optional): Its cached objects, from `members()`.
+
+    Returns:
+        nbytes (int): The estimate, in bytes.
+
+    """
+    if objects is None:
+        objects = members().get(name, [])
+    seen = set()
+    nbytes = 0
+    for obj in objects:
+        nbytes += _sizeof(obj, seen)
+        for attr in obj.attributes._cache.values():
+            if attr is not None:
+                nbytes += _sizeof(attr, seen)
+    return nbytes
+
+
+def stats(with_memory=False):
+    """
+    Get zone statistics.
+
+    Args:
+        with_memory (bool, optional): Also estimate the memory used by
+            each zone, which walks all its objects.
+
+    Returns:
+        stats (dict): With keys `loads`, `evictions`, `held` (eviction
+            attempts refused), `flushed` (objects evicted) and `zones`,
+            mapping each known zone to a dict with keys `loaded`,
+            `rooms`, `objects` (cached now), `idle` (seconds since a
+            puppeted character was in it), `loads`, `evictions`, `held`
+            (why it was last kept) and, if asked for, `bytes`.
+
+    """
+    result = dict(_STATS)
+    now = time()
+    zone_members = members()
+    zones = {}
+    for name, zone in _ZONES.items():
+        objects = zone_members.get(name, [])
+        zones[name] = {"loaded": zone.loaded, "rooms": len(zone.room_ids),
+                       "objects": len(objects), "idle": now - zone.last_active,
+                       "loads": zone.loads, "evictions": zone.evictions, "held": zone.held}
+        if with_memory:
+            zones[name]["bytes"] = memory(name, objects)
+    result["zones"] = zones
+    return result